@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -52,6 +53,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'crm.middleware.ReplicaPinningMiddleware',
+    'crm.middleware.RateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'alx-backend-graphql_crm.urls'
@@ -78,15 +81,187 @@ WSGI_APPLICATION = 'alx-backend-graphql_crm.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# SQLite production profile (see crm/db/backends/sqlite3/base.py):
+# WAL lets readers run alongside the single writer, pragmas are applied on
+# connect, connections are reused across requests and atomic blocks start
+# with BEGIN IMMEDIATE so writers queue instead of failing on lock upgrades.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    # Durable at WAL checkpoints; a power loss can only drop the last commits
+    'synchronous': 'normal',
+    # Negative values are KiB: 64 MiB page cache per connection
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'busy_timeout': 5000,
+    'temp_store': 'memory',
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'crm.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': SQLITE_PRAGMAS,
+        },
+    }
+}
+
+# Read replicas: GraphQL queries read from the aliases in CRM_READ_REPLICAS
+# (round-robin), mutations and Celery writes go to 'default' (see crm/routers.py).
+# Two local SQLite files can stand in for a primary/replica pair:
+#
+#   DATABASES['replica'] = {
+#       **DATABASES['default'],
+#       'NAME': BASE_DIR / 'db_replica.sqlite3',
+#       'TEST': {'MIRROR': 'default'},
+#   }
+#   CRM_READ_REPLICAS = ['replica']
+#
+# and `python manage.py sync_sqlite_replicas` copies the primary into them.
+DATABASE_ROUTERS = ['crm.routers.ReplicaRouter']
+CRM_READ_REPLICAS = []
+# Seconds a client keeps reading from the primary after it wrote (> replica lag)
+CRM_REPLICA_PIN_SECONDS = 5
+
+# Shared by the web processes and Celery workers: batched events
+# (crm/batching.py) wait here for the worker that flushes them, and product
+# saves bump their cache version here. A process-local cache (CACHE_URL
+# 'locmem://') would strand events in the process that added them, so it only
+# suits a single process; manage.py test always uses one (crm/test_runner.py).
+CACHE_URL = os.environ.get('CACHE_URL', 'redis://localhost:6379/3')
+if CACHE_URL.startswith('locmem://'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        },
     }
+
+TEST_RUNNER = 'crm.test_runner.TestRunner'
+
+# Per-process product snapshot cache (crm/product_cache.py). Saves bump a
+# version key in the shared cache (CACHES) so every process drops its
+# snapshot; ttl bounds staleness when the bump is missed.
+CRM_PRODUCT_CACHE = {
+    'enabled': True,
+    'max_size': 1024,
+    'ttl': 30.0,
+}
+
+# Revenue analytics (crm/analytics.py): 'numpy' keeps order facts in memory
+# as NumPy columns (optional dependency), 'database' aggregates in SQL
+CRM_ANALYTICS = {
+    'engine': 'numpy',
+    'refresh_interval': 5.0,
+    'full_refresh_interval': 3600.0,
 }
 
 GRAPHENE = {
-    'SCHEMA': 'crm.schema.schema'
+    'SCHEMA': 'crm.schema.schema',
+    # Off: crm.views.GraphQLView opens the transactions (CRM_ATOMIC_MUTATIONS)
+    'ATOMIC_MUTATIONS': False,
+    'MIDDLEWARE': [
+        'crm.middleware.PrimaryForMutationsMiddleware',
+        'crm.middleware.LoaderResetMiddleware',
+    ],
+}
+
+# Run each GraphQL mutation in a transaction (BEGIN IMMEDIATE with the
+# profile above), except those in crm.views.NON_ATOMIC_MUTATIONS, which
+# commit in chunks
+CRM_ATOMIC_MUTATIONS = True
+
+# GraphQL endpoint used by the CRM cron jobs and Celery tasks
+CRM_GRAPHQL_ENDPOINT = 'http://localhost:8000/graphql'
+
+# Their gql client (crm/graphql_client.py) caches the endpoint's schema in
+# schema_cache for schema_ttl seconds instead of fetching it on every run
+CRM_GRAPHQL_CLIENT = {
+    'schema_cache': '/tmp/crm_graphql_schema.json',
+    'schema_ttl': 3600.0,
+}
+
+# Batched /graphql requests (a JSON array of operations): at most
+# `max_operations` per request; with `parallel_reads`, batches made only of
+# queries run on `workers` threads, each with its own database connection
+CRM_GRAPHQL_BATCH = {
+    'max_operations': 20,
+    'parallel_reads': False,
+    'workers': 4,
+}
+
+# /graphql response encoding (see crm/encoders.py): orjson when installed,
+# else the stdlib encoder. Responses of at least `min_size` bytes are
+# streamed gzipped to clients that accept it
+CRM_GRAPHQL_RESPONSES = {
+    'encoder': 'auto',
+    'compress': True,
+    'min_size': 1024,
+    'level': 1,
+}
+
+# Admission control for /graphql (see crm/ratelimit.py): each client (user,
+# API key or IP) has a token bucket of `burst` cost units refilled at `rate`
+# per second, and may have `concurrency` requests in flight. Past
+# `max_in_flight` requests overall, new ones are shed with a 429. Use the
+# 'redis' backend when several nodes serve the API.
+CRM_RATE_LIMIT = {
+    'enabled': True,
+    'backend': 'locmem',
+    'redis_url': 'redis://localhost:6379/1',
+    'rate': 100.0,
+    'burst': 2000,
+    'concurrency': 4,
+    'max_in_flight': 64,
+    'list_size': 20,
+    'list_sizes': {
+        'Query.allOrders': 250,
+        'Query.allCustomers': 250,
+        'Query.allProducts': 250,
+    },
+    'max_sizes': {
+        'Query.pendingOrderReminders': 1000,
+        'Query.customersBySegment': 1000,
+        'Query.search': 100,
+    },
+    'max_depth': 20,
+    'max_nodes': 5000,
+    'mutation_cost': 10,
+    'field_costs': {
+        'Query.search': 10,
+        'Query.revenueBreakdown': 20,
+    },
+}
+
+# Readiness probes behind /readyz (see crm/health.py)
+CRM_HEALTH = {
+    'ttl': 5.0,
+    'required': ['database', 'cache', 'schema'],
+    'broker_timeout': 1.0,
+}
+
+# Heartbeat cron job: readiness URL it polls and its latency history
+CRM_HEARTBEAT = {
+    'url': 'http://localhost:8000/readyz',
+    'timeout': 5.0,
+    'history_file': '/tmp/crm_heartbeat_history.json',
+    'history_size': 288,
+    'alert_factor': 3.0,
+}
+
+# JSON-lines log files of the CRM cron jobs and Celery tasks (see crm/joblog.py),
+# rotated by logrotate (see crm/README.md)
+CRM_JOB_LOG = {
+    'directory': '/tmp',
+    'buffer_size': 64 * 1024,
+    'flush_interval': 1.0,
+    'queue': False,
 }
 
 
@@ -134,10 +309,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Django Crontab Configuration
 # https://github.com/kraiz/django-crontab
 
-CRONJOBS = [
-    ('*/5 * * * *', 'crm.cron.log_crm_heartbeat'),
-    ('0 */12 * * *', 'crm.cron.update_low_stock'),
-]
+# The periodic jobs moved to CELERY_BEAT_SCHEDULE; run
+# `python manage.py crontab remove` once to drop the old crontab entries
+CRONJOBS = []
 
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
@@ -147,12 +321,189 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
+# Queues: run the slow ones on their own workers so a weekly report can't
+# hold up quick jobs, e.g.
+#   celery -A crm worker -Q default,notifications -n quick@%h
+#   celery -A crm worker -Q reports,exports -c 2 -n bulk@%h
+from kombu import Queue
+
+CELERY_TASK_DEFAULT_QUEUE = 'default'
+# Queues share the default direct exchange, so each needs its own routing key
+CELERY_TASK_QUEUES = [
+    Queue('default', routing_key='default'),
+    # Report generation and its shards
+    Queue('reports', routing_key='reports'),
+    # Bulk data movement: imports, exports and the order archive
+    Queue('exports', routing_key='exports'),
+    # Batched notifications (crm/batching.py)
+    Queue('notifications', routing_key='notifications'),
+]
+CELERY_TASK_ROUTES = {
+    'crm.tasks.generate_crm_report': {'queue': 'reports'},
+    'crm.tasks.generate_weekly_report': {'queue': 'reports'},
+    'crm.tasks.aggregate_report_shard': {'queue': 'reports'},
+    'crm.tasks.merge_weekly_report': {'queue': 'reports'},
+    'crm.tasks.archive_old_orders': {'queue': 'exports'},
+    'crm.tasks.clean_inactive_customers': {'queue': 'exports'},
+    'crm.tasks.rescore_rfm': {'queue': 'reports'},
+    'crm.tasks.flush_batch': {'queue': 'notifications'},
+    'crm.tasks.send_order_reminders': {'queue': 'notifications'},
+}
+
+# Workers reserve one task per process at a time, so a long task doesn't
+# sit on prefetched messages another worker could run
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Per-task limits. Time limits (seconds) need the prefork pool; the soft
+# limit raises SoftTimeLimitExceeded in the task, the hard one kills it.
+# Rate limits apply per worker. Long idempotent tasks are acknowledged
+# after they finish, so a crashed worker's task is redelivered.
+CELERY_TASK_ANNOTATIONS = {
+    'crm.tasks.generate_crm_report': {'rate_limit': '1/m', 'soft_time_limit': 300, 'time_limit': 360},
+    'crm.tasks.generate_weekly_report': {'rate_limit': '1/m', 'soft_time_limit': 60, 'time_limit': 90},
+    'crm.tasks.aggregate_report_shard': {'soft_time_limit': 600, 'time_limit': 660, 'acks_late': True},
+    'crm.tasks.merge_weekly_report': {'soft_time_limit': 300, 'time_limit': 360, 'acks_late': True},
+    'crm.tasks.archive_old_orders': {'soft_time_limit': 3000, 'time_limit': 3300},
+    'crm.tasks.prune_idempotency_keys': {'soft_time_limit': 600, 'time_limit': 660},
+    'crm.tasks.log_crm_heartbeat': {'soft_time_limit': 60, 'time_limit': 90},
+    'crm.tasks.update_low_stock': {'soft_time_limit': 600, 'time_limit': 660},
+    'crm.tasks.send_order_reminders': {'soft_time_limit': 1800, 'time_limit': 1860},
+    'crm.tasks.clean_inactive_customers': {'soft_time_limit': 1800, 'time_limit': 1860},
+    'crm.tasks.refresh_rfm_scores': {'soft_time_limit': 240, 'time_limit': 270},
+    'crm.tasks.rescore_rfm': {'soft_time_limit': 1800, 'time_limit': 1860},
+    # Not rate limited: batching already bounds how often it runs
+    'crm.tasks.flush_batch': {'soft_time_limit': 60, 'time_limit': 90},
+}
+
 # Celery Beat Schedule
 from celery.schedules import crontab
 
+# Jobs marked @exclusive in crm/tasks.py skip a run while the previous one
+# still holds the job's lock (CRM_JOB_LOCKS). `expires` drops runs no worker
+# picked up before the next one is due.
 CELERY_BEAT_SCHEDULE = {
+    'log-crm-heartbeat': {
+        'task': 'crm.tasks.log_crm_heartbeat',
+        'schedule': crontab(minute='*/5'),
+        'options': {'expires': 4 * 60},
+    },
+    # Reconciliation only: products are handled as their stock crosses the
+    # threshold (crm/low_stock.py)
+    'update-low-stock': {
+        'task': 'crm.tasks.update_low_stock',
+        'schedule': crontab(minute=0, hour='*/12'),
+        'options': {'expires': 6 * 3600},
+    },
+    'send-order-reminders': {
+        'task': 'crm.tasks.send_order_reminders',
+        'schedule': crontab(minute=0, hour=8),
+        'options': {'expires': 12 * 3600},
+    },
+    'clean-inactive-customers': {
+        'task': 'crm.tasks.clean_inactive_customers',
+        'schedule': crontab(minute=0, hour=2, day_of_week='sun'),
+        'options': {'expires': 12 * 3600},
+    },
     'generate-crm-report': {
         'task': 'crm.tasks.generate_crm_report',
         'schedule': crontab(day_of_week='mon', hour=6, minute=0),
     },
+    'archive-old-orders': {
+        'task': 'crm.tasks.archive_old_orders',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'generate-weekly-report': {
+        'task': 'crm.tasks.generate_weekly_report',
+        'schedule': crontab(day_of_week='mon', hour=6, minute=30),
+    },
+    'prune-idempotency-keys': {
+        'task': 'crm.tasks.prune_idempotency_keys',
+        'schedule': crontab(minute=15),
+    },
+    # Incremental: only customers whose orders changed since the last run
+    'refresh-rfm-scores': {
+        'task': 'crm.tasks.refresh_rfm_scores',
+        'schedule': crontab(minute='*/5'),
+        'options': {'expires': 4 * 60},
+    },
+    'rescore-rfm': {
+        'task': 'crm.tasks.rescore_rfm',
+        'schedule': crontab(hour=4, minute=0),
+        'options': {'expires': 12 * 3600},
+    },
+}
+
+# Locks of the periodic jobs (crm/locks.py): Redis, or lock files under
+# `directory` while Redis is unreachable. A lock expires after its ttl in
+# seconds, so ttls stay above the tasks' time limits.
+CRM_JOB_LOCKS = {
+    'backend': 'redis',
+    'redis_url': 'redis://localhost:6379/2',
+    'fallback': 'file',
+    'directory': '/tmp/crm_locks',
+    'ttl': 3600,
+    'ttls': {
+        'log_crm_heartbeat': 120,
+        'update_low_stock': 900,
+        'generate_crm_report': 600,
+        'refresh_rfm_scores': 300,
+        'prune_idempotency_keys': 900,
+        # Held while the chord is dispatched; the shards run after it
+        'generate_weekly_report': 120,
+    },
+}
+
+# Order archive (crm/archive.py): orders older than age_days move from the
+# hot Order table to ArchivedOrder, batch_size orders per transaction
+CRM_ORDER_ARCHIVE = {
+    'age_days': 365,
+    'batch_size': 1000,
+    'max_batches': None,
+    'pause': 0.05,
+}
+
+# Idempotency keys of order mutations (crm/idempotency.py): results are
+# replayed for `ttl` seconds, then pruned hourly by prune_idempotency_keys
+CRM_IDEMPOTENCY = {
+    'ttl': 24 * 3600,
+    'prune_batch_size': 5000,
+}
+
+# Event batches (crm/batching.py): events wait in Django's cache for
+# flush_after seconds, then up to max_size of them are handled by one task
+CRM_BATCHES = {
+    'stock_changes': {'flush_after': 2.0, 'max_size': 500},
+}
+
+# Low-stock tracking (crm/low_stock.py): products below their
+# low_stock_threshold (or `threshold`) are alerted on and restocked by
+# `restock_increment` units (None only alerts) by the stock_changes batch
+CRM_LOW_STOCK = {
+    'threshold': 10,
+    'restock_increment': 10,
+    'chunk_size': 500,
+}
+
+# Order status transitions (crm/order_status.py): orders read, updated and
+# logged per transaction by bulkUpdateOrderStatus
+CRM_ORDER_STATUS = {
+    'chunk_size': 500,
+}
+
+# Weekly report (crm/reports.py): orders are split into `shards` id ranges
+# that are aggregated in parallel (Celery chord or process pool) and merged
+CRM_REPORTS = {
+    'shards': 16,
+    'top_products': 20,
+    'cohort_weeks': 8,
+    'segments': {'repeat': 2, 'loyal': 5},
+    'output_dir': '/tmp',
+}
+
+# RFM scores and segments (crm/rfm.py): refresh_rfm_scores re-reads orders
+# updated since the watermark minus `overlap` seconds, `chunk_size`
+# customers per transaction; rescore_rfm recomputes the quintiles nightly
+CRM_RFM = {
+    'overlap': 60.0,
+    'chunk_size': 500,
 }
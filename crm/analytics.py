@@ -0,0 +1,353 @@
+"""
+CRM Analytics
+Revenue group-by and top-N queries over all orders (hot and archived).
+
+With NumPy installed and CRM_ANALYTICS['engine'] set to 'numpy', order
+facts are kept in memory as typed NumPy columns and refreshed
+incrementally from the updated_at watermark, so a query is a few
+vectorized passes instead of an ORM aggregation. Without NumPy the same
+queries run as database aggregations.
+"""
+
+import importlib.util
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek
+
+from crm import money
+from crm.models import ArchivedOrder, Order
+
+# NumPy is imported by load_numpy() on first use, so processes that never
+# query analytics (Celery workers, cron jobs) start without it
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+np = None
+
+DEFAULTS = {
+    # 'numpy' for the in-memory snapshot, 'database' for ORM aggregations
+    'engine': 'numpy',
+    # Seconds between incremental refreshes (run lazily by queries)
+    'refresh_interval': 5.0,
+    # Seconds of updated_at re-read on each refresh, for transactions
+    # that committed after a later updated_at was already seen
+    'overlap': 60.0,
+    # Seconds between full reloads, which also drop deleted orders
+    'full_refresh_interval': 3600.0,
+    # Rows fetched per database round trip while loading
+    'chunk_size': 50000,
+}
+
+GROUP_BY = ('product', 'customer', 'status', 'day', 'week', 'month')
+
+STATUSES = [choice for choice, _ in Order.STATUS_CHOICES]
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# Column name -> NumPy dtype; 37 bytes per order
+COLUMNS = {
+    'id': 'int64',
+    'customer_id': 'int32',
+    'product_id': 'int32',
+    'quantity': 'int32',
+    'amount_cents': 'int64',
+    'status': 'int8',
+    'created_at': 'int64',      # Unix seconds
+}
+
+FACT_FIELDS = ['id', 'customer_id', 'product_id', 'quantity', 'amount_cents', 'status', 'created_at']
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_ANALYTICS', {})}
+
+
+def load_numpy():
+    global np
+    if np is None and HAS_NUMPY:
+        import numpy
+        np = numpy
+    return np
+
+
+def numpy_enabled():
+    return get_config()['engine'] == 'numpy' and load_numpy() is not None
+
+
+def to_fact(row):
+    """ORM values row -> tuple in COLUMNS order."""
+    id, customer_id, product_id, quantity, amount_cents, status, created_at = row
+    return (
+        id, customer_id, product_id, quantity,
+        amount_cents, STATUS_CODES.get(status, -1), int(created_at.timestamp()),
+    )
+
+
+def period_label(group_by, seconds):
+    moment = datetime.fromtimestamp(int(seconds), tz=dt_timezone.utc)
+    if group_by == 'day':
+        return moment.strftime('%Y-%m-%d')
+    if group_by == 'week':
+        year, week, _ = moment.isocalendar()
+        return f'{year}-W{week:02d}'
+    return moment.strftime('%Y-%m')
+
+
+class OrderSnapshot:
+    """
+    Order facts in NumPy columns sorted by id. Columns are preallocated
+    with spare capacity and published together with the row count as one
+    (columns, size) tuple: appended rows only become visible once the new
+    tuple is swapped in, so queries never see a half-written row.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.data = None
+        self.watermark = None
+        self.refreshed_at = 0.0
+        self.loaded_at = 0.0
+
+    def info(self):
+        row_bytes = sum(np.dtype(dtype).itemsize for dtype in COLUMNS.values())
+        size = self.data[1] if self.data else 0
+        return {
+            'orders': size,
+            'bytes': row_bytes * size,
+            'bytes_per_million': row_bytes * 10 ** 6,
+            'watermark': self.watermark.isoformat() if self.watermark else None,
+        }
+
+    def fetch(self, since=None):
+        """
+        Facts from both order tables changed at or after `since` as an
+        id-sorted int64 array, plus the newest updated_at.
+        """
+        chunk_size = get_config()['chunk_size']
+        chunks = []
+        newest = None
+        for model in (Order, ArchivedOrder):
+            queryset = model.objects.order_by()
+            if since is not None:
+                queryset = queryset.filter(updated_at__gte=since)
+            # Read before the rows: anything updated meanwhile is re-read next time
+            latest = queryset.aggregate(latest=Max('updated_at'))['latest']
+            if latest is None:
+                continue
+            newest = latest if newest is None else max(newest, latest)
+
+            # Raw cents of the column, saving a Decimal per row
+            rows = queryset.annotate(amount_cents=money.cents('total_amount')).values_list(*FACT_FIELDS)
+            batch = []
+            # Converted chunk by chunk so loading never holds every row as Python objects
+            for row in rows.iterator(chunk_size=chunk_size):
+                batch.append(to_fact(row))
+                if len(batch) == chunk_size:
+                    chunks.append(np.array(batch, dtype='int64'))
+                    batch = []
+            if batch:
+                chunks.append(np.array(batch, dtype='int64'))
+
+        if not chunks:
+            return np.empty((0, len(COLUMNS)), dtype='int64'), newest
+        rows = np.concatenate(chunks)
+        rows = rows[np.argsort(rows[:, 0], kind='stable')]
+        # An order being archived can show up in both tables; keep the hot copy
+        _, first = np.unique(rows[:, 0], return_index=True)
+        return rows[first], newest
+
+    def to_columns(self, rows):
+        """(columns, size) for an id-sorted int64 array of facts, with spare capacity."""
+        capacity = max(1024, int(len(rows) * 1.25))
+        columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS.items()}
+        for index, name in enumerate(COLUMNS):
+            columns[name][:len(rows)] = rows[:, index]
+        return columns, len(rows)
+
+    def load(self):
+        """Replace the snapshot with every order."""
+        rows, newest = self.fetch()
+        self.data = self.to_columns(rows)
+        self.watermark = newest
+        self.loaded_at = self.refreshed_at = time.monotonic()
+
+    def apply(self, rows):
+        """Upsert id-sorted facts into the columns."""
+        columns, size = self.data
+        if not len(rows):
+            return
+        ids = columns['id'][:size]
+        positions = np.searchsorted(ids, rows[:, 0])
+        known = positions < size
+        known[known] = ids[positions[known]] == rows[known, 0]
+
+        # Changed orders (e.g. a new status) are overwritten in place
+        for index, name in enumerate(COLUMNS):
+            columns[name][positions[known]] = rows[known, index]
+
+        new = rows[~known]
+        if not len(new):
+            return
+        if size and new[0, 0] < ids[-1]:
+            # A lower id committed late: merge and re-sort everything
+            merged = np.concatenate([
+                np.stack([columns[name][:size] for name in COLUMNS], axis=1).astype('int64'),
+                new,
+            ])
+            self.data = self.to_columns(merged[np.argsort(merged[:, 0], kind='stable')])
+            return
+
+        end = size + len(new)
+        if end > len(columns['id']):
+            capacity = max(end, len(columns['id']) * 2)
+            columns = {
+                name: np.concatenate([column[:size], np.zeros(capacity - size, dtype=column.dtype)])
+                for name, column in columns.items()
+            }
+        for index, name in enumerate(COLUMNS):
+            columns[name][size:end] = new[:, index]
+        self.data = (columns, end)
+
+    def refresh(self, force=False):
+        """Load or incrementally update the snapshot when it is due."""
+        load_numpy()
+        config = get_config()
+        now = time.monotonic()
+        if not force and self.data is not None and now - self.refreshed_at < config['refresh_interval']:
+            return
+        # While another thread refreshes, keep serving the current data
+        if not self._lock.acquire(blocking=self.data is None or force):
+            return
+        try:
+            if self.data is None or now - self.loaded_at >= config['full_refresh_interval']:
+                self.load()
+                return
+            since = self.watermark - timedelta(seconds=config['overlap']) if self.watermark else None
+            rows, newest = self.fetch(since)
+            self.apply(rows)
+            if newest is not None and (self.watermark is None or newest > self.watermark):
+                self.watermark = newest
+            self.refreshed_at = now
+        finally:
+            self._lock.release()
+
+    def revenue(self, group_by, since=None, until=None, statuses=None, top=None):
+        """[(label, orders, quantity, revenue_cents)] by revenue, descending."""
+        columns, size = self.data
+        created = columns['created_at'][:size]
+        mask = np.ones(size, dtype=bool)
+        if since is not None:
+            mask &= created >= int(since.timestamp())
+        if until is not None:
+            mask &= created < int(until.timestamp())
+        if statuses:
+            codes = [STATUS_CODES[status] for status in statuses if status in STATUS_CODES]
+            mask &= np.isin(columns['status'][:size], codes)
+
+        if group_by in ('product', 'customer'):
+            keys = columns[f'{group_by}_id'][:size][mask]
+        elif group_by == 'status':
+            keys = columns['status'][:size][mask]
+        elif group_by == 'day':
+            keys = created[mask] // 86400
+        elif group_by == 'week':
+            # Unix day 0 was a Thursday; shift so weeks start on Monday
+            keys = (created[mask] // 86400 + 3) // 7
+        else:
+            keys = created[mask].astype('datetime64[s]').astype('datetime64[M]').astype('int64')
+
+        quantities = columns['quantity'][:size][mask]
+        amounts = columns['amount_cents'][:size][mask]
+        if not len(keys):
+            return []
+        low = int(keys.min())
+        span = int(keys.max()) - low + 1
+        if span <= 4 * len(keys) + 1024:
+            # Dense keys (ids, periods, statuses): count straight into slots, O(n)
+            slots = keys.astype('int64') - low
+            orders = np.bincount(slots, minlength=span)
+            present = np.flatnonzero(orders)
+            unique = present + low
+            orders = orders[present]
+            quantity = np.bincount(slots, weights=quantities, minlength=span)[present]
+            cents = np.bincount(slots, weights=amounts, minlength=span)[present]
+        else:
+            unique, inverse = np.unique(keys, return_inverse=True)
+            orders = np.bincount(inverse, minlength=len(unique))
+            quantity = np.bincount(inverse, weights=quantities, minlength=len(unique))
+            cents = np.bincount(inverse, weights=amounts, minlength=len(unique))
+
+        chosen = np.arange(len(unique))
+        if top is not None and top < len(unique):
+            chosen = np.argpartition(-cents, top - 1)[:top]
+        # Highest revenue first, ties by key
+        chosen = chosen[np.lexsort((unique[chosen], -cents[chosen]))]
+
+        results = []
+        for index in chosen.tolist():
+            key = int(unique[index])
+            if group_by == 'status':
+                label = STATUSES[key] if 0 <= key < len(STATUSES) else 'unknown'
+            elif group_by == 'day':
+                label = period_label(group_by, key * 86400)
+            elif group_by == 'week':
+                label = period_label(group_by, (key * 7 - 3) * 86400)
+            elif group_by == 'month':
+                label = str(np.datetime64(key, 'M'))
+            else:
+                label = str(key)
+            results.append((label, int(orders[index]), int(round(quantity[index])), int(round(cents[index]))))
+        return results
+
+
+snapshot = OrderSnapshot()
+
+TRUNC = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}
+
+
+def database_revenue(group_by, since=None, until=None, statuses=None, top=None):
+    """revenue() as database aggregations over both order tables."""
+    totals = defaultdict(lambda: [0, 0, 0])
+    for model in (Order, ArchivedOrder):
+        queryset = model.objects.order_by()
+        if since is not None:
+            queryset = queryset.filter(created_at__gte=since)
+        if until is not None:
+            queryset = queryset.filter(created_at__lt=until)
+        if statuses:
+            queryset = queryset.filter(status__in=statuses)
+        if group_by in TRUNC:
+            queryset = queryset.annotate(key=TRUNC[group_by]('created_at'))
+        else:
+            queryset = queryset.annotate(key=F('status' if group_by == 'status' else f'{group_by}_id'))
+        rows = queryset.values('key').annotate(
+            orders=Count('id'), quantity=Sum('quantity'), revenue=Sum(money.cents('total_amount')),
+        )
+        for row in rows:
+            total = totals[row['key']]
+            total[0] += row['orders']
+            total[1] += row['quantity'] or 0
+            total[2] += row['revenue'] or 0
+
+    # Highest revenue first, ties by key (status ties by name here)
+    ordered = sorted(totals.items(), key=lambda item: (-item[1][2], item[0]))
+    results = []
+    for key, (orders, quantity, revenue) in ordered[:top]:
+        label = period_label(group_by, key.timestamp()) if group_by in TRUNC else str(key)
+        results.append((label, orders, quantity, revenue))
+    return results
+
+
+def revenue(group_by, since=None, until=None, statuses=None, top=None):
+    """
+    Orders, quantity and revenue (in cents) per group, highest revenue
+    first, over hot and archived orders created in [since, until).
+    """
+    if group_by not in GROUP_BY:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+    if numpy_enabled():
+        snapshot.refresh()
+        return snapshot.revenue(group_by, since, until, statuses, top)
+    return database_revenue(group_by, since, until, statuses, top)
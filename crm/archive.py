@@ -0,0 +1,134 @@
+"""
+CRM Order Archive
+Moves orders older than CRM_ORDER_ARCHIVE['age_days'] from the hot Order
+table into ArchivedOrder, in small batches so each transaction holds the
+write lock only briefly.
+
+Since only orders older than the configured age are ever archived, every
+order created after archive_boundary() is still in the hot table. Order
+lookups use that to read the archive only when the requested date range
+reaches past the boundary.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from crm import routers
+from crm.models import ArchivedOrder, Order
+
+DEFAULTS = {
+    # Orders older than this many days are moved to the archive
+    'age_days': 365,
+    # Orders moved per transaction
+    'batch_size': 1000,
+    # Stop after this many batches per run (None: until nothing is left)
+    'max_batches': None,
+    # Seconds to sleep between batches, leaving room for other writers
+    'pause': 0.0,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_ORDER_ARCHIVE', {})}
+
+
+def archive_boundary(now=None):
+    """Orders created at or after this moment are never in the archive."""
+    return (now or timezone.now()) - timedelta(days=get_config()['age_days'])
+
+
+def aware(value):
+    """value in the current time zone if it is naive, e.g. an argument without an offset."""
+    if value is not None and timezone.is_naive(value):
+        return timezone.make_aware(value)
+    return value
+
+
+def needs_archive(created_after=None):
+    """Whether orders created after `created_after` (None: ever) may be archived."""
+    return created_after is None or aware(created_after) < archive_boundary()
+
+
+def archive_batch(cutoff, batch_size):
+    """Move up to batch_size orders created before cutoff. Returns the number moved."""
+    with transaction.atomic():
+        orders = list(
+            Order.objects.filter(created_at__lt=cutoff)
+            .order_by('pk')
+            .values(*ArchivedOrder.ORDER_FIELDS)[:batch_size]
+        )
+        if not orders:
+            return 0
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**order) for order in orders])
+        Order.objects.filter(pk__in=[order['id'] for order in orders]).delete()
+        return len(orders)
+
+
+def archive_orders(batch_size=None, max_batches=None, log=None):
+    """
+    Archive every order older than the configured age, batch by batch.
+    `log(batch, moved)` is called after each batch. Returns the total moved.
+    """
+    config = get_config()
+    batch_size = batch_size or config['batch_size']
+    max_batches = max_batches or config['max_batches']
+    cutoff = archive_boundary()
+
+    total = 0
+    batches = 0
+    # Always read the primary: the batches must see their own deletes
+    with routers.primary():
+        while max_batches is None or batches < max_batches:
+            moved = archive_batch(cutoff, batch_size)
+            if not moved:
+                break
+            batches += 1
+            total += moved
+            if log:
+                log(batches, moved)
+            if config['pause']:
+                time.sleep(config['pause'])
+    return total
+
+
+def filter_range(queryset, created_after=None, created_before=None):
+    if created_after is not None:
+        queryset = queryset.filter(created_at__gte=created_after)
+    if created_before is not None:
+        queryset = queryset.filter(created_at__lt=created_before)
+    return queryset
+
+
+def orders_in_range(created_after=None, created_before=None):
+    """
+    Orders created in [created_after, created_before), newest first, as
+    Order instances. The archive is only queried when the range needs it.
+    """
+    created_after, created_before = aware(created_after), aware(created_before)
+    orders = filter_range(Order.objects.all(), created_after, created_before)
+    if not needs_archive(created_after):
+        return orders
+
+    # Hot table first: an order archived in between shows up twice
+    # instead of not at all, and the duplicate is dropped below
+    orders = list(orders)
+    seen = {order.pk for order in orders}
+    archived = filter_range(ArchivedOrder.objects.all(), created_after, created_before)
+    orders += [order.as_order() for order in archived if order.pk not in seen]
+    orders.sort(key=lambda order: order.created_at, reverse=True)
+    return orders
+
+
+def get_order(pk):
+    """Order by id, falling back to the archive. Raises Order.DoesNotExist."""
+    try:
+        return Order.objects.get(pk=pk)
+    except Order.DoesNotExist:
+        try:
+            return ArchivedOrder.objects.get(pk=pk).as_order()
+        except ArchivedOrder.DoesNotExist:
+            raise Order.DoesNotExist(f"Order {pk} does not exist")
@@ -0,0 +1,135 @@
+"""
+CRM Task Batching
+Coalesces many small events (e.g. stock changes) into one task execution.
+
+Producers call Batch.add(event), which costs a few cache operations. The
+first event of a batch schedules the flush_batch task `flush_after`
+seconds later; that one execution hands every event buffered by then (up
+to `max_size`, the rest in immediate follow-up flushes) to the batch's
+handler as a list.
+
+Events wait in Django's cache under increasing sequence numbers, so the
+processes adding events and the workers flushing them must share the
+cache backend: Redis in production, locmem only within one process (eager
+tasks, tests, benchmarks). Configure batches in CRM_BATCHES by name.
+
+A flush only hands over a contiguous run of sequence numbers. A number
+without an event may belong to a producer that incremented the counter
+but hasn't written yet, so the flush stops there; only once the gap has
+been seen for longer than 'ttl' is its event taken as expired and skipped.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULTS = {
+    # Seconds between a batch's first event and its flush
+    'flush_after': 1.0,
+    # Events handed to the handler per execution
+    'max_size': 500,
+    # Seconds buffered events are kept if never flushed
+    'ttl': 24 * 3600,
+    # Seconds producers wait before trying to schedule again after the
+    # broker was unreachable
+    'retry_after': 10,
+}
+
+# Batch instances by name, looked up by the flush_batch task
+_batches = {}
+
+
+def get_config(name):
+    return {**DEFAULTS, **getattr(settings, 'CRM_BATCHES', {}).get(name, {})}
+
+
+def get_batch(name):
+    return _batches[name]
+
+
+class Batch:
+    """A named event buffer flushed to handler(events) by the flush_batch task."""
+
+    def __init__(self, name, handler):
+        self.name = name
+        self.handler = handler
+        _batches[name] = self
+
+    def key(self, suffix):
+        return f'crm:batch:{self.name}:{suffix}'
+
+    def add(self, event):
+        """Buffer a JSON-serializable event and make sure a flush is scheduled."""
+        config = get_config(self.name)
+        cache.add(self.key('seq'), 0, timeout=None)
+        seq = cache.incr(self.key('seq'))
+        cache.set(self.key(seq), event, timeout=config['ttl'])
+        # Expires in case the scheduled task is lost, e.g. with a crashed worker
+        if cache.add(self.key('scheduled'), 1, timeout=max(60, config['flush_after'] * 10)):
+            self.schedule(config['flush_after'])
+
+    def schedule(self, countdown):
+        from kombu.exceptions import OperationalError
+
+        from crm.tasks import flush_batch
+
+        try:
+            flush_batch.apply_async((self.name,), countdown=countdown)
+        except OperationalError:
+            # Broker unreachable: the events stay buffered, and the flag keeps
+            # every producer from paying for a failed publish until it expires
+            cache.set(self.key('scheduled'), 1, timeout=get_config(self.name)['retry_after'])
+
+    def flush(self):
+        """
+        Hand the oldest buffered events (up to max_size) to the handler and
+        schedule another flush if some remain. Returns the number handled.
+        """
+        config = get_config(self.name)
+        if not cache.add(self.key('lock'), 1, timeout=max(60, config['flush_after'] * 10)):
+            # Another flush is running; try again after it
+            cache.set(self.key('scheduled'), 1, timeout=max(60, config['flush_after'] * 10))
+            self.schedule(config['flush_after'])
+            return 0
+        try:
+            seq, done = cache.get(self.key('seq')) or 0, cache.get(self.key('done')) or 0
+            if done > seq:
+                # The counter restarted, e.g. after the cache was cleared
+                done = 0
+            start = done + 1
+            end = min(seq, start + config['max_size'] - 1)
+            keys = [self.key(n) for n in range(start, end + 1)]
+            items = cache.get_many(keys)
+            last = start - 1
+            expired = []
+            for n in range(start, end + 1):
+                if self.key(n) not in items:
+                    if not self.gap_expired(n, config['ttl']):
+                        # Probably still being written by its producer
+                        break
+                    expired.append(self.key(f'gap:{n}'))
+                last = n
+            events = [items[key] for key in keys[:last - start + 1] if key in items]
+            if events:
+                self.handler(events)
+            if last >= start:
+                cache.set(self.key('done'), last, timeout=None)
+                cache.delete_many(keys[:last - start + 1] + expired)
+        finally:
+            cache.delete(self.key('lock'))
+
+        # Producers don't schedule while the flag is set, so check for events
+        # left behind only after clearing it
+        cache.delete(self.key('scheduled'))
+        if (cache.get(self.key('seq')) or 0) > last and cache.add(self.key('scheduled'), 1, timeout=60):
+            # A full batch suggests more are waiting: flush again right away
+            self.schedule(0 if last == end and events else config['flush_after'])
+        return len(events)
+
+    def gap_expired(self, n, ttl):
+        """Whether sequence number n has been missing its event for over ttl seconds."""
+        key = self.key(f'gap:{n}')
+        now = time.time()
+        cache.add(key, now, timeout=ttl * 2)
+        return now - cache.get(key, now) > ttl
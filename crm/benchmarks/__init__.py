@@ -0,0 +1,5 @@
+"""
+CRM Benchmarks
+Seeded datasets, measurement helpers and benchmark suites for the CRM app.
+Suites are run through management commands (see crm/management/commands).
+"""
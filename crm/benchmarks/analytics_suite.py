@@ -0,0 +1,112 @@
+"""
+Analytics Benchmark
+Loads the NumPy order snapshot from a large generated order history and
+compares its group-by queries with the equivalent database aggregations.
+"""
+
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from crm import analytics
+from crm.benchmarks import datasets
+from crm.benchmarks.measure import measure
+from crm.models import Order
+
+# Rows per executemany() while seeding
+CHUNK = 50000
+
+
+def seed_orders(count, customer_ids, product_ids, seed=0, history=True):
+    """
+    Insert `count` orders with raw SQL, spread over the seeded history
+    window, or created now when `history` is false.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    span = timedelta(days=datasets.ORDER_HISTORY_DAYS).total_seconds()
+    table = connection.ops.quote_name(Order._meta.db_table)
+    fields = ['customer', 'product', 'quantity', 'total_amount', 'status', 'created_at', 'updated_at']
+    columns = [Order._meta.get_field(name).column for name in fields]
+    sql = (
+        f"INSERT INTO {table} ({', '.join(connection.ops.quote_name(c) for c in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))})"
+    )
+    for start in range(0, count, CHUNK):
+        rows = []
+        for _ in range(min(CHUNK, count - start)):
+            created = now - timedelta(seconds=rng.random() * span) if history else now
+            quantity = rng.randint(1, 5)
+            rows.append((
+                rng.choice(customer_ids), rng.choice(product_ids), quantity,
+                # total_amount is stored as integer cents
+                quantity * rng.randint(100, 20000),
+                rng.choice(datasets.STATUSES), created, created,
+            ))
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+def run_suite(orders, repeat=5, log=None):
+    """
+    Seed `orders` orders, load the snapshot and time every group-by both ways.
+    Returns the results.
+    """
+    ctx = datasets.seed({'customers': 2000, 'products': 500, 'orders': 0})
+    seed_orders(orders, ctx['customer_ids'], ctx['product_ids'])
+    snapshot = analytics.OrderSnapshot()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    snapshot.refresh()
+    load_s = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    info = snapshot.info()
+    results = {
+        'orders': orders,
+        'load_s': round(load_s, 2),
+        'load_peak_mb': round(peak / 2 ** 20, 1),
+        'snapshot_mb': round(info['bytes'] / 2 ** 20, 1),
+        'mb_per_million': round(info['bytes_per_million'] / 2 ** 20, 1),
+        'queries': {},
+    }
+    if log:
+        log('load', {key: value for key, value in results.items() if key != 'queries'})
+
+    since = timezone.now() - timedelta(days=90)
+    cases = {
+        'product_top10': ('product', {'top': 10}),
+        'customer_top10': ('customer', {'top': 10}),
+        'status': ('status', {}),
+        'month': ('month', {}),
+        'week_last_90d': ('week', {'since': since}),
+        'day_shipped_last_90d': ('day', {'since': since, 'statuses': ['shipped', 'delivered']}),
+    }
+    for name, (group_by, options) in cases.items():
+        numpy = measure(lambda i: snapshot.revenue(group_by, **options), repeat=repeat)
+        database = measure(lambda i: analytics.database_revenue(group_by, **options), repeat=repeat)
+        metrics = {
+            'numpy_ms': numpy['latency_ms'],
+            'database_ms': database['latency_ms'],
+            'speedup': round(database['latency_ms'] / numpy['latency_ms'], 1) if numpy['latency_ms'] else None,
+        }
+        results['queries'][name] = metrics
+        if log:
+            log(name, metrics)
+
+    # Incremental refresh after a burst of new orders
+    seed_orders(1000, ctx['customer_ids'], ctx['product_ids'], seed=1, history=False)
+    start = time.perf_counter()
+    snapshot.refresh(force=True)
+    results['incremental_refresh_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    if log:
+        log('refresh', {'new_orders': 1000, 'ms': results['incremental_refresh_ms']})
+
+    datasets.clear()
+    return results
@@ -0,0 +1,57 @@
+"""
+Batch Benchmark
+Times a dashboard's worth of read operations sent to /graphql as separate
+HTTP requests, as one batched request, and as one batch run in parallel.
+"""
+
+from django.test import Client, override_settings
+
+from crm.benchmarks import datasets
+from crm.benchmarks.measure import measure
+from crm.benchmarks.schema_suite import OPERATIONS
+
+# Read operations a dashboard page issues together
+DASHBOARD = ['all_products', 'low_stock_products', 'customer_detail', 'product_detail', 'order_detail', 'all_orders_nested']
+
+MODES = ['separate', 'batch', 'parallel_batch']
+
+
+def run_suite(scales, operations=None, repeat=5, workers=4, log=None):
+    """Measure each mode at each scale. Returns {scale: {mode: metrics}}."""
+    operations = operations or DASHBOARD
+    # A host DEBUG's default ALLOWED_HOSTS accepts outside the test runner
+    client = Client(SERVER_NAME='localhost')
+    results = {}
+    for scale in scales:
+        datasets.clear()
+        ctx = datasets.seed(scale)
+
+        def entries(i):
+            return [
+                {'query': OPERATIONS[name][0], 'variables': OPERATIONS[name][1](ctx, i)}
+                for name in operations
+            ]
+
+        def post(payload):
+            response = client.post('/graphql', payload, content_type='application/json')
+            if response.status_code != 200 or 'errors' in response.content.decode():
+                raise RuntimeError(f"GraphQL errors: {response.content[:500]}")
+
+        runs = {
+            'separate': lambda i: [post(entry) for entry in entries(i)],
+            'batch': lambda i: post(entries(i)),
+            'parallel_batch': lambda i: post(entries(i)),
+        }
+        results[scale] = {}
+        for mode in MODES:
+            batch = {'parallel_reads': mode == 'parallel_batch', 'workers': workers}
+            # The rate limiter would throttle the benchmark itself
+            with override_settings(CRM_RATE_LIMIT={'enabled': False}, CRM_GRAPHQL_BATCH=batch):
+                metrics = measure(runs[mode], repeat=repeat)
+            if mode == 'parallel_batch':
+                # Worker threads' queries aren't counted
+                metrics.pop('queries')
+            results[scale][mode] = metrics
+            if log:
+                log(scale, mode, metrics)
+    return results
@@ -0,0 +1,127 @@
+"""
+Product Cache Benchmark
+Replays a Zipf-distributed mix of product(id) queries and createOrder
+mutations with and without crm.product_cache and counts the reads that
+reach the product table.
+"""
+
+import random
+import time
+
+from django.db import connection
+from django.test.utils import override_settings
+
+from crm.benchmarks import datasets
+from crm.benchmarks.schema_suite import execute
+from crm.models import Product
+from crm.product_cache import get_product, products as product_cache
+
+PRODUCT_QUERY = """
+    query Product($id: ID!) {
+        product(id: $id) { id name price }
+    }
+"""
+
+CREATE_ORDER = """
+    mutation CreateOrder($customerId: ID!, $productId: ID!) {
+        createOrder(customerId: $customerId, productId: $productId, quantity: 1) { success }
+    }
+"""
+
+
+class ProductReadCounter:
+    """Count SELECTs on the product table and all statements, on this thread."""
+
+    def __init__(self):
+        self.product_reads = 0
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        if sql.lstrip().upper().startswith('SELECT') and 'FROM "crm_product"' in sql:
+            self.product_reads += 1
+        return execute(sql, params, many, context)
+
+
+def zipf_workload(product_ids, customer_ids, operations, skew=1.1, read_ratio=0.8, seed=0):
+    """[(document, variables)] with product popularity following Zipf(skew)."""
+    rng = random.Random(seed)
+    ranked = list(product_ids)
+    rng.shuffle(ranked)
+    weights = [1 / (rank + 1) ** skew for rank in range(len(ranked))]
+    workload = []
+    for product_id in rng.choices(ranked, weights, k=operations):
+        if rng.random() < read_ratio:
+            workload.append((PRODUCT_QUERY, {'id': product_id}))
+        else:
+            workload.append((CREATE_ORDER, {
+                'customerId': rng.choice(customer_ids),
+                'productId': product_id,
+            }))
+    return workload
+
+
+def replay(workload):
+    counter = ProductReadCounter()
+    start = time.perf_counter()
+    with connection.execute_wrapper(counter):
+        for document, variables in workload:
+            execute(document, variables)
+    elapsed = time.perf_counter() - start
+    return {
+        'ops_per_s': round(len(workload) / elapsed, 1),
+        'queries': counter.queries,
+        'product_reads': counter.product_reads,
+    }
+
+
+def lookup_us(func, runs=2000):
+    """Mean microseconds per call."""
+    func()
+    start = time.perf_counter()
+    for _ in range(runs):
+        func()
+    return round((time.perf_counter() - start) / runs * 1e6, 1)
+
+
+def run_suite(scale, operations=5000, skew=1.1, read_ratio=0.8, max_size=None, log=None):
+    """
+    Replay the same workload with the cache off and on.
+    Returns {'uncached': metrics, 'cached': metrics, 'lookup_us': ..., 'reduction': ...}.
+    """
+    ctx = datasets.seed(scale)
+    # Enough stock everywhere that every order succeeds in both runs
+    Product.objects.update(stock=datasets.HOT_PRODUCT_STOCK)
+    workload = zipf_workload(ctx['product_ids'], ctx['customer_ids'], operations, skew, read_ratio)
+
+    results = {}
+    for name, enabled in (('uncached', False), ('cached', True)):
+        config = {'enabled': enabled}
+        if max_size:
+            config['max_size'] = max_size
+        product_cache.clear()
+        product_cache.reset_stats()
+        with override_settings(CRM_PRODUCT_CACHE=config):
+            results[name] = replay(workload)
+        if enabled:
+            results[name].update(product_cache.info())
+        if log:
+            log(name, results[name])
+
+    # The lookup alone, without GraphQL execution around it
+    product_id = ctx['hot_product_id']
+    results['lookup_us'] = {
+        'orm': lookup_us(lambda: Product.objects.get(pk=product_id)),
+        'cache_hit': lookup_us(lambda: get_product(product_id)),
+    }
+    if log:
+        log('lookup_us', results['lookup_us'])
+
+    datasets.clear()
+    uncached, cached = results['uncached'], results['cached']
+    results['reduction'] = {
+        'product_reads': round(1 - cached['product_reads'] / uncached['product_reads'], 4),
+        'queries': round(1 - cached['queries'] / uncached['queries'], 4),
+        'speedup': round(cached['ops_per_s'] / uncached['ops_per_s'], 2),
+    }
+    return results
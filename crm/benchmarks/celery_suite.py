@@ -0,0 +1,208 @@
+"""
+Celery Benchmark
+Runs embedded Celery workers on an in-memory broker to measure how
+queues and batching change task latency and throughput.
+
+- queues: how long quick tasks wait when they are sent right after a slow
+  one, on one shared queue versus on dedicated queues with their own worker.
+- batching: how long it takes to handle a burst of small events sent as
+  one task each versus coalesced by crm.batching.Batch.
+
+No Redis is needed: the crm app is pointed at `memory://` for the
+duration of the run. Workers use the solo pool in threads of this
+process, so task durations are sleeps rather than CPU work.
+"""
+
+import contextlib
+import threading
+import time
+
+from celery.contrib.testing.worker import start_worker
+from django.test import override_settings
+
+from crm import batching
+from crm.celery import app
+
+# Cache big enough to hold every buffered event of the batching scenario
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'crm-celery-benchmark',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    },
+}
+
+SCENARIOS = ['queues', 'batching']
+
+
+class Completions:
+    """Thread-safe record of when each benchmark task finished."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = {}
+        self.handled = 0
+        self.executions = 0
+        self.done = threading.Event()
+        self.expected = None
+
+    def reset(self, expected):
+        with self.lock:
+            self.times = {}
+            self.handled = 0
+            self.executions = 0
+            self.expected = expected
+            self.done.clear()
+
+    def record(self, key=None, handled=1):
+        with self.lock:
+            if key is not None:
+                self.times[key] = time.perf_counter()
+            self.handled += handled
+            self.executions += 1
+            if self.handled >= self.expected:
+                self.done.set()
+
+    def wait(self, timeout=60):
+        if not self.done.wait(timeout):
+            raise RuntimeError(f"Only {self.handled} of {self.expected} benchmark tasks finished")
+
+
+completions = Completions()
+
+
+@app.task(name='crm.benchmarks.slow_task', ignore_result=True)
+def slow_task(seconds):
+    time.sleep(seconds)
+    completions.record()
+
+
+@app.task(name='crm.benchmarks.quick_task', ignore_result=True)
+def quick_task(key):
+    completions.record(key)
+
+
+@app.task(name='crm.benchmarks.event_task', ignore_result=True)
+def event_task(event):
+    time.sleep(event_task.overhead)
+    completions.record()
+
+
+def handle_events(events):
+    time.sleep(event_task.overhead)
+    completions.record(handled=len(events))
+
+
+benchmark_batch = batching.Batch('celery_benchmark', handle_events)
+
+
+def configure(**options):
+    """
+    Set app options. The CELERY_ settings Django loaded take precedence
+    over plain option names, so both are set.
+    """
+    app.conf.update({**options, **{f'CELERY_{key.upper()}': value for key, value in options.items()}})
+
+
+@contextlib.contextmanager
+def memory_broker():
+    """Point the crm app at an in-memory broker for the block."""
+    keys = ('broker_url', 'broker_transport_options', 'result_backend', 'task_always_eager')
+    previous = {key: app.conf[key] for key in keys}
+    configure(
+        broker_url='memory://', result_backend='cache+memory://', task_always_eager=False,
+        # The memory transport polls its queues; the default of a second would dominate
+        broker_transport_options={'polling_interval': 0.005},
+    )
+    # Drop connections pooled for the previous broker
+    app._after_fork()
+    try:
+        yield app
+    finally:
+        configure(**previous)
+        app._after_fork()
+
+
+@contextlib.contextmanager
+def workers(*queue_sets):
+    """One embedded worker per set of queues."""
+    # Register the crm tasks as a worker would; it rejects tasks unknown at start
+    app.loader.import_default_modules()
+    with contextlib.ExitStack() as stack:
+        for queues in queue_sets:
+            stack.enter_context(start_worker(
+                app, perform_ping_check=False, queues=queues, shutdown_timeout=30,
+                hostname=f"{'-'.join(queues)}@benchmark",
+            ))
+        yield
+
+
+def run_queues(quick=20, slow_seconds=1.0):
+    """
+    Send one slow task followed by `quick` quick ones and return how long
+    the quick ones waited: on one shared queue, and with the slow task
+    routed to the reports queue and consumed by its own worker.
+    """
+    # Queue of the slow task and the queues of each worker
+    setups = {
+        'shared_queue': ('default', [['default']]),
+        'dedicated_queues': ('reports', [['default'], ['reports']]),
+    }
+    results = {}
+    for mode, (slow_queue, queue_sets) in setups.items():
+        with workers(*queue_sets):
+            completions.reset(quick + 1)
+            slow_task.apply_async((slow_seconds,), queue=slow_queue)
+            sent = {}
+            for key in range(quick):
+                sent[key] = time.perf_counter()
+                quick_task.apply_async((key,), queue='default')
+            completions.wait()
+            waits = sorted((completions.times[key] - sent[key]) * 1000 for key in range(quick))
+        results[mode] = {
+            'quick_p50_ms': round(waits[len(waits) // 2], 1),
+            'quick_max_ms': round(waits[-1], 1),
+        }
+    return results
+
+
+def run_batching(events=2000, overhead_ms=1.0, flush_after=0.1, max_size=500):
+    """
+    Send `events` small events, each costing `overhead_ms` per task
+    execution (e.g. a connection or an API call), as one task each and
+    through a Batch, and time until all of them were handled.
+    """
+    event_task.overhead = overhead_ms / 1000
+    batches = {'celery_benchmark': {'flush_after': flush_after, 'max_size': max_size}}
+    results = {}
+    with override_settings(CACHES=CACHES, CRM_BATCHES=batches), workers(['default', 'notifications']):
+        for mode in ('task_per_event', 'batched'):
+            completions.reset(events)
+            start = time.perf_counter()
+            for n in range(events):
+                event = {'product_id': n % 50, 'stock': n}
+                if mode == 'batched':
+                    benchmark_batch.add(event)
+                else:
+                    event_task.delay(event)
+            sent_ms = (time.perf_counter() - start) * 1000
+            completions.wait()
+            results[mode] = {
+                'send_ms': round(sent_ms, 1),
+                'total_ms': round((time.perf_counter() - start) * 1000, 1),
+                'executions': completions.executions,
+            }
+    return results
+
+
+def run_suite(scenarios=None, log=None, **options):
+    """Run each scenario on an in-memory broker. Returns {scenario: {mode: metrics}}."""
+    runs = {'queues': run_queues, 'batching': run_batching}
+    results = {}
+    with memory_broker():
+        for scenario in scenarios or SCENARIOS:
+            results[scenario] = runs[scenario](**options.get(scenario, {}))
+            if log:
+                for mode, metrics in results[scenario].items():
+                    log(scenario, mode, metrics)
+    return results
@@ -0,0 +1,146 @@
+"""
+SQLite Contention Benchmark
+Mixed read/write load from concurrent threads against copies of the same
+seeded database, once with Django's stock SQLite configuration and once
+with the production profile from settings.
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import threading
+import time
+from contextlib import closing
+
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+
+from crm.models import Customer, Order, Product
+
+# Database settings of each profile, NAME is filled in per run
+PROFILES = {
+    'stock': lambda default: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'CONN_MAX_AGE': 0,
+        'OPTIONS': {},
+    },
+    'tuned': lambda default: {
+        'ENGINE': default['ENGINE'],
+        'CONN_MAX_AGE': default['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': default['CONN_HEALTH_CHECKS'],
+        'OPTIONS': default['OPTIONS'],
+    },
+}
+
+
+def register_database(alias, config):
+    """Add a database alias at runtime."""
+    databases = {'default': connections.settings['default'], alias: config}
+    connections.settings[alias] = connections.configure_settings(databases)[alias]
+
+
+def read_operation(alias, ids, rng):
+    """A product detail, a product page and a customer's orders."""
+    Product.objects.using(alias).get(pk=rng.choice(ids['products']))
+    list(Product.objects.using(alias).all()[:20])
+    list(Order.objects.using(alias).filter(customer_id=rng.choice(ids['customers']))[:20])
+
+
+def write_operation(alias, ids, rng):
+    """The createOrder pattern: read the product, insert an order, decrement stock."""
+    with transaction.atomic(using=alias):
+        product = Product.objects.using(alias).get(pk=ids['hot_product'])
+        Order.objects.using(alias).create(
+            customer_id=rng.choice(ids['customers']),
+            product_id=product.pk,
+            quantity=1,
+            total_amount=product.price,
+        )
+        Product.objects.using(alias).filter(pk=product.pk).update(stock=F('stock') - 1)
+
+
+def run_load(alias, ids, readers, writers, duration):
+    """Run reader and writer threads for `duration` seconds and collect metrics."""
+    stats = {'read': [], 'write': []}
+    errors = {'read': 0, 'write': 0}
+    lock = threading.Lock()
+    stop = threading.Event()
+    barrier = threading.Barrier(readers + writers + 1)
+
+    def worker(kind, seed):
+        rng = random.Random(seed)
+        operation = read_operation if kind == 'read' else write_operation
+        conn = connections[alias]
+        try:
+            barrier.wait()
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    operation(alias, ids, rng)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    with lock:
+                        stats[kind].append(elapsed)
+                except OperationalError:
+                    with lock:
+                        errors[kind] += 1
+                # End of "request": CONN_MAX_AGE decides whether to reconnect
+                conn.close_if_unusable_or_obsolete()
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=worker, args=('read', n)) for n in range(readers)]
+    threads += [threading.Thread(target=worker, args=('write', readers + n)) for n in range(writers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    result = {}
+    for kind in ('read', 'write'):
+        timings = sorted(stats[kind])
+        result[f'{kind}s_per_s'] = round(len(timings) / duration, 1)
+        result[f'{kind}_p50_ms'] = round(statistics.median(timings), 3) if timings else None
+        result[f'{kind}_p95_ms'] = round(timings[int(len(timings) * 0.95)], 3) if timings else None
+        result[f'{kind}_errors'] = errors[kind]
+    return result
+
+
+def run_suite(db_path, profiles=None, readers=8, writers=4, duration=5.0, log=None):
+    """
+    Run the mixed load once per profile on a copy of the seeded database
+    at db_path. Returns {profile: metrics}.
+    """
+    default = connections['default'].settings_dict
+    ids = {
+        'products': list(Product.objects.values_list('pk', flat=True)),
+        'customers': list(Customer.objects.values_list('pk', flat=True)),
+        'hot_product': Product.objects.order_by('-stock').values_list('pk', flat=True)[0],
+    }
+    connections.close_all()
+
+    results = {}
+    for name in profiles or list(PROFILES):
+        path = f'{db_path}.{name}'
+        shutil.copyfile(db_path, path)
+        if name == 'stock':
+            # The copy inherits WAL mode from the seeded file
+            with closing(sqlite3.connect(path)) as raw:
+                raw.execute('PRAGMA journal_mode = delete')
+
+        alias = f'contention_{name}'
+        register_database(alias, {**PROFILES[name](default), 'NAME': path})
+        try:
+            results[name] = run_load(alias, ids, readers, writers, duration)
+        finally:
+            connections[alias].close()
+            for suffix in ('', '-wal', '-shm', '-journal'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        if log:
+            log(name, results[name])
+    return results
@@ -0,0 +1,117 @@
+"""
+Benchmark Datasets
+Seeds the CRM tables with deterministic data at several scales.
+"""
+
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from crm.models import Customer, IdempotencyKey, Product, Order, OrderEvent
+from crm.product_cache import products as product_cache
+
+# Row counts per scale
+SCALES = {
+    'small': {'customers': 20, 'products': 10, 'orders': 100},
+    'medium': {'customers': 200, 'products': 50, 'orders': 2000},
+    'large': {'customers': 2000, 'products': 200, 'orders': 20000},
+}
+
+# Usernames of seeded users share this prefix so they can be cleared
+USERNAME_PREFIX = 'bench_'
+
+# Stock of the product used by order mutations, large enough to never run out
+HOT_PRODUCT_STOCK = 10 ** 9
+
+# Seeded orders are spread over this many days before now
+ORDER_HISTORY_DAYS = 730
+
+STATUSES = [choice for choice, _ in Order.STATUS_CHOICES]
+
+
+def clear():
+    """Delete every row created by seed()."""
+    # Product ids are reused after a clear, so drop the cached snapshots too
+    product_cache.clear()
+    IdempotencyKey.objects.all().delete()
+    OrderEvent.objects.all().delete()
+    Order.objects.all().delete()
+    Product.objects.all().delete()
+    Customer.objects.all().delete()
+    User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+
+def seed(scale, seed=0):
+    """
+    Replace the CRM data with a dataset of the given scale.
+    Returns a context dict with the ids benchmark operations need.
+    """
+    sizes = SCALES[scale] if isinstance(scale, str) else scale
+    rng = random.Random(seed)
+    now = timezone.now()
+
+    clear()
+
+    # Users and their customer profiles
+    User.objects.bulk_create([
+        User(
+            username=f'{USERNAME_PREFIX}{i}',
+            email=f'{USERNAME_PREFIX}{i}@example.com',
+            first_name='Bench',
+            last_name=str(i),
+        )
+        for i in range(sizes['customers'])
+    ])
+    users = User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('pk')
+    Customer.objects.bulk_create([
+        Customer(user=user, phone=f'+1555{i:07d}', address=f'{i} Benchmark Street')
+        for i, user in enumerate(users)
+    ])
+    customer_ids = list(Customer.objects.order_by('pk').values_list('pk', flat=True))
+
+    # Products; roughly a third of them start below the low-stock threshold
+    Product.objects.bulk_create([
+        Product(
+            name=f'Product {i:05d}',
+            description=f'Benchmark product number {i}',
+            price=Decimal(rng.randint(100, 100000)) / 100,
+            stock=rng.randint(0, 30),
+        )
+        for i in range(sizes['products'] - 1)
+    ] + [
+        Product(name='Hot Product', description='Always in stock', price=Decimal('9.99'), stock=HOT_PRODUCT_STOCK),
+    ])
+    products = list(Product.objects.order_by('pk'))
+    hot_product = products[-1]
+
+    # Orders, spread evenly over the history window
+    orders = []
+    for i in range(sizes['orders']):
+        product = products[rng.randrange(len(products))]
+        quantity = rng.randint(1, 5)
+        orders.append(Order(
+            customer_id=customer_ids[rng.randrange(len(customer_ids))],
+            product=product,
+            quantity=quantity,
+            total_amount=product.price * quantity,
+            status=STATUSES[rng.randrange(len(STATUSES))],
+        ))
+    Order.objects.bulk_create(orders, batch_size=1000)
+
+    # created_at is auto_now_add, so backdate it in a second pass
+    orders = list(Order.objects.order_by('pk').only('pk'))
+    span = timedelta(days=ORDER_HISTORY_DAYS)
+    for order in orders:
+        order.created_at = now - span * rng.random()
+    Order.objects.bulk_update(orders, ['created_at'], batch_size=1000)
+
+    return {
+        'scale': scale,
+        'customer_ids': customer_ids,
+        'product_ids': [product.pk for product in products],
+        'order_ids': [order.pk for order in orders],
+        'hot_product_id': hot_product.pk,
+    }
@@ -0,0 +1,307 @@
+"""
+Cron/Celery Job Benchmark Suite
+Runs the CRM periodic jobs against seeded databases of increasing size and
+records wall time, SQL queries, SQLite work and peak memory for each run.
+
+The jobs talk to the GraphQL endpoint over HTTP, so a live server thread
+is started on the benchmark database and the jobs are pointed at it.
+"""
+
+import contextlib
+import cProfile
+import io
+import math
+import os
+import runpy
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test.testcases import LiveServerThread, _StaticFilesHandler
+from django.test.utils import override_settings
+
+from crm.benchmarks import datasets
+
+CRON_JOBS_DIR = Path(__file__).resolve().parent.parent / 'cron_jobs'
+
+# SQLite calls the progress handler every this many VM instructions
+PROGRESS_STEP = 1000
+
+
+class DatabaseActivity:
+    """
+    Count SQL statements and SQLite VM instructions on every connection,
+    including the ones opened by live server threads while active.
+
+    VM instructions are a proxy for rows scanned: a full table scan costs
+    a handful of instructions per row visited.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.vm_steps = 0
+        self.active = False
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.active:
+            with self._lock:
+                self.queries += 1
+        return execute(sql, params, many, context)
+
+    def _progress(self):
+        if self.active:
+            with self._lock:
+                self.vm_steps += PROGRESS_STEP
+        return 0
+
+    def _install(self, conn):
+        if self not in conn.execute_wrappers:
+            conn.execute_wrappers.append(self)
+        if conn.vendor == 'sqlite':
+            conn.connection.set_progress_handler(self._progress, PROGRESS_STEP)
+
+    def _connection_created(self, sender, connection, **kwargs):
+        self._install(connection)
+
+    def __enter__(self):
+        connection.ensure_connection()
+        self._install(connection)
+        connection_created.connect(self._connection_created)
+        self.active = True
+        return self
+
+    def __exit__(self, *exc_info):
+        self.active = False
+        connection_created.disconnect(self._connection_created)
+        if self in connection.execute_wrappers:
+            connection.execute_wrappers.remove(self)
+        if connection.vendor == 'sqlite' and connection.connection is not None:
+            connection.connection.set_progress_handler(None, 0)
+
+
+@contextlib.contextmanager
+def live_server():
+    """Serve the project on a random local port, yielding its base URL."""
+    server = LiveServerThread('localhost', _StaticFilesHandler)
+    server.daemon = True
+    server.start()
+    server.is_ready.wait()
+    if server.error:
+        raise server.error
+    try:
+        yield f'http://localhost:{server.port}'
+    finally:
+        server.terminate()
+
+
+@contextlib.contextmanager
+def eager_celery():
+    """Execute Celery tasks in-process for the duration of the block."""
+    from crm.celery import app
+
+    previous = app.conf.task_always_eager, app.conf.task_eager_propagates
+    app.conf.task_always_eager = True
+    app.conf.task_eager_propagates = True
+    try:
+        yield app
+    finally:
+        app.conf.task_always_eager, app.conf.task_eager_propagates = previous
+
+
+def run_heartbeat():
+    from crm.cron import log_crm_heartbeat
+    log_crm_heartbeat()
+
+
+def run_low_stock():
+    from crm.cron import update_low_stock
+    update_low_stock()
+
+
+def run_low_stock_reconcile():
+    from crm.low_stock import reconcile
+    reconcile()
+
+
+def run_crm_report():
+    from crm.tasks import generate_crm_report
+    generate_crm_report.delay().get()
+
+
+def run_order_reminders():
+    # A fresh watermark per run, so every run processes the same orders
+    with tempfile.TemporaryDirectory(prefix='crm_bench_') as tmpdir:
+        os.environ['CRM_ORDER_REMINDERS_WATERMARK'] = os.path.join(tmpdir, 'watermark')
+        try:
+            runpy.run_path(str(CRON_JOBS_DIR / 'send_order_reminders.py'), run_name='__main__')
+        finally:
+            os.environ.pop('CRM_ORDER_REMINDERS_WATERMARK', None)
+
+
+def cleanup_script():
+    """Return the Python program the cleanup shell script hands to manage.py shell."""
+    source = (CRON_JOBS_DIR / 'clean_inactive_customers.sh').read_text()
+    start = source.index('PYTHON_SCRIPT="') + len('PYTHON_SCRIPT="')
+    end = source.index('\n"\n', start)
+    return compile(source[start:end], 'clean_inactive_customers.sh', 'exec')
+
+
+def run_customer_cleanup():
+    exec(cleanup_script(), {'__name__': '__main__'})
+
+
+JOBS = {
+    'log_crm_heartbeat': run_heartbeat,
+    'update_low_stock': run_low_stock,
+    'reconcile_low_stock': run_low_stock_reconcile,
+    'generate_crm_report': run_crm_report,
+    'send_order_reminders': run_order_reminders,
+    'clean_inactive_customers': run_customer_cleanup,
+}
+
+
+def call_job(func):
+    """Run a job, swallowing its stdout and exit status."""
+    exit_code = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            func()
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+    return exit_code
+
+
+def run_job(name, scale, restore, profile_dir=None):
+    """
+    Measure one job. `restore` is called before each run so that every
+    run starts from the same seeded data.
+    """
+    func = JOBS[name]
+
+    restore()
+    with DatabaseActivity() as activity:
+        start = time.perf_counter()
+        exit_code = call_job(func)
+        wall_ms = (time.perf_counter() - start) * 1000
+
+    restore()
+    tracemalloc.start()
+    try:
+        call_job(func)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    metrics = {
+        'wall_ms': round(wall_ms, 1),
+        'queries': activity.queries,
+        'vm_steps': activity.vm_steps,
+        'peak_kb': round(peak / 1024, 1),
+        'exit_code': exit_code,
+    }
+
+    if profile_dir:
+        restore()
+        profiler = cProfile.Profile()
+        profiler.runcall(call_job, func)
+        path = Path(profile_dir) / f"{name}-{scale}.prof"
+        profiler.dump_stats(path)
+        metrics['profile'] = str(path)
+
+    return metrics
+
+
+def snapshot_restorer(db_path, scale):
+    """Copy the seeded database aside and return a function restoring it."""
+    connections.close_all()
+    template = f'{db_path}.{scale}'
+    shutil.copyfile(db_path, template)
+
+    def restore():
+        connections.close_all()
+        shutil.copyfile(template, db_path)
+
+    restore.template = template
+    return restore
+
+
+def run_suite(db_path, scales, jobs=None, profile_dir=None, log=None):
+    """
+    Seed each scale once and run every job against a fresh copy of it.
+    Returns {scale: {job: metrics}}.
+    """
+    jobs = jobs or list(JOBS)
+    if profile_dir:
+        Path(profile_dir).mkdir(parents=True, exist_ok=True)
+
+    results = {}
+    with live_server() as base_url, eager_celery():
+        url = f'{base_url}/graphql'
+        heartbeat = {**settings.CRM_HEARTBEAT, 'url': f'{base_url}/readyz'}
+        endpoints = override_settings(CRM_GRAPHQL_ENDPOINT=url, CRM_HEARTBEAT=heartbeat)
+        endpoints.enable()
+        previous_endpoint = os.environ.get('CRM_GRAPHQL_ENDPOINT')
+        os.environ['CRM_GRAPHQL_ENDPOINT'] = url
+        try:
+            for scale in scales:
+                datasets.seed(scale)
+                restore = snapshot_restorer(db_path, scale)
+                results[scale] = {}
+                try:
+                    for name in jobs:
+                        results[scale][name] = run_job(name, scale, restore, profile_dir)
+                        if log:
+                            log(scale, name, results[scale][name])
+                finally:
+                    os.remove(restore.template)
+        finally:
+            endpoints.disable()
+            if previous_endpoint is None:
+                os.environ.pop('CRM_GRAPHQL_ENDPOINT', None)
+            else:
+                os.environ['CRM_GRAPHQL_ENDPOINT'] = previous_endpoint
+    return results
+
+
+def scaling_curves(results, metric='wall_ms'):
+    """
+    Fit metric ~ orders ** exponent per job over the measured scales.
+
+    Returns rows sorted by the projected metric at ten times the largest
+    measured scale, so the job most likely to break first comes first.
+    """
+    points = {}
+    for scale, jobs in results.items():
+        orders = datasets.SCALES[scale]['orders']
+        for name, metrics in jobs.items():
+            points.setdefault(name, []).append((orders, max(metrics[metric], 1e-3)))
+
+    rows = []
+    for name, values in points.items():
+        values.sort()
+        if len(values) > 1:
+            xs = [math.log(x) for x, _ in values]
+            ys = [math.log(y) for _, y in values]
+            mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+            exponent = (
+                sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+                / sum((x - mean_x) ** 2 for x in xs)
+            )
+        else:
+            exponent = 0.0
+        largest = values[-1][1]
+        rows.append({
+            'job': name,
+            'exponent': round(exponent, 2),
+            'largest': round(largest, 1),
+            'projected_10x': round(largest * 10 ** exponent, 1),
+        })
+    rows.sort(key=lambda row: row['projected_10x'], reverse=True)
+    return rows
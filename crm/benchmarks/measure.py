@@ -0,0 +1,67 @@
+"""
+Benchmark Measurement
+Helpers to time a callable and record its SQL query count and peak memory.
+"""
+
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+
+
+class QueryCounter:
+    """
+    Count SQL statements executed on the current thread's connection.
+    Unlike CaptureQueriesContext it does not need DEBUG and has no cap.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+
+def measure(func, repeat=5, warmup=1):
+    """
+    Run func repeatedly and return its metrics.
+
+    latency_ms is the median wall time over `repeat` runs, queries is the
+    number of SQL queries of a single run and peak_kb the peak Python
+    memory allocated by a single run (measured separately, since tracing
+    allocations slows the code down).
+    """
+    for i in range(warmup):
+        func(i)
+
+    timings = []
+    queries = 0
+    for i in range(repeat):
+        with QueryCounter() as counter:
+            start = time.perf_counter()
+            func(warmup + i)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries = counter.count
+
+    tracemalloc.start()
+    try:
+        func(warmup + repeat)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'latency_ms': round(statistics.median(timings), 3),
+        'queries': queries,
+        'peak_kb': round(peak / 1024, 1),
+    }
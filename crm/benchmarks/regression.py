@@ -0,0 +1,76 @@
+"""
+Benchmark Baselines
+Stores benchmark results as JSON and compares new runs against them.
+"""
+
+import json
+from pathlib import Path
+
+BASELINE_DIR = Path(__file__).resolve().parent / 'baselines'
+
+# Allowed relative increase of each metric before a run counts as a regression
+DEFAULT_TOLERANCES = {
+    'latency_ms': 0.5,
+    'queries': 0.0,
+    'peak_kb': 0.25,
+}
+
+# Absolute increase always tolerated, so tiny values don't fail on noise
+ABSOLUTE_SLACK = {
+    'latency_ms': 2.0,
+    'queries': 0,
+    'peak_kb': 64,
+}
+
+
+def baseline_path(name):
+    return BASELINE_DIR / f'{name}.json'
+
+
+def load_baseline(name):
+    """Return the stored results for a suite, or an empty dict."""
+    path = baseline_path(name)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(name, results):
+    """Merge results into the stored baseline of a suite."""
+    baseline = load_baseline(name)
+    for scale, operations in results.items():
+        baseline.setdefault(scale, {}).update(operations)
+    BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(baseline_path(name), 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return baseline
+
+
+def compare(baseline, results, tolerances=None, metrics=None):
+    """
+    Compare results with a baseline.
+    Returns a list of human readable regressions, empty if none.
+    Operations or metrics missing from the baseline are ignored.
+    """
+    tolerances = {**DEFAULT_TOLERANCES, **(tolerances or {})}
+    regressions = []
+
+    for scale, operations in results.items():
+        for operation, values in operations.items():
+            expected = baseline.get(scale, {}).get(operation)
+            if not expected:
+                continue
+            for metric, tolerance in tolerances.items():
+                if metrics and metric not in metrics:
+                    continue
+                if metric not in values or metric not in expected:
+                    continue
+                limit = expected[metric] * (1 + tolerance) + ABSOLUTE_SLACK.get(metric, 0)
+                if values[metric] > limit:
+                    regressions.append(
+                        f"{scale}/{operation}: {metric} {values[metric]} > {expected[metric]} "
+                        f"(+{tolerance:.0%} tolerance)"
+                    )
+    return regressions
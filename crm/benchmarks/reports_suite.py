@@ -0,0 +1,60 @@
+"""
+Reports Benchmark
+Times the sharded weekly report with 1..N worker processes on a generated
+order history and checks every run matches the single-process report.
+"""
+
+import os
+import time
+
+from crm import reports
+from crm.benchmarks import datasets
+from crm.benchmarks.analytics_suite import seed_orders
+
+
+def run_suite(orders, workers=(1, 2, 4), shards=None, repeat=3, log=None):
+    """Seed `orders` orders and build the report with each worker count. Returns the results."""
+    ctx = datasets.seed({'customers': 2000, 'products': 500, 'orders': 0})
+    seed_orders(orders, ctx['customer_ids'], ctx['product_ids'])
+    shards = shards or reports.get_config()['shards']
+
+    # Time of each shard on its own: the work a perfect pool would split
+    start, end = reports.week_bounds()
+    shard_ms = []
+    for low, high in reports.shard_ranges(shards):
+        began = time.perf_counter()
+        reports.aggregate_shard(low, high, start, end)
+        shard_ms.append((time.perf_counter() - began) * 1000)
+
+    results = {
+        'orders': orders,
+        'shards': shards,
+        'cpus': os.cpu_count(),
+        'shard_ms': {'total': round(sum(shard_ms), 1), 'max': round(max(shard_ms, default=0), 1)},
+        'runs': {},
+    }
+    if log:
+        log('setup', {key: value for key, value in results.items() if key != 'runs'})
+
+    expected = None
+    for count in workers:
+        timings = []
+        for _ in range(repeat):
+            began = time.perf_counter()
+            report = reports.build_weekly_report(workers=count, shards=shards)
+            timings.append(time.perf_counter() - began)
+        if expected is None:
+            expected = report
+        elapsed = min(timings)
+        baseline = results['runs'][workers[0]]['s'] if results['runs'] else elapsed
+        metrics = {
+            's': round(elapsed, 3),
+            'speedup': round(baseline / elapsed, 2),
+            'matches': report == expected,
+        }
+        results['runs'][count] = metrics
+        if log:
+            log(f'workers={count}', metrics)
+
+    datasets.clear()
+    return results
@@ -0,0 +1,348 @@
+"""
+GraphQL Schema Benchmark Suite
+Representative queries and mutations of crm.schema, measured for latency,
+SQL query count and peak memory at several dataset scales.
+"""
+
+import statistics
+import threading
+import time
+
+from django.db import connection
+from django.test import RequestFactory
+
+from crm.benchmarks import datasets
+from crm.benchmarks.measure import measure
+from crm.models import Order, Product
+from crm.schema import schema
+
+# Each operation is a GraphQL document and a function building its
+# variables from the seeded dataset context and the iteration number.
+OPERATIONS = {
+    'all_customers_nested': (
+        """
+        query {
+            allCustomers {
+                id
+                phone
+                user { username email }
+                orders { id totalAmount product { name } }
+            }
+        }
+        """,
+        lambda ctx, i: {},
+    ),
+    'all_products': (
+        """
+        query {
+            allProducts { id name price stock }
+        }
+        """,
+        lambda ctx, i: {},
+    ),
+    'all_orders_nested': (
+        """
+        query {
+            allOrders {
+                id
+                quantity
+                totalAmount
+                status
+                createdAt
+                customer { id user { email } }
+                product { id name price }
+            }
+        }
+        """,
+        lambda ctx, i: {},
+    ),
+    'low_stock_products': (
+        """
+        query {
+            lowStockProducts(threshold: 10) { id name stock }
+        }
+        """,
+        lambda ctx, i: {},
+    ),
+    'customer_detail': (
+        """
+        query CustomerDetail($id: ID!) {
+            customer(id: $id) {
+                id
+                phone
+                address
+                user { username email }
+                orders { id status totalAmount }
+            }
+        }
+        """,
+        lambda ctx, i: {'id': ctx['customer_ids'][i % len(ctx['customer_ids'])]},
+    ),
+    'product_detail': (
+        """
+        query ProductDetail($id: ID!) {
+            product(id: $id) { id name description price stock }
+        }
+        """,
+        lambda ctx, i: {'id': ctx['product_ids'][i % len(ctx['product_ids'])]},
+    ),
+    'order_detail': (
+        """
+        query OrderDetail($id: ID!) {
+            order(id: $id) {
+                id
+                totalAmount
+                status
+                customer { user { email } }
+                product { name }
+            }
+        }
+        """,
+        lambda ctx, i: {'id': ctx['order_ids'][i % len(ctx['order_ids'])]},
+    ),
+    'create_customer': (
+        """
+        mutation CreateCustomer($username: String!, $email: String!) {
+            createCustomer(username: $username, email: $email, phone: "+15550000000") {
+                success
+                customer { id }
+            }
+        }
+        """,
+        lambda ctx, i: {
+            'username': f"{datasets.USERNAME_PREFIX}new_{ctx['scale']}_{i}",
+            'email': f"{datasets.USERNAME_PREFIX}new_{i}@example.com",
+        },
+    ),
+    'create_product': (
+        """
+        mutation CreateProduct($name: String!) {
+            createProduct(name: $name, price: 19.99, stock: 5) {
+                success
+                product { id }
+            }
+        }
+        """,
+        lambda ctx, i: {'name': f'New Product {i}'},
+    ),
+    'create_order': (
+        """
+        mutation CreateOrder($customerId: ID!, $productId: ID!) {
+            createOrder(customerId: $customerId, productId: $productId, quantity: 1) {
+                success
+                order { id totalAmount }
+            }
+        }
+        """,
+        lambda ctx, i: {
+            'customerId': ctx['customer_ids'][i % len(ctx['customer_ids'])],
+            'productId': ctx['hot_product_id'],
+        },
+    ),
+    # A new key per iteration: the cost of claiming and storing a key
+    'create_order_idempotent': (
+        """
+        mutation CreateOrder($customerId: ID!, $productId: ID!, $key: String!) {
+            createOrder(customerId: $customerId, productId: $productId, quantity: 1, idempotencyKey: $key) {
+                success
+                order { id totalAmount }
+            }
+        }
+        """,
+        lambda ctx, i: {
+            'customerId': ctx['customer_ids'][i % len(ctx['customer_ids'])],
+            'productId': ctx['hot_product_id'],
+            'key': f"bench-{ctx['scale']}-{i}",
+        },
+    ),
+    # The same key every iteration: a client retry answered from the stored result
+    'create_order_replay': (
+        """
+        mutation CreateOrder($customerId: ID!, $productId: ID!, $key: String!) {
+            createOrder(customerId: $customerId, productId: $productId, quantity: 1, idempotencyKey: $key) {
+                success
+                order { id totalAmount }
+            }
+        }
+        """,
+        lambda ctx, i: {
+            'customerId': ctx['customer_ids'][0],
+            'productId': ctx['hot_product_id'],
+            'key': f"bench-replay-{ctx['scale']}",
+        },
+    ),
+    # increment 0 leaves stock untouched so every iteration does the same work
+    'update_low_stock_products': (
+        """
+        mutation {
+            updateLowStockProducts(threshold: 10, increment: 0) {
+                success
+                updatedProducts { id stock }
+            }
+        }
+        """,
+        lambda ctx, i: {},
+    ),
+}
+
+# Operations whose `success` field must be true
+MUTATIONS = {
+    'create_customer': 'createCustomer',
+    'create_product': 'createProduct',
+    'create_order': 'createOrder',
+    'create_order_idempotent': 'createOrder',
+    'create_order_replay': 'createOrder',
+    'update_low_stock_products': 'updateLowStockProducts',
+}
+
+
+def execute(operation, variables=None):
+    """Execute a GraphQL document against crm.schema, raising on errors."""
+    request = RequestFactory().post('/graphql')
+    result = schema.execute(operation, variable_values=variables, context_value=request)
+    if result.errors:
+        raise RuntimeError(f"GraphQL errors: {result.errors}")
+    return result.data
+
+
+def run_operation(name, ctx, repeat=5):
+    """Measure a single named operation against the seeded dataset."""
+    document, variables = OPERATIONS[name]
+    field = MUTATIONS.get(name)
+
+    def run(i):
+        data = execute(document, variables(ctx, i))
+        if field and not data[field]['success']:
+            raise RuntimeError(f"{name} returned success=false")
+
+    return measure(run, repeat=repeat)
+
+
+def run_concurrent_orders(ctx, threads=8, orders_per_thread=10):
+    """
+    Place orders for the hot product from several threads at once.
+
+    Reports per-order latency, throughput, failed orders and lost stock
+    updates (orders that succeeded but whose decrement was overwritten).
+    Requires a file database that every thread can open.
+    """
+    document, _ = OPERATIONS['create_order']
+    product_id = ctx['hot_product_id']
+    stock_before = Product.objects.get(pk=product_id).stock
+    timings = []
+    outcomes = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker(n):
+        try:
+            barrier.wait()
+            for i in range(orders_per_thread):
+                variables = {
+                    'customerId': ctx['customer_ids'][(n + i) % len(ctx['customer_ids'])],
+                    'productId': product_id,
+                }
+                start = time.perf_counter()
+                try:
+                    success = execute(document, variables)['createOrder']['success']
+                except Exception:
+                    success = False
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    timings.append(elapsed)
+                    outcomes.append(success)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    succeeded = sum(outcomes)
+    stock_after = Product.objects.get(pk=product_id).stock
+    return {
+        'latency_ms': round(statistics.median(timings), 3),
+        'throughput_ops': round(len(outcomes) / wall, 1),
+        'failed': len(outcomes) - succeeded,
+        'lost_updates': succeeded - (stock_before - stock_after),
+    }
+
+
+def run_duplicate_orders(ctx, threads=8):
+    """
+    Send the same createOrder with the same idempotency key from several
+    threads at once, as clients retrying a timed-out request do.
+
+    Exactly one order should be placed and every response should carry it.
+    Requires a file database that every thread can open.
+    """
+    document, variables = OPERATIONS['create_order_replay']
+    variables = {**variables(ctx, 0), 'key': f"bench-duplicate-{ctx['scale']}"}
+    product_id = ctx['hot_product_id']
+    stock_before = Product.objects.get(pk=product_id).stock
+    orders_before = Order.objects.count()
+    timings = []
+    order_ids = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def worker():
+        try:
+            barrier.wait()
+            start = time.perf_counter()
+            try:
+                order = execute(document, variables)['createOrder']['order']
+            except Exception:
+                order = None
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                timings.append(elapsed)
+                order_ids.append(order and order['id'])
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    return {
+        'latency_ms': round(statistics.median(timings), 3),
+        'requests': threads,
+        'orders_placed': Order.objects.count() - orders_before,
+        'stock_taken': stock_before - Product.objects.get(pk=product_id).stock,
+        'distinct_responses': len(set(order_ids)),
+    }
+
+
+def run_suite(scales, operations=None, repeat=5, concurrency=0, log=None):
+    """
+    Seed each scale and measure every operation.
+    Returns {scale: {operation: metrics}}; the concurrent order benchmark
+    is included when `concurrency` (number of threads) is non-zero.
+    """
+    operations = operations or list(OPERATIONS)
+    results = {}
+    for scale in scales:
+        ctx = datasets.seed(scale)
+        results[scale] = {}
+        for name in operations:
+            results[scale][name] = run_operation(name, ctx, repeat=repeat)
+            if log:
+                log(scale, name, results[scale][name])
+        if concurrency:
+            name = 'concurrent_create_order'
+            results[scale][name] = run_concurrent_orders(ctx, threads=concurrency)
+            if log:
+                log(scale, name, results[scale][name])
+            name = 'concurrent_duplicate_order'
+            results[scale][name] = run_duplicate_orders(ctx, threads=concurrency)
+            if log:
+                log(scale, name, results[scale][name])
+    datasets.clear()
+    return results
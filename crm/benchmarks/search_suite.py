@@ -0,0 +1,134 @@
+"""
+Search Benchmark
+Compares the FTS5 index behind crm.search with the icontains scans it
+replaces, on generated product and customer text.
+"""
+
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from crm import search
+from crm.benchmarks.datasets import USERNAME_PREFIX, clear
+from crm.benchmarks.measure import measure
+from crm.models import Customer, Product
+
+# Rows per bulk insert while seeding
+CHUNK = 20000
+
+
+def vocabulary(rng, size=5000):
+    """Pronounceable made-up words, so that every word has a known frequency."""
+    consonants, vowels = 'bcdfghklmnprstvz', 'aeiou'
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def seed(products, customers, seed=0):
+    """
+    Insert `products` products and `customers` customers with Zipf-like word
+    frequencies. Returns the vocabulary ordered from most to least common.
+    """
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    rng.shuffle(words)
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+
+    def text(count):
+        return ' '.join(rng.choices(words, weights, k=count))
+
+    clear()
+    for start in range(0, products, CHUNK):
+        with transaction.atomic():
+            Product.objects.bulk_create([
+                Product(name=text(3).title(), description=f'{text(12)} sku{i:07d}', price=1, stock=1)
+                for i in range(start, min(start + CHUNK, products))
+            ])
+
+    for start in range(0, customers, CHUNK):
+        end = min(start + CHUNK, customers)
+        with transaction.atomic():
+            User.objects.bulk_create([
+                User(
+                    username=f'{USERNAME_PREFIX}{i}',
+                    email=f'{rng.choice(words)}.{i}@example.com',
+                    first_name=text(1).title(),
+                    last_name=text(1).title(),
+                )
+                for i in range(start, end)
+            ])
+            users = User.objects.filter(username__startswith=USERNAME_PREFIX).order_by('-pk')[:end - start]
+            Customer.objects.bulk_create([
+                Customer(user_id=user_id, phone=f'+1555{i:07d}', address=f'{i} {text(2).title()} Street')
+                for i, user_id in enumerate(users.values_list('pk', flat=True), start)
+            ])
+    return words
+
+
+def queries(words, products):
+    """
+    Search texts from common to rare, plus a prefix, two words, an exact
+    SKU (one match) and a miss.
+    """
+    return {
+        'common_word': ('product', words[0]),
+        'mid_word': ('product', words[100]),
+        'rare_word': ('product', words[-1]),
+        'prefix': ('product', words[50][:3]),
+        'two_words': ('product', f'{words[1]} {words[20]}'),
+        'sku': ('product', f'sku{products // 2:07d}'),
+        'no_match': ('product', 'qqqqxyz'),
+        'customer_name': ('customer', words[10]),
+        'customer_email': ('customer', f'{words[30]}.'),
+    }
+
+
+def index_size_kb():
+    """On-disk size of both FTS5 indexes, None if SQLite lacks the dbstat table."""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT sum(pgsize) FROM dbstat "
+                "WHERE name LIKE 'crm_product_search%' OR name LIKE 'crm_customer_search%'"
+            )
+            return round(cursor.fetchone()[0] / 1024, 1)
+    except Exception:
+        return None
+
+
+def run_suite(products, customers, first=20, repeat=5, log=None):
+    """Seed the data and time every query both ways. Returns the results."""
+    start = time.perf_counter()
+    words = seed(products, customers)
+    results = {
+        'rows': {'products': products, 'customers': customers},
+        'seed_s': round(time.perf_counter() - start, 1),
+        'index_kb': index_size_kb(),
+        'queries': {},
+    }
+
+    for name, (kind, text) in queries(words, products).items():
+        match = search.to_match_query(text)
+        hits = len(search.fts_search(kind, match, first))
+        fts = measure(lambda i: search.fts_search(kind, match, first), repeat=repeat)
+        # First `first` matches in table order: stops early, but unranked
+        scan = measure(lambda i: search.fallback_search(kind, text, first), repeat=repeat)
+        # Every match: the least an icontains-based ranking has to read
+        scan_all = measure(lambda i: search.fallback_search(kind, text, None), repeat=repeat)
+        metrics = {
+            'text': text,
+            'hits': hits,
+            'fts_ms': fts['latency_ms'],
+            'icontains_ms': scan['latency_ms'],
+            'icontains_all_ms': scan_all['latency_ms'],
+            'speedup': round(scan['latency_ms'] / fts['latency_ms'], 1) if fts['latency_ms'] else None,
+            'speedup_all': round(scan_all['latency_ms'] / fts['latency_ms'], 1) if fts['latency_ms'] else None,
+        }
+        results['queries'][name] = metrics
+        if log:
+            log(name, metrics)
+    return results
@@ -0,0 +1,122 @@
+"""
+Serialization Benchmark
+Times the JSON encoding and gzip compression of large /graphql responses.
+
+- encode: the allOrders response of `orders` orders (nested customer and
+  product) encoded by graphene-django's json.dumps and by each encoder of
+  crm/encoders.py, and a list of the same orders as ORM values with
+  Decimal and datetime values, which go through the encoders' default().
+- gzip: the encoded response compressed by gzip_stream() at several levels.
+- http: the whole POST /graphql round trip, per encoder, plain and gzipped.
+"""
+
+import json
+import statistics
+import time
+
+from django.test import Client, override_settings
+
+from crm import encoders
+from crm.benchmarks import datasets
+from crm.benchmarks.measure import measure
+from crm.benchmarks.schema_suite import OPERATIONS
+from crm.models import Order
+from crm.schema import schema
+
+QUERY = OPERATIONS['all_orders_nested'][0]
+
+LEVELS = [1, 6, 9]
+
+
+def timed(func, repeat):
+    """Median milliseconds of `repeat` calls of func() after one warmup, and its last result."""
+    result = func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 2), result
+
+
+def graphene_dumps(data, pretty=False):
+    # What graphene-django's GraphQLView.json_encode does
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def available_encoders():
+    names = ['stdlib', 'orjson'] if encoders.HAS_ORJSON else ['stdlib']
+    return {'graphene': graphene_dumps, **{name: encoders.get_encoder(name).encode for name in names}}
+
+
+def run_encode(data, rows, repeat):
+    results = {}
+    for name, encode in available_encoders().items():
+        ms, body = timed(lambda: encode(data), repeat)
+        metrics = {'response_ms': ms, 'bytes': len(body)}
+        if name != 'graphene':
+            metrics['native_values_ms'], _ = timed(lambda: encode(rows), repeat)
+        results[name] = metrics
+    return results
+
+
+def run_gzip(body, repeat, chunk_size=encoders.DEFAULTS['chunk_size']):
+    results = {}
+    for level in LEVELS:
+        ms, compressed = timed(lambda: b''.join(encoders.gzip_stream(body, level, chunk_size)), repeat)
+        results[f'level_{level}'] = {
+            'ms': ms,
+            'bytes': len(compressed),
+            'ratio': round(len(body) / len(compressed), 1),
+        }
+    return results
+
+
+def run_http(repeat):
+    # A host DEBUG's default ALLOWED_HOSTS accepts outside the test runner
+    client = Client(SERVER_NAME='localhost')
+    results = {}
+    for name in available_encoders():
+        if name == 'graphene':
+            continue
+        for compressed in (False, True):
+            headers = {'HTTP_ACCEPT_ENCODING': 'gzip'} if compressed else {}
+
+            def post(i):
+                response = client.post('/graphql', {'query': QUERY}, content_type='application/json', **headers)
+                # Drain the stream, as the server would
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                if response.status_code != 200:
+                    raise RuntimeError(f"GraphQL errors: {body[:500]}")
+                post.size = len(body)
+
+            # The rate limiter would throttle the benchmark itself
+            with override_settings(CRM_RATE_LIMIT={'enabled': False}, CRM_GRAPHQL_RESPONSES={'encoder': name}):
+                metrics = measure(post, repeat=repeat)
+            metrics['bytes'] = post.size
+            results[f"{name}_{'gzip' if compressed else 'plain'}"] = metrics
+    return results
+
+
+def run_suite(orders=10000, repeat=5, log=None):
+    """
+    Seed `orders` orders and run every scenario.
+    Returns {scenario: {variant: metrics}}.
+    """
+    datasets.seed({'customers': max(1, orders // 10), 'products': 100, 'orders': orders})
+    result = schema.execute(QUERY)
+    if result.errors:
+        raise result.errors[0]
+    data = {'data': result.data}
+    rows = list(Order.objects.values('id', 'customer_id', 'product_id', 'quantity', 'total_amount', 'status', 'created_at'))
+
+    results = {
+        'encode': run_encode(data, rows, repeat),
+        'gzip': run_gzip(encoders.get_encoder().encode(data), repeat),
+        'http': run_http(repeat),
+    }
+    if log:
+        for scenario, variants in results.items():
+            for variant, metrics in variants.items():
+                log(scenario, variant, metrics)
+    return results
@@ -0,0 +1,98 @@
+"""
+Startup Benchmark
+Times the cold start of the short-lived processes the CRM runs (cron jobs,
+Celery workers, the cleanup script) in fresh interpreters, and breaks the
+import time of each down by top-level package with `python -X importtime`.
+"""
+
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+SETUP = (
+    "import os, django; "
+    "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx-backend-graphql_crm.settings'); "
+    "django.setup(); "
+)
+
+# Python program run in a fresh interpreter for each startup path
+SCENARIOS = {
+    'interpreter': "pass",
+    'django_setup': SETUP,
+    # django-crontab runs `manage.py crontab run <hash>`, which imports crm.cron
+    'cron_job': SETUP + "import crm.cron",
+    # A Celery worker imports every task module on boot
+    'celery_tasks': SETUP + "import crm.tasks",
+    'schema': SETUP + "from crm.schema import schema",
+    'schema_introspection': SETUP + "from crm.schema import get_introspection; get_introspection()",
+}
+
+
+def child_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_python(code, *options):
+    """
+    Run code in a fresh interpreter from the project directory.
+    Returns (wall seconds, CPU seconds, stderr). CPU time is the steadier
+    measure on a busy machine.
+    """
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    cpu = child_cpu()
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, *options, '-c', code],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - start
+    if process.returncode:
+        raise RuntimeError(f"Startup scenario failed:\n{process.stderr}")
+    return elapsed, child_cpu() - cpu, process.stderr
+
+
+def import_profile(code, top=10):
+    """
+    Import time of `code` by top-level package, from `python -X importtime`.
+    Returns [(package, ms)], slowest first, and the total.
+    """
+    _, _, stderr = run_python(code, '-X', 'importtime')
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    ranked = sorted(packages.items(), key=lambda item: -item[1])
+    total_ms = round(sum(packages.values()) / 1000, 1)
+    return [(package, round(us / 1000, 1)) for package, us in ranked[:top]], total_ms
+
+
+def run_suite(scenarios=None, repeat=10, top=0, log=None):
+    """
+    Time each scenario `repeat` times (after a warm-up run that fills the OS
+    file cache) and optionally profile its imports. Returns the results.
+    """
+    results = {}
+    for name in scenarios or list(SCENARIOS):
+        code = SCENARIOS[name]
+        run_python(code)
+        runs = [run_python(code) for _ in range(repeat)]
+        metrics = {
+            'median_ms': round(statistics.median(wall for wall, _, _ in runs) * 1000, 1),
+            'cpu_ms': round(statistics.median(cpu for _, cpu, _ in runs) * 1000, 1),
+        }
+        if top:
+            packages, metrics['import_ms'] = import_profile(code, top)
+            metrics['packages'] = dict(packages)
+        results[name] = metrics
+        if log:
+            log(name, metrics)
+    return results
@@ -1,5 +1,6 @@
 import os
 from celery import Celery
+from celery.signals import task_prerun
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx-backend-graphql_crm.settings')
@@ -25,6 +26,12 @@ app.conf.update(
     enable_utc=True,
 )
 
+@task_prerun.connect
+def reset_database_routing(**kwargs):
+    # Each task starts reading from replicas until it writes (see crm/routers.py)
+    from crm import routers
+    routers.reset_state()
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
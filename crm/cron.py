@@ -1,150 +1,173 @@
 """
 CRM Cron Jobs
 This module contains functions that can be executed by django-crontab.
+
+Every cron entry imports this module in a fresh process, so HTTP and
+GraphQL client libraries are only imported by the jobs that use them.
 """
 
+import json
 import os
+import statistics
 import sys
-from datetime import datetime
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from crm import graphql_client
+from crm.joblog import job_run
+
+def record_heartbeat_latency(latency_ms, history_file, history_size):
+    """Append a latency to the heartbeat history file and return the history."""
+    try:
+        with open(history_file) as f:
+            history = json.load(f)
+    except (OSError, ValueError):
+        history = []
+    history = (history + [latency_ms])[-history_size:]
+
+    # Write a new file and swap it in, so a crash never leaves half a file
+    tmp_file = f"{history_file}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(history, f)
+    os.replace(tmp_file, history_file)
+    return history
+
+def heartbeat_latency_alert(history, alert_factor, min_samples=12):
+    """
+    Compare the latest latency with the median of the previous ones.
+    Returns the alert details when it is alert_factor times higher, else None.
+    """
+    previous = history[:-1]
+    if len(previous) < min_samples:
+        return None
+    median = statistics.median(previous)
+    if history[-1] <= median * alert_factor:
+        return None
+    return {
+        'latency_ms': history[-1],
+        'median_ms': round(median, 3),
+        'p95_ms': round(statistics.quantiles(previous, n=20)[-1], 3),
+        'samples': len(previous),
+    }
 
 def log_crm_heartbeat():
     """
     Logs a heartbeat message to indicate CRM is alive.
-    Optionally queries GraphQL hello field to verify endpoint responsiveness.
+    Polls the /readyz endpoint (cached dependency probes, no GraphQL
+    introspection) and records its latency, warning when it trends up.
     """
-    
-    # Get current timestamp in DD/MM/YYYY-HH:MM:SS format
-    timestamp = datetime.now().strftime('%d/%m/%Y-%H:%M:%S')
-    
-    # Log file path
-    log_file = '/tmp/crm_heartbeat_log.txt'
-    
-    # Create heartbeat message
-    heartbeat_message = f"{timestamp} CRM is alive"
-    
-    try:
-        # Append to log file (does not overwrite)
-        with open(log_file, 'a') as f:
-            f.write(heartbeat_message + '\n')
-        
-        # Optionally query GraphQL hello field to verify endpoint is responsive
+
+    import requests
+
+    config = settings.CRM_HEARTBEAT
+
+    with job_run('log_crm_heartbeat') as run:
+        run.info("CRM is alive")
+
+        # Check readiness but don't fail the heartbeat if it is down
         try:
-            # GraphQL endpoint
-            graphql_endpoint = "http://localhost:8000/graphql"
-            
-            # GraphQL query for hello field
-            query = gql("""
-                query {
-                    name
-                }
-            """)
-            
-            # Create GraphQL client
-            transport = RequestsHTTPTransport(url=graphql_endpoint)
-            client = Client(transport=transport, fetch_schema_from_transport=True)
-            
-            # Execute the query
-            result = client.execute(query)
-            
-            # Log successful GraphQL query
-            graphql_status = f"{timestamp} GraphQL endpoint responsive: {result.get('name', 'No response')}"
-            with open(log_file, 'a') as f:
-                f.write(graphql_status + '\n')
-                
-        except Exception as graphql_error:
-            # Log GraphQL error but don't fail the heartbeat
-            graphql_error_msg = f"{timestamp} GraphQL endpoint error: {str(graphql_error)}"
-            with open(log_file, 'a') as f:
-                f.write(graphql_error_msg + '\n')
-    
-    except Exception as e:
-        # If we can't write to log file, print to stderr
-        print(f"Error writing heartbeat log: {str(e)}", file=sys.stderr)
-        sys.exit(1)
+            start = time.perf_counter()
+            response = requests.get(config['url'], timeout=config['timeout'])
+            latency_ms = round((time.perf_counter() - start) * 1000, 3)
+            body = response.json()
+
+            run.info(
+                "Readiness checked",
+                http_status=response.status_code,
+                readiness=body.get('status'),
+                latency_ms=latency_ms,
+                failing=[name for name, check in body.get('checks', {}).items() if not check.get('ok')],
+            )
+
+            # Keep the latency history and alert on upward trends
+            history = record_heartbeat_latency(latency_ms, config['history_file'], config['history_size'])
+            alert = heartbeat_latency_alert(history, config['alert_factor'])
+            if alert:
+                run.warning("Readiness latency above trend", **alert)
+
+        except Exception as health_error:
+            run.warning("Readiness check error", error=str(health_error))
 
 def update_low_stock():
     """
     Executes the UpdateLowStockProducts mutation via GraphQL endpoint.
     Logs updated product names and new stock levels.
     """
-    
-    # Get current timestamp
-    timestamp = datetime.now().strftime('%d/%m/%Y-%H:%M:%S')
-    
-    # Log file path
-    log_file = '/tmp/low_stock_updates_log.txt'
-    
-    try:
-        # GraphQL endpoint
-        graphql_endpoint = "http://localhost:8000/graphql"
-        
-        # GraphQL mutation for updating low stock products
-        mutation = gql("""
-            mutation UpdateLowStockProducts($threshold: Int, $increment: Int) {
-                updateLowStockProducts(threshold: $threshold, increment: $increment) {
-                    success
-                    message
-                    updatedProducts {
-                        id
-                        name
-                        stock
-                        price
+
+    with job_run('update_low_stock') as run:
+        try:
+            # GraphQL mutation for updating low stock products
+            mutation = """
+                mutation UpdateLowStockProducts($threshold: Int, $increment: Int) {
+                    updateLowStockProducts(threshold: $threshold, increment: $increment) {
+                        success
+                        message
+                        updatedProducts {
+                            id
+                            name
+                            stock
+                            price
+                        }
                     }
                 }
+            """
+
+            # Execute the mutation
+            variables = {
+                "threshold": 10,
+                "increment": 10
             }
-        """)
-        
-        # Create GraphQL client
-        transport = RequestsHTTPTransport(url=graphql_endpoint)
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-        
-        # Execute the mutation
-        variables = {
-            "threshold": 10,
-            "increment": 10
-        }
-        
-        result = client.execute(mutation, variable_values=variables)
-        
-        # Extract results
-        mutation_result = result.get('updateLowStockProducts', {})
-        success = mutation_result.get('success', False)
-        message = mutation_result.get('message', 'No message')
-        updated_products = mutation_result.get('updatedProducts', [])
-        
-        # Log the results
-        log_message = f"{timestamp} Low stock update initiated"
-        with open(log_file, 'a') as f:
-            f.write(log_message + '\n')
-        
-        if success:
-            log_message = f"{timestamp} {message}"
-            with open(log_file, 'a') as f:
-                f.write(log_message + '\n')
-            
-            # Log each updated product
-            for product in updated_products:
-                product_name = product.get('name', 'Unknown Product')
-                new_stock = product.get('stock', 0)
-                product_id = product.get('id', 'Unknown ID')
-                
-                product_log = f"{timestamp} Updated Product ID: {product_id}, Name: {product_name}, New Stock: {new_stock}"
-                with open(log_file, 'a') as f:
-                    f.write(product_log + '\n')
-        else:
-            error_log = f"{timestamp} Low stock update failed: {message}"
-            with open(log_file, 'a') as f:
-                f.write(error_log + '\n')
-    
-    except Exception as e:
-        # Log error
-        error_message = f"{timestamp} Error in low stock update: {str(e)}"
-        try:
-            with open(log_file, 'a') as f:
-                f.write(error_message + '\n')
-        except:
-            print(f"Error writing to log file: {e}", file=sys.stderr)
-        print(f"Error in low stock update: {str(e)}", file=sys.stderr)
-        sys.exit(1)
+
+            result = graphql_client.execute(mutation, variables)
+
+            # Extract results
+            mutation_result = result.get('updateLowStockProducts', {})
+            success = mutation_result.get('success', False)
+            message = mutation_result.get('message', 'No message')
+            updated_products = mutation_result.get('updatedProducts', [])
+
+            # Log the results
+            run.info("Low stock update initiated", threshold=variables['threshold'], increment=variables['increment'])
+
+            if success:
+                run.info(message)
+
+                # Log each updated product (buffered, no file reopen per product)
+                for product in updated_products:
+                    run.info(
+                        "Updated product",
+                        product_id=product.get('id', 'Unknown ID'),
+                        name=product.get('name', 'Unknown Product'),
+                        stock=product.get('stock', 0),
+                    )
+                    run.count('updated_products')
+            else:
+                run.error("Low stock update failed", detail=message)
+
+        except Exception as e:
+            # Log error
+            run.error("Error in low stock update", error=str(e))
+            print(f"Error in low stock update: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+
+def clean_inactive_customers(days=365):
+    """
+    Deletes customers with no orders, hot or archived, in the last `days`
+    days, with their orders (the clean_inactive_customers.sh cleanup as a
+    Celery beat job).
+    """
+
+    from crm.models import Customer
+
+    with job_run('clean_inactive_customers') as run:
+        cutoff = timezone.now() - timedelta(days=days)
+        # Archived orders too: the archive age may be shorter than `days`
+        inactive = Customer.objects.exclude(orders__created_at__gte=cutoff).exclude(
+            archived_orders__created_at__gte=cutoff,
+        )
+        _, deleted = inactive.delete()
+        for label, count in deleted.items():
+            run.count(label.split('.')[-1].lower(), count)
+        run.info(f"Deleted {deleted.get('crm.Customer', 0)} inactive customers", cutoff=cutoff.isoformat())
+
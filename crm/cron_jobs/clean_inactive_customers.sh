@@ -55,10 +55,11 @@ try:
     all_customers = Customer.objects.all()
     total_customers_before = all_customers.count()
     
-    # Find customers with no orders since one year ago
+    # Find customers with no orders since one year ago, hot or archived
     # This includes customers with no orders at all, and customers whose last order was more than a year ago
     inactive_customers = Customer.objects.filter(
-        ~Q(orders__created_at__gte=one_year_ago)
+        ~Q(orders__created_at__gte=one_year_ago),
+        ~Q(archived_orders__created_at__gte=one_year_ago),
     ).distinct()
     
     # Count how many will be deleted
@@ -1,117 +1,210 @@
 #!/usr/bin/env python3
 """
 Order Reminders Script
-Queries GraphQL endpoint for orders within the last 7 days and logs them.
+Pages through pending orders from the last 7 days via the pendingOrderReminders
+GraphQL query and dispatches reminders in batches through a pluggable sender.
+Only orders newer than the last-run watermark are processed.
 """
 
 import os
 import sys
-from datetime import datetime, timedelta
+import smtplib
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
 from gql import gql, Client
+from gql.transport.exceptions import TransportQueryError
 from gql.transport.requests import RequestsHTTPTransport
 
-# GraphQL endpoint
-GRAPHQL_ENDPOINT = "http://localhost:8000/graphql"
-LOG_FILE = "/tmp/order_reminders_log.txt"
+# Make the crm package importable when run directly by cron
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from crm.joblog import job_run
 
-def log_message(message):
-    """Log message with timestamp to the log file."""
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    log_entry = f"{timestamp} - {message}\n"
-    
-    try:
-        with open(LOG_FILE, 'a') as f:
-            f.write(log_entry)
-    except Exception as e:
-        print(f"Error writing to log file: {e}", file=sys.stderr)
-
-def get_recent_orders():
-    """Query GraphQL for orders within the last 7 days."""
-    
-    # GraphQL query to get orders with customer information
-    query = gql("""
-        query GetRecentOrders {
-            orders {
-                id
-                customer {
-                    user {
-                        email
-                    }
-                }
-                created_at
-                status
-                total_amount
-            }
+# GraphQL endpoint (can be overridden through the environment)
+GRAPHQL_ENDPOINT = os.environ.get('CRM_GRAPHQL_ENDPOINT', "http://localhost:8000/graphql")
+
+# Id of the last order a reminder was dispatched for
+WATERMARK_FILE = os.environ.get('CRM_ORDER_REMINDERS_WATERMARK', "/tmp/order_reminders_watermark.txt")
+
+# Reminder selection
+SINCE_DAYS = 7
+STATUS = 'pending'
+
+# Orders fetched per GraphQL request, reminders per dispatched batch and
+# maximum number of batches being dispatched at the same time. The rate
+# limiter (crm/ratelimit.py) charges a page 1 + PAGE_SIZE x 5 fields: 1501,
+# under its default burst of 2000 cost units
+PAGE_SIZE = 300
+BATCH_SIZE = 50
+MAX_CONCURRENCY = 4
+
+# Times a page refused with a 429 is retried after the endpoint's Retry-After
+RATE_LIMIT_RETRIES = 5
+
+# Reminder sender: "file" (default) or "smtp"
+SENDER = os.environ.get('CRM_REMINDER_SENDER', 'file')
+SMTP_HOST = os.environ.get('CRM_SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.environ.get('CRM_SMTP_PORT', '1025'))
+SMTP_FROM = os.environ.get('CRM_SMTP_FROM', 'crm@localhost')
+
+REMINDERS_QUERY = gql("""
+    query PendingOrderReminders($sinceDays: Int, $status: String, $afterId: ID, $first: Int) {
+        pendingOrderReminders(sinceDays: $sinceDays, status: $status, afterId: $afterId, first: $first) {
+            id
+            customerEmail
+            createdAt
+            status
+            totalAmount
         }
-    """)
-    
+    }
+""")
+
+def format_reminder(order):
+    """One-line description of a reminder."""
+    return (
+        f"Order ID: {order.get('id', 'unknown')}, "
+        f"Customer Email: {order.get('customerEmail') or 'no-email'}, "
+        f"Date: {order.get('createdAt', 'unknown-date')}, "
+        f"Status: {order.get('status', 'unknown-status')}, "
+        f"Amount: {order.get('totalAmount', 'unknown-amount')}"
+    )
+
+class FileSender:
+    """Records each reminder in the job log (/tmp/order_reminders_log.txt)."""
+
+    def __init__(self, run):
+        self.run = run
+
+    def send_batch(self, orders):
+        for order in orders:
+            self.run.info(
+                "Reminder sent",
+                order_id=order.get('id'),
+                customer_email=order.get('customerEmail'),
+                created_at=order.get('createdAt'),
+                status=order.get('status'),
+                total_amount=order.get('totalAmount'),
+            )
+
+class SMTPSender:
+    """
+    Emails reminders over a single SMTP connection per batch.
+    Point CRM_SMTP_HOST/CRM_SMTP_PORT at a local stand-in server
+    (e.g. `python -m aiosmtpd -n`) outside production.
+    """
+
+    def __init__(self, run, host=SMTP_HOST, port=SMTP_PORT, sender=SMTP_FROM):
+        self.run = run
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    def send_batch(self, orders):
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            for order in orders:
+                if not order.get('customerEmail'):
+                    continue
+                message = EmailMessage()
+                message['From'] = self.sender
+                message['To'] = order['customerEmail']
+                message['Subject'] = f"Reminder about your order {order['id']}"
+                message.set_content(format_reminder(order))
+                smtp.send_message(message)
+        self.run.info("Reminder batch emailed", size=len(orders))
+
+SENDERS = {
+    'file': FileSender,
+    'smtp': SMTPSender,
+}
+
+def read_watermark():
+    """Return the id of the last processed order, or None on the first run."""
     try:
-        # Create GraphQL client
-        transport = RequestsHTTPTransport(url=GRAPHQL_ENDPOINT)
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-        
-        # Execute the query
-        result = client.execute(query)
-        
-        return result.get('orders', [])
-        
-    except Exception as e:
-        log_message(f"Error querying GraphQL: {str(e)}")
-        return []
-
-def filter_recent_orders(orders):
-    """Filter orders to only include those from the last 7 days."""
-    seven_days_ago = datetime.now() - timedelta(days=7)
-    recent_orders = []
-    
-    for order in orders:
+        with open(WATERMARK_FILE) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def write_watermark(order_id):
+    """Atomically record the id of the last processed order."""
+    directory = os.path.dirname(WATERMARK_FILE) or '.'
+    fd, path = tempfile.mkstemp(dir=directory, prefix='.order_reminders_')
+    with os.fdopen(fd, 'w') as f:
+        f.write(str(order_id))
+    os.replace(path, WATERMARK_FILE)
+
+def execute_page(client, variables):
+    """Run the reminders query, waiting out the endpoint's rate limit."""
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
         try:
-            # Parse the created_at date
-            order_date = datetime.fromisoformat(order['created_at'].replace('Z', '+00:00'))
-            
-            # Check if order is within last 7 days
-            if order_date >= seven_days_ago:
-                recent_orders.append(order)
-                
-        except Exception as e:
-            log_message(f"Error parsing date for order {order.get('id', 'unknown')}: {str(e)}")
-    
-    return recent_orders
+            return client.execute(REMINDERS_QUERY, variable_values=variables)
+        except TransportQueryError as e:
+            extensions = (e.errors or [{}])[0].get('extensions') or {}
+            if extensions.get('code') != 'RATE_LIMITED' or attempt == RATE_LIMIT_RETRIES:
+                raise
+            time.sleep(extensions.get('retryAfter', 1))
+
+def fetch_pages(client, after_id):
+    """Yield pages of reminder rows with ids greater than after_id."""
+    while True:
+        result = execute_page(client, {
+            'sinceDays': SINCE_DAYS,
+            'status': STATUS,
+            'afterId': after_id,
+            'first': PAGE_SIZE,
+        })
+        page = result.get('pendingOrderReminders') or []
+        if not page:
+            return
+        yield page
+        if len(page) < PAGE_SIZE:
+            return
+        after_id = page[-1]['id']
+
+def dispatch(run, sender, pages, executor, slots):
+    """
+    Send every page in batches, with at most MAX_CONCURRENCY batches in
+    flight. The watermark advances once all batches of a page succeeded.
+    """
+    for page in pages:
+        futures = []
+        for start in range(0, len(page), BATCH_SIZE):
+            batch = page[start:start + BATCH_SIZE]
+            slots.acquire()
+            future = executor.submit(sender.send_batch, batch)
+            future.add_done_callback(lambda _: slots.release())
+            futures.append((future, len(batch)))
+        for future, size in futures:
+            future.result()
+            run.count('reminders', size)
+        write_watermark(page[-1]['id'])
+        run.count('pages')
 
 def main():
     """Main function to process order reminders."""
-    
-    log_message("Starting order reminders processing")
-    
-    try:
-        # Get all orders from GraphQL
-        all_orders = get_recent_orders()
-        
-        if not all_orders:
-            log_message("No orders found or error occurred while fetching orders")
-            return
-        
-        # Filter for recent orders (last 7 days)
-        recent_orders = filter_recent_orders(all_orders)
-        
-        log_message(f"Found {len(recent_orders)} orders within the last 7 days")
-        
-        # Log each order's details
-        for order in recent_orders:
-            order_id = order.get('id', 'unknown')
-            customer_email = order.get('customer', {}).get('user', {}).get('email', 'no-email')
-            order_date = order.get('created_at', 'unknown-date')
-            status = order.get('status', 'unknown-status')
-            total_amount = order.get('total_amount', 'unknown-amount')
-            
-            log_message(f"Order ID: {order_id}, Customer Email: {customer_email}, Date: {order_date}, Status: {status}, Amount: {total_amount}")
-        
-        log_message("Order reminders processing completed successfully")
-        
-    except Exception as e:
-        log_message(f"Unexpected error in main function: {str(e)}")
-        print(f"Error: {str(e)}", file=sys.stderr)
-        sys.exit(1)
+
+    with job_run('send_order_reminders') as run:
+        try:
+            after_id = read_watermark()
+            run.info("Starting order reminders processing", after_id=after_id)
+            sender = SENDERS[SENDER](run)
+
+            # The query is known, so skip the schema introspection round-trip
+            transport = RequestsHTTPTransport(url=GRAPHQL_ENDPOINT)
+            client = Client(transport=transport, fetch_schema_from_transport=False)
+
+            slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+                dispatch(run, sender, fetch_pages(client, after_id), executor, slots)
+
+            run.info(f"Sent reminders for {STATUS} orders within the last {SINCE_DAYS} days")
+
+        except Exception as e:
+            run.error("Unexpected error in main function", error=str(e))
+            print(f"Error: {str(e)}", file=sys.stderr)
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,51 @@
+"""
+SQLite backend with a production tuning profile.
+
+Django's SQLite backend with two extra OPTIONS:
+
+- 'pragmas': PRAGMA name -> value applied to every new connection
+  (journal_mode, synchronous, cache_size, mmap_size, busy_timeout, ...).
+- 'transaction_mode': DEFERRED (SQLite's default), IMMEDIATE or EXCLUSIVE,
+  used to BEGIN every atomic() block. IMMEDIATE takes the write lock up
+  front, so concurrent writers queue on busy_timeout instead of failing
+  with "database is locked" when a read lock can't be upgraded.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = dict(options.get('pragmas', {}))
+        self.transaction_mode = (options.get('transaction_mode') or 'DEFERRED').upper()
+
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}, "
+                f"not {self.transaction_mode!r}"
+            )
+        for name, value in self.pragmas.items():
+            if not name.isidentifier() or not str(value).replace('-', '').isalnum():
+                raise ImproperlyConfigured(f"Invalid SQLite pragma: {name} = {value}")
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        # Not sqlite3.connect() arguments
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
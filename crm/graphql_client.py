@@ -0,0 +1,97 @@
+"""
+CRM GraphQL Client
+gql client for the cron jobs and Celery tasks that call the CRM's own
+GraphQL endpoint.
+
+gql and requests are imported on first use, so processes that load
+crm.cron or crm.tasks without running such a job (Celery workers, other
+cron entries) don't pay for them. The server's introspection result is
+cached in a file for CRM_GRAPHQL_CLIENT['schema_ttl'] seconds: clients
+still validate queries locally, without an introspection round trip on
+every run.
+"""
+
+import json
+import os
+import time
+
+from django.conf import settings
+
+DEFAULTS = {
+    # File holding the endpoint's introspection result
+    'schema_cache': '/tmp/crm_graphql_schema.json',
+    # Seconds the cached introspection result is used
+    'schema_ttl': 3600.0,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_GRAPHQL_CLIENT', {})}
+
+
+def load_introspection(url):
+    """Cached introspection result for url, or None when missing or expired."""
+    config = get_config()
+    try:
+        if time.time() - os.path.getmtime(config['schema_cache']) > config['schema_ttl']:
+            return None
+        with open(config['schema_cache']) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cached['introspection'] if cached.get('url') == url else None
+
+
+def save_introspection(url, introspection):
+    path = get_config()['schema_cache']
+    # Write a new file and swap it in, so readers never see half a file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'url': url, 'introspection': introspection}, f)
+    os.replace(tmp_path, path)
+
+
+def _execute(url, run):
+    """Call run(client) with a client validating against the cached schema, else a fresh one."""
+    from gql import Client
+    from gql.transport.requests import RequestsHTTPTransport
+    from graphql import GraphQLError
+
+    introspection = load_introspection(url)
+    if introspection is not None:
+        client = Client(transport=RequestsHTTPTransport(url=url), introspection=introspection)
+        try:
+            return run(client)
+        except GraphQLError:
+            # Local validation failed: the cached schema may predate a deploy
+            pass
+
+    client = Client(transport=RequestsHTTPTransport(url=url), fetch_schema_from_transport=True)
+    result = run(client)
+    save_introspection(url, client.introspection)
+    return result
+
+
+def execute(query, variables=None, url=None):
+    """
+    Execute a GraphQL document against the CRM endpoint and return its data.
+    Raises on transport errors and GraphQL errors, like gql's Client.execute().
+    """
+    from gql import gql
+
+    document = gql(query)
+    return _execute(url or settings.CRM_GRAPHQL_ENDPOINT, lambda client: client.execute(document, variable_values=variables))
+
+
+def execute_batch(queries, url=None):
+    """
+    Execute several GraphQL documents (strings, or (query, variables) pairs)
+    in one HTTP request and return their data, in order.
+    """
+    from gql import GraphQLRequest, gql
+
+    requests = [
+        GraphQLRequest(gql(query), variable_values=variables)
+        for query, variables in ((query, None) if isinstance(query, str) else query for query in queries)
+    ]
+    return _execute(url or settings.CRM_GRAPHQL_ENDPOINT, lambda client: client.execute_batch(requests))
@@ -0,0 +1,116 @@
+"""
+CRM Health Checks
+Dependency probes behind the /readyz endpoint. Probe results are cached for
+a few seconds so frequent readiness checks don't hammer the database,
+cache or broker.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULTS = {
+    # Seconds a probe result is reused before the dependency is pinged again
+    'ttl': 5.0,
+    # Probes that must pass for the service to be ready; others only degrade it
+    'required': ['database', 'cache', 'schema'],
+    # Seconds to wait for the broker connection
+    'broker_timeout': 1.0,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_HEALTH', {})}
+
+
+def check_database():
+    from django.db import connection
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1')
+        cursor.fetchone()
+
+
+def check_cache():
+    from django.core.cache import cache
+    cache.set('crm:healthcheck', 1, 10)
+    if cache.get('crm:healthcheck') != 1:
+        raise RuntimeError("cache did not return the probe value")
+
+
+def check_broker():
+    from crm.celery import app
+    with app.connection_for_write() as conn:
+        conn.ensure_connection(max_retries=0, interval_start=0, timeout=get_config()['broker_timeout'])
+
+
+def check_schema():
+    from graphene_django.settings import graphene_settings
+    schema = graphene_settings.SCHEMA
+    if schema is None or schema.graphql_schema.query_type is None:
+        raise RuntimeError("GraphQL schema is not loaded")
+
+
+PROBES = {
+    'database': check_database,
+    'cache': check_cache,
+    'broker': check_broker,
+    'schema': check_schema,
+}
+
+_results = {}
+_locks = {name: threading.Lock() for name in PROBES}
+
+
+def run_probe(name, fresh=False):
+    """
+    Return {'ok', 'latency_ms', 'error', 'checked_at'} for one probe,
+    reusing a result younger than the configured ttl unless `fresh`.
+    While one thread refreshes an expired result, others get the old one.
+    """
+    ttl = get_config()['ttl']
+    result = _results.get(name)
+    if not fresh and result and time.monotonic() - result['_at'] < ttl:
+        return result
+
+    lock = _locks[name]
+    if not lock.acquire(blocking=result is None or fresh):
+        return result
+    try:
+        start = time.perf_counter()
+        error = None
+        try:
+            PROBES[name]()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        result = {
+            'ok': error is None,
+            'latency_ms': round((time.perf_counter() - start) * 1000, 3),
+            'error': error,
+            'checked_at': time.time(),
+            '_at': time.monotonic(),
+        }
+        _results[name] = result
+        return result
+    finally:
+        lock.release()
+
+
+def readiness(fresh=False):
+    """
+    Run every probe and return (status, checks) where status is "ok",
+    "degraded" (an optional probe failed) or "unavailable".
+    """
+    required = get_config()['required']
+    checks = {}
+    for name in PROBES:
+        result = run_probe(name, fresh=fresh)
+        checks[name] = {key: value for key, value in result.items() if not key.startswith('_')}
+
+    if any(not checks[name]['ok'] for name in required if name in checks):
+        status = 'unavailable'
+    elif any(not check['ok'] for check in checks.values()):
+        status = 'degraded'
+    else:
+        status = 'ok'
+    return status, checks
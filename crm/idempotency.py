@@ -0,0 +1,127 @@
+"""
+CRM Idempotency Keys
+Lets clients retry order mutations safely: a mutation run with an
+idempotency key executes once, and every retry with the same key gets the
+stored result back instead of executing again.
+
+The key is claimed with an INSERT that ignores conflicts, in the same
+transaction as the mutation's own writes and its stored result. A
+concurrent duplicate therefore waits on the claim (the primary's write lock
+or the unique index) until the first request commits, then replays its
+result; if the first request rolls back, the duplicate executes instead.
+Keys expire after CRM_IDEMPOTENCY['ttl'] seconds and are deleted in batches
+by the prune_idempotency_keys task.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from crm.models import IdempotencyKey
+
+DEFAULTS = {
+    # Seconds a key (and the result stored with it) is kept
+    'ttl': 24 * 3600,
+    # Expired keys deleted per statement by prune_expired()
+    'prune_batch_size': 5000,
+}
+
+KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+class IdempotencyError(Exception):
+    """Invalid key, or a key already used for a request with other arguments."""
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_IDEMPOTENCY', {})}
+
+
+def fingerprint(arguments):
+    """Short hash of the mutation arguments."""
+    data = json.dumps(arguments, sort_keys=True, default=str).encode()
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def claim(operation, key, digest, using):
+    """
+    Insert the key unless it already exists. Returns None when this request
+    claimed it, otherwise the stored (live) IdempotencyKey row.
+    """
+    connection = connections[using]
+    ops = connection.ops
+    columns = ['operation', 'key', 'fingerprint', 'expires_at']
+    sql = (
+        f"{ops.insert_statement(on_conflict=OnConflict.IGNORE)} "
+        f"{ops.quote_name(IdempotencyKey._meta.db_table)} "
+        f"({', '.join(ops.quote_name(column) for column in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"{ops.on_conflict_suffix_sql(None, OnConflict.IGNORE, None, None)}"
+    )
+    now = timezone.now()
+    expires_at = ops.adapt_datetimefield_value(now + timedelta(seconds=get_config()['ttl']))
+    # Retried once when the existing key turns out to be expired
+    for _ in range(2):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [operation, key, digest, expires_at])
+            if cursor.rowcount:
+                return None
+        stored = IdempotencyKey.objects.using(using).filter(operation=operation, key=key).first()
+        if stored is not None and stored.expires_at > now:
+            return stored
+        if stored is not None:
+            IdempotencyKey.objects.using(using).filter(pk=stored.pk, expires_at__lte=now).delete()
+    raise RuntimeError(f"Could not claim idempotency key {key!r}")
+
+
+def run(operation, key, arguments, execute, dump, load):
+    """
+    Run `execute()` once per (operation, key) and return its result.
+
+    `dump(result)` turns the result into JSON-serializable data to store,
+    and `load(data)` rebuilds a result from it on replay. Without a key
+    `execute()` just runs. Raises IdempotencyError when the key was used with
+    different arguments or is empty or too long.
+    """
+    if key is None:
+        return execute()
+    if not key or len(key) > KEY_LENGTH:
+        raise IdempotencyError(f"Idempotency keys must be 1 to {KEY_LENGTH} characters")
+
+    digest = fingerprint(arguments)
+    using = router.db_for_write(IdempotencyKey)
+    # The claim, the mutation and its stored result commit (or roll back) together
+    with transaction.atomic(using=using, savepoint=False):
+        stored = claim(operation, key, digest, using)
+        if stored is None:
+            result = execute()
+            IdempotencyKey.objects.using(using).filter(operation=operation, key=key).update(response=dump(result))
+            return result
+
+    # Outside the block, so a rejected key doesn't break an enclosing transaction
+    if stored.fingerprint != digest:
+        raise IdempotencyError(f"Idempotency key {key!r} was already used with different arguments")
+    return load(stored.response)
+
+
+def prune_expired(batch_size=None, log=None):
+    """Delete expired keys in batches. Returns the number deleted."""
+    batch_size = batch_size or get_config()['prune_batch_size']
+    total = 0
+    while True:
+        now = timezone.now()
+        ids = list(
+            IdempotencyKey.objects.filter(expires_at__lte=now).order_by('expires_at')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return total
+        deleted, _ = IdempotencyKey.objects.filter(pk__in=ids, expires_at__lte=now).delete()
+        total += deleted
+        if log:
+            log(deleted)
@@ -0,0 +1,290 @@
+"""
+CRM Job Logging
+Structured logging shared by the cron jobs, Celery tasks and cron_jobs scripts.
+
+Each job appends JSON lines to its own log file, for example:
+
+    {"ts": "2024-01-15T08:00:00.123+00:00", "level": "INFO", "job": "update_low_stock",
+     "run_id": "3f2a9c1b7d4e", "message": "Run finished", "status": "ok",
+     "duration_ms": 41.7, "counts": {"updated_products": 3}}
+
+Records are buffered in memory and appended with one write per record, so
+the prefork workers of a job can share its file without interleaving
+partial lines. Rotation is left to an external tool such as logrotate:
+the file is reopened once it has been moved away. With the `queue` option
+records are handed to a background thread, so hot loops never block on
+file I/O; the end of a run waits until its records are written. Configure
+through the CRM_JOB_LOG setting.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+DEFAULTS = {
+    # Directory of the job log files
+    'directory': '/tmp',
+    # Bytes of records kept in memory per log file and the longest time
+    # records stay there
+    'buffer_size': 64 * 1024,
+    'flush_interval': 1.0,
+    # Write records from a background thread instead of the calling thread
+    'queue': False,
+}
+
+# Log file of each job inside the log directory
+JOB_LOG_FILES = {
+    'log_crm_heartbeat': 'crm_heartbeat_log.txt',
+    'update_low_stock': 'low_stock_updates_log.txt',
+    'generate_crm_report': 'crm_report_log.txt',
+    'send_order_reminders': 'order_reminders_log.txt',
+    'clean_inactive_customers': 'customer_cleanup_log.txt',
+    'archive_old_orders': 'order_archive_log.txt',
+    'generate_weekly_report': 'weekly_report_log.txt',
+    'prune_idempotency_keys': 'idempotency_prune_log.txt',
+    'low_stock_alerts': 'low_stock_alerts_log.txt',
+    'refresh_rfm_scores': 'rfm_refresh_log.txt',
+    'rescore_rfm': 'rfm_rescore_log.txt',
+}
+
+_lock = threading.Lock()
+_handlers = {}
+# Queue listeners by job, in queue mode
+_listeners = {}
+
+
+def get_config():
+    """Return DEFAULTS updated with settings.CRM_JOB_LOG, when Django settings are available."""
+    config = dict(DEFAULTS)
+    try:
+        from django.conf import settings
+        config.update(getattr(settings, 'CRM_JOB_LOG', {}))
+    except Exception:
+        # Standalone scripts may run without Django settings
+        pass
+    return config
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'job': getattr(record, 'job', record.name),
+            'run_id': getattr(record, 'run_id', None),
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'data', None) or {})
+        if record.exc_info:
+            entry['error'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class BufferedWatchedFileHandler(logging.handlers.WatchedFileHandler):
+    """
+    WatchedFileHandler that keeps formatted records in memory instead of
+    writing each one. They are written when buffer_size bytes are waiting,
+    when flush_interval has passed, on ERROR records and on close, with
+    one unbuffered append per record: writes from other processes land
+    between whole lines. The file is checked for rotation once per flush.
+    """
+
+    def __init__(self, filename, buffer_size, flush_interval):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._records = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+        super().__init__(filename, encoding='utf-8', delay=True)
+
+    def _open(self):
+        return open(self.baseFilename, 'ab', buffering=0)
+
+    def emit(self, record):
+        try:
+            line = (self.format(record) + self.terminator).encode(self.encoding)
+            self._records.append(line)
+            self._size += len(line)
+            if (
+                record.levelno >= logging.ERROR
+                or self._size >= self.buffer_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        with self.lock:
+            self._last_flush = time.monotonic()
+            if not self._records:
+                return
+            # Reopens the file if logrotate moved it away
+            self.reopenIfNeeded()
+            if self.stream is None:
+                self.stream = self._open()
+                self._statstream()
+            for line in self._records:
+                self.stream.write(line)
+            self._records.clear()
+            self._size = 0
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class JobQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps tracebacks as a separate field instead of folding them into the message."""
+
+    def prepare(self, record):
+        if record.exc_info:
+            record = copy.copy(record)
+            error = logging.Formatter().formatException(record.exc_info)
+            record.data = {**(getattr(record, 'data', None) or {}), 'error': error}
+            record.exc_info = None
+            record.exc_text = None
+        return super().prepare(record)
+
+
+class JobQueueListener(logging.handlers.QueueListener):
+    """QueueListener that can flush its handlers once the records queued before are written."""
+
+    def handle(self, record):
+        if isinstance(record, threading.Event):
+            for handler in self.handlers:
+                handler.flush()
+            record.set()
+            return
+        super().handle(record)
+
+    def flush(self, timeout=5.0):
+        done = threading.Event()
+        self.queue.put_nowait(done)
+        done.wait(timeout)
+
+
+def _stop_listeners():
+    for listener in _listeners.values():
+        listener.stop()
+    _listeners.clear()
+
+
+def get_handler(job):
+    """Return the (shared) file handler writing the log file of a job."""
+    with _lock:
+        if job in _handlers:
+            return _handlers[job]
+
+        config = get_config()
+        filename = JOB_LOG_FILES.get(job, f'{job}_log.txt')
+        handler = BufferedWatchedFileHandler(
+            os.path.join(config['directory'], filename),
+            buffer_size=config['buffer_size'],
+            flush_interval=config['flush_interval'],
+        )
+        handler.setFormatter(JsonLinesFormatter())
+
+        logger = logging.getLogger(f'crm.jobs.{job}')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        if config['queue']:
+            records = queue.SimpleQueue()
+            listener = JobQueueListener(records, handler)
+            listener.start()
+            if not _listeners:
+                atexit.register(_stop_listeners)
+            _listeners[job] = listener
+            logger.addHandler(JobQueueHandler(records))
+        else:
+            logger.addHandler(handler)
+
+        _handlers[job] = handler
+        return handler
+
+
+def flush(job):
+    """Write out the buffered records of a job, including those still queued."""
+    listener = _listeners.get(job)
+    if listener is not None:
+        listener.flush()
+    get_handler(job).flush()
+
+
+def get_logger(job):
+    """Return the logger of a job, configuring its handler on first use."""
+    get_handler(job)
+    return logging.getLogger(f'crm.jobs.{job}')
+
+
+class JobRun:
+    """
+    One execution of a job. Records carry the job name and run id; on
+    exit a summary record with the status, duration and counters is written.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.run_id = uuid.uuid4().hex[:12]
+        self.counts = {}
+        self.logger = get_logger(job)
+        self.started = None
+
+    def log(self, level, message, exc_info=None, **data):
+        self.logger.log(
+            level, message, exc_info=exc_info,
+            extra={'job': self.job, 'run_id': self.run_id, 'data': data},
+        )
+
+    def info(self, message, **data):
+        self.log(logging.INFO, message, **data)
+
+    def warning(self, message, **data):
+        self.log(logging.WARNING, message, **data)
+
+    def error(self, message, **data):
+        self.log(logging.ERROR, message, **data)
+
+    def count(self, name, amount=1):
+        """Add to one of the counters reported when the run finishes."""
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        summary = {'duration_ms': duration_ms, 'counts': self.counts}
+        if exc_type is None:
+            self.info("Run finished", status='ok', **summary)
+        elif issubclass(exc_type, SystemExit):
+            # The job already logged why it exits, only record the code
+            status = 'ok' if not exc_value.code else 'error'
+            self.log(
+                logging.INFO if status == 'ok' else logging.ERROR, "Run finished",
+                status=status, exit_code=exc_value.code, **summary,
+            )
+        else:
+            self.log(
+                logging.ERROR, "Run failed", exc_info=(exc_type, exc_value, traceback),
+                status='error', **summary,
+            )
+        # Short-lived cron processes should not hold records until exit
+        flush(self.job)
+        return False
+
+
+def job_run(job):
+    """Start logging one run of a job: `with job_run('update_low_stock') as run: ...`"""
+    return JobRun(job)
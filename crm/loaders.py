@@ -0,0 +1,145 @@
+"""
+CRM Request Loaders
+Per-request batching and caching of related objects (the DataLoader
+pattern), so nested fields don't run one query per parent.
+
+List resolvers announce the keys their children will need with want();
+the first load() that misses fetches every wanted key in one query, and
+later loads are served from the cache. Fetched objects in turn announce
+the keys of their own nested fields, so each level of a query costs one
+query however many parents it has (two for the hot and archived orders
+of customers and products). The loaders live on the request, so every
+operation of a batched request shares them. Mutations clear them (see
+crm.views.GraphQLView), since they may change cached objects.
+"""
+
+import threading
+
+from django.contrib.auth.models import User
+from django.db import connections, router
+
+from crm.models import ArchivedOrder, Customer, Order, Product
+
+
+class Loader:
+    """
+    Objects of one model by primary key or, with `field`, lists of objects
+    by the value of that field (e.g. a customer's orders by customer_id).
+    `on_fetch(objects)` is called with every batch of fetched objects.
+    """
+
+    def __init__(self, model, on_fetch=None, field=None):
+        self.model = model
+        self.on_fetch = on_fetch
+        self.field = field
+        self._cache = {}
+        self._wanted = set()
+        self._lock = threading.Lock()
+
+    def want(self, keys):
+        """Keys fetched along with the next miss."""
+        with self._lock:
+            self._wanted.update(key for key in keys if key is not None and key not in self._cache)
+
+    def prime(self, key, value):
+        with self._lock:
+            self._cache.setdefault(key, value)
+
+    def load(self, key):
+        if key is None:
+            return [] if self.field else None
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+            keys = self._wanted | {key}
+            self._wanted = set()
+            fetched = self.fetch(keys)
+            self._cache.update(fetched)
+        if self.on_fetch:
+            # Outside the lock: it calls other loaders, which may be fetching in other threads
+            values = fetched.values()
+            self.on_fetch([obj for value in values for obj in (value if self.field else [value]) if obj is not None])
+        return fetched[key]
+
+    def fetch(self, keys):
+        if self.field is None:
+            found = self.model.objects.in_bulk(keys)
+            return {key: found.get(key) for key in keys}
+        return self.fetch_lists(self.model, keys)
+
+    def fetch_lists(self, model, keys):
+        """{key: [objects of `model` whose field is key]}"""
+        # One IN (...) per chunk, within the database's parameter limit
+        size = connections[router.db_for_read(model)].features.max_query_params or len(keys)
+        keys = sorted(keys)
+        grouped = {key: [] for key in keys}
+        for start in range(0, len(keys), size):
+            for obj in model.objects.filter(**{f'{self.field}__in': keys[start:start + size]}):
+                grouped[getattr(obj, self.field)].append(obj)
+        return grouped
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._wanted.clear()
+
+
+class OrderListLoader(Loader):
+    """
+    Orders by `field` (customer_id or product_id), hot and archived ones as
+    Order instances, newest first like the related managers.
+    """
+
+    def __init__(self, on_fetch, field):
+        super().__init__(Order, on_fetch, field)
+
+    def fetch(self, keys):
+        # Hot table first: an order archived in between is read twice and
+        # its archived copy dropped, instead of being missed
+        grouped = self.fetch_lists(Order, keys)
+        seen = {order.pk for orders in grouped.values() for order in orders}
+        for key, archived in self.fetch_lists(ArchivedOrder, keys).items():
+            if archived:
+                grouped[key] += [order.as_order() for order in archived if order.pk not in seen]
+                grouped[key].sort(key=lambda order: order.created_at, reverse=True)
+        return grouped
+
+
+class Loaders:
+    """The loaders of one request."""
+
+    def __init__(self):
+        self.user = Loader(User)
+        self.customer = Loader(Customer, self.want_for_customers)
+        self.product = Loader(Product, self.want_for_products)
+        self.customer_orders = OrderListLoader(self.want_for_orders, field='customer_id')
+        self.product_orders = OrderListLoader(self.want_for_orders, field='product_id')
+
+    def want_for_customers(self, customers):
+        """Announce the related objects the customers' nested fields may load."""
+        self.user.want(customer.user_id for customer in customers)
+        self.customer_orders.want(customer.pk for customer in customers)
+
+    def want_for_products(self, products):
+        self.product_orders.want(product.pk for product in products)
+
+    def want_for_orders(self, orders):
+        self.customer.want(order.customer_id for order in orders)
+        self.product.want(order.product_id for order in orders)
+
+    def clear(self):
+        for loader in (self.user, self.customer, self.product, self.customer_orders, self.product_orders):
+            loader.clear()
+
+
+def get_loaders(context):
+    """
+    Loaders stored on the GraphQL context (the request). Without a context
+    a fresh, unshared set is returned.
+    """
+    if context is None:
+        return Loaders()
+    loaders = getattr(context, 'crm_loaders', None)
+    if loaders is None:
+        loaders = context.crm_loaders = Loaders()
+    return loaders
@@ -0,0 +1,249 @@
+"""
+CRM Job Locks
+Locks that keep two runs of a periodic job from overlapping, and the
+duration and outcome of each job's runs.
+
+The 'redis' backend shares locks between every node: a lock is a key set
+with NX and an expiry, released only by the token that took it, so a run
+that outlived its `ttl` can't release its successor's lock. While Redis
+is unreachable, locks fall back to the `fallback` backend. The 'file'
+backend holds an flock(2) on a file per job, which protects one node and
+is released by the kernel when a worker dies.
+
+Configure through the CRM_JOB_LOCKS setting.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+DEFAULTS = {
+    # 'redis' (shared between nodes) or 'file' (one node)
+    'backend': 'redis',
+    'redis_url': 'redis://localhost:6379/2',
+    # Backend used while Redis is unreachable; None raises instead
+    'fallback': 'file',
+    # Lock files and run records of the file backend
+    'directory': '/tmp/crm_locks',
+    # Seconds after which a Redis lock expires; keep above the task's time_limit
+    'ttl': 3600,
+    # Per job overrides of ttl
+    'ttls': {},
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_JOB_LOCKS', {})}
+
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class Lock:
+    """A held lock; release() it once the run is over."""
+
+    def __init__(self, backend, name, token):
+        self.backend = backend
+        self.name = name
+        self.token = token
+
+    def release(self):
+        self.backend.release(self.name, self.token)
+
+
+class RedisLocks:
+    """Locks and run records in Redis. Raises redis.RedisError when unreachable."""
+
+    prefix = 'crm:job:'
+
+    def __init__(self, url):
+        import redis
+
+        self.errors = redis.RedisError
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._release = self.client.register_script(RELEASE_SCRIPT)
+
+    def acquire(self, name, ttl):
+        token = uuid.uuid4().hex
+        if self.client.set(f'{self.prefix}lock:{name}', token, nx=True, px=int(ttl * 1000)):
+            return Lock(self, name, token)
+        return None
+
+    def release(self, name, token):
+        try:
+            self._release(keys=[f'{self.prefix}lock:{name}'], args=[token])
+        except self.errors:
+            # Expires after its ttl
+            pass
+
+    def record(self, name, status, duration_ms):
+        key = f'{self.prefix}runs:{name}'
+        pipe = self.client.pipeline()
+        pipe.hincrby(key, 'skipped' if status == 'skipped' else 'runs', 1)
+        pipe.hset(key, mapping=run_fields(status, duration_ms))
+        pipe.execute()
+        if duration_ms is not None:
+            # Compare and set: several nodes may finish runs at once
+            self.client.eval(
+                "if tonumber(redis.call('HGET', KEYS[1], 'max_duration_ms') or '0') < tonumber(ARGV[1]) then "
+                "redis.call('HSET', KEYS[1], 'max_duration_ms', ARGV[1]) end",
+                1, key, duration_ms,
+            )
+
+    def runs(self, name):
+        fields = self.client.hgetall(f'{self.prefix}runs:{name}')
+        return decode_runs({key.decode(): value.decode() for key, value in fields.items()})
+
+
+class FileLocks:
+    """Locks held with flock(2) and run records in JSON files, in one directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = {}
+
+    def path(self, name, suffix):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f'{name}.{suffix}')
+
+    def acquire(self, name, ttl):
+        fd = os.open(self.path(name, 'lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        token = uuid.uuid4().hex
+        self._files[token] = fd
+        return Lock(self, name, token)
+
+    def release(self, name, token):
+        fd = self._files.pop(token, None)
+        if fd is not None:
+            # Closing the file drops the lock
+            os.close(fd)
+
+    def record(self, name, status, duration_ms):
+        # Only the lock holder writes, apart from skip counts, which may
+        # occasionally be lost to a concurrent write
+        runs = self.runs(name)
+        counter = 'skipped' if status == 'skipped' else 'runs'
+        runs[counter] = runs.get(counter, 0) + 1
+        runs.update(run_fields(status, duration_ms))
+        if duration_ms is not None:
+            runs['max_duration_ms'] = max(runs.get('max_duration_ms') or 0, duration_ms)
+        path = self.path(name, 'json')
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f'.{name}.')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(runs, f)
+        os.replace(tmp_path, path)
+
+    def runs(self, name):
+        try:
+            with open(self.path(name, 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+def run_fields(status, duration_ms):
+    """Fields describing the latest run (or skip) of a job."""
+    fields = {'last_status': status, 'last_at': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+    if duration_ms is not None:
+        fields['last_duration_ms'] = duration_ms
+    return fields
+
+
+def decode_runs(fields):
+    for key in ('runs', 'skipped'):
+        if key in fields:
+            fields[key] = int(fields[key])
+    for key in ('last_duration_ms', 'max_duration_ms'):
+        if key in fields:
+            fields[key] = float(fields[key])
+    return fields
+
+
+_backends = {}
+
+
+def get_backend(name=None):
+    config = get_config()
+    name = name or config['backend']
+    key = (name, config['redis_url'], config['directory'])
+    if key not in _backends:
+        _backends[key] = RedisLocks(config['redis_url']) if name == 'redis' else FileLocks(config['directory'])
+    return _backends[key]
+
+
+def with_fallback(operation):
+    """Run operation(backend) on the configured backend, or on the fallback while Redis is down."""
+    config = get_config()
+    backend = get_backend()
+    try:
+        return operation(backend)
+    except getattr(backend, 'errors', ()):
+        if not config['fallback']:
+            raise
+        return operation(get_backend(config['fallback']))
+
+
+def acquire(name, ttl=None):
+    """Take the lock of job `name`. Returns a Lock, or None while another run holds it."""
+    config = get_config()
+    ttl = ttl or config['ttls'].get(name, config['ttl'])
+    return with_fallback(lambda backend: backend.acquire(name, ttl))
+
+
+def record_run(name, status, duration_ms=None):
+    """Record a run's status ('ok', 'failed' or 'skipped') and duration."""
+    with_fallback(lambda backend: backend.record(name, status, duration_ms))
+
+
+def job_runs(name):
+    """
+    Run records of job `name`: runs, skipped, last_status, last_at,
+    last_duration_ms and max_duration_ms.
+    """
+    return with_fallback(lambda backend: backend.runs(name))
+
+
+def run_exclusive(name, func, *args, **kwargs):
+    """
+    Call func unless a previous run of job `name` still holds its lock, and
+    record the run. Returns (status, result); status is 'skipped' without
+    calling func. A func ending with sys.exit(1), like the cron jobs do on
+    errors, raises RuntimeError so the caller sees the failure.
+    """
+    lock = acquire(name)
+    if lock is None:
+        record_run(name, 'skipped')
+        return 'skipped', None
+
+    status = 'failed'
+    start = time.perf_counter()
+    try:
+        try:
+            result = func(*args, **kwargs)
+        except SystemExit as e:
+            if e.code:
+                raise RuntimeError(f"Job {name} exited with status {e.code}") from e
+            result = None
+        status = 'ok'
+        return status, result
+    finally:
+        try:
+            record_run(name, status, round((time.perf_counter() - start) * 1000, 1))
+        finally:
+            lock.release()
@@ -0,0 +1,148 @@
+"""
+CRM Low Stock
+Event-driven tracking of products whose stock is below their threshold.
+
+Writes that change stock call stock_changed() with each product's stock
+delta. It reads the new stock and threshold of those products in one
+query, and the products that crossed their threshold (either way) are
+added to the stock_changes batch once the transaction commits. The batch
+handler runs as one Celery task for many events (see crm/batching.py):
+it re-reads the products, keeps the LowStockProduct set in sync, logs an
+alert for every product that went low and restocks low products by
+`restock_increment`.
+
+reconcile() is the periodic full pass (the update_low_stock task) that
+catches whatever the events missed, e.g. writes made with raw SQL or
+flushes lost with a worker.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from crm import batching
+from crm.joblog import job_run
+from crm.models import LowStockProduct, Product
+
+DEFAULTS = {
+    # Threshold of products without low_stock_threshold
+    'threshold': 10,
+    # Units added to each low product when it is handled; None only alerts
+    'restock_increment': 10,
+    # Products read and updated per query by the handler and reconcile()
+    'chunk_size': 500,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_LOW_STOCK', {})}
+
+
+def threshold(config=None):
+    """Each product's effective threshold, as a query expression."""
+    config = config or get_config()
+    return Coalesce('low_stock_threshold', Value(config['threshold']))
+
+
+def stock_changed(changes):
+    """
+    Record stock changes made by the current transaction. `changes` maps
+    product ids to the stock delta just applied, or to None for new
+    products. Products that crossed their threshold are handled after
+    the commit; the others cost nothing more than this one query.
+    """
+    if not changes:
+        return
+    rows = Product.objects.filter(pk__in=list(changes)).annotate(limit=threshold()).values_list('pk', 'stock', 'limit')
+    events = []
+    for pk, stock, limit in rows:
+        delta = changes[pk]
+        was_low = delta is not None and stock - delta < limit
+        if was_low != (stock < limit):
+            events.append({'product_id': pk, 'stock': stock})
+    if events:
+        transaction.on_commit(lambda: [stock_changes.add(event) for event in events])
+
+
+def chunked(ids, size):
+    ids = sorted(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def low_products(ids, config):
+    """{id: (stock, threshold)} of the products among `ids` below their threshold."""
+    rows = (
+        Product.objects.filter(pk__in=ids).annotate(limit=threshold(config))
+        .filter(stock__lt=F('limit')).values_list('pk', 'stock', 'limit')
+    )
+    return {pk: (stock, limit) for pk, stock, limit in rows}
+
+
+def sync(ids, run, config=None):
+    """
+    Bring the low-stock set up to date for the products `ids` (one chunk):
+    alert on products that went low, restock them and add the ones still
+    low to the set; drop the ones that recovered.
+    """
+    config = config or get_config()
+    ids = set(ids)
+    now = timezone.now()
+    low = low_products(ids, config)
+    tracked = set(LowStockProduct.objects.filter(product_id__in=ids).values_list('product_id', flat=True))
+
+    for pk in sorted(set(low) - tracked):
+        run.warning("Product below threshold", product_id=pk, stock=low[pk][0], threshold=low[pk][1])
+        run.count('alerts')
+
+    increment = config['restock_increment']
+    if low and increment:
+        with transaction.atomic():
+            Product.objects.filter(pk__in=list(low)).update(stock=F('stock') + increment, updated_at=now)
+        for pk in sorted(low):
+            run.info("Restocked product", product_id=pk, stock=low[pk][0] + increment)
+        run.count('restocked', len(low))
+        low = low_products(list(low), config)
+
+    with transaction.atomic():
+        recovered = ids - set(low)
+        LowStockProduct.objects.filter(product_id__in=list(recovered & tracked)).delete()
+        LowStockProduct.objects.bulk_create(
+            [LowStockProduct(product_id=pk, since=now) for pk in sorted(set(low) - tracked)],
+            ignore_conflicts=True,
+        )
+    run.count('low', len(low))
+
+
+def handle_changes(events):
+    """Handler of the stock_changes batch."""
+    config = get_config()
+    with job_run('low_stock_alerts') as run:
+        run.count('events', len(events))
+        ids = {event['product_id'] for event in events}
+        for chunk in chunked(ids, config['chunk_size']):
+            sync(chunk, run, config)
+
+
+def reconcile():
+    """
+    Full pass over the catalog: sync every product below its threshold or
+    in the set. Returns the number of products whose membership the
+    events had missed.
+    """
+    config = get_config()
+    with job_run('update_low_stock') as run:
+        low = set(Product.objects.annotate(limit=threshold(config)).filter(stock__lt=F('limit')).values_list('pk', flat=True))
+        tracked = set(LowStockProduct.objects.values_list('product_id', flat=True))
+        missed = len(low ^ tracked)
+        run.count('missed', missed)
+        for chunk in chunked(low | tracked, config['chunk_size']):
+            sync(chunk, run, config)
+        run.info(f"Reconciled {len(low | tracked)} products, {missed} missed by stock-change events")
+        return missed
+
+
+# Producers call stock_changed(); events are handled by the notifications workers
+stock_changes = batching.Batch('stock_changes', handle_changes)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from crm.archive import archive_boundary, archive_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Move orders older than CRM_ORDER_ARCHIVE['age_days'] into the "
+        "archive table in batches (same as the archive_old_orders task)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Orders per transaction")
+        parser.add_argument('--max-batches', type=int, help="Stop after this many batches")
+
+    def handle(self, *args, **options):
+        def log(batch, moved):
+            self.stdout.write(f"batch {batch}: {moved} orders")
+
+        self.stdout.write(f"Archiving orders created before {archive_boundary():%Y-%m-%d %H:%M}")
+        total = archive_orders(
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            log=log,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} orders"))
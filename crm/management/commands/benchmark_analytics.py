@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm import analytics
+from crm.benchmarks.analytics_suite import run_suite
+from crm.benchmarks.database import benchmark_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the NumPy analytics snapshot from a generated order history and "
+        "compare its revenue queries with database aggregations."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000,
+                            help="Orders to generate (default: 1000000)")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per query (default: 5)")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        if not analytics.HAS_NUMPY:
+            raise CommandError("NumPy is not installed (pip install numpy)")
+
+        def log(name, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{name:<22} {values}")
+
+        with benchmark_database():
+            results = run_suite(options['orders'], repeat=options['repeat'], log=log)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks.batch_suite import DASHBOARD, run_suite
+from crm.benchmarks.database import benchmark_database
+from crm.benchmarks import datasets
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare dashboard read operations sent to /graphql as separate requests, "
+        "as one batch and as one parallel batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', choices=list(datasets.SCALES),
+                            help="Dataset scale to run (repeatable, default: small and medium)")
+        parser.add_argument('--operation', action='append', help=f"Operation to batch (repeatable, default: {', '.join(DASHBOARD)})")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per mode (default: 5)")
+        parser.add_argument('--workers', type=int, default=4, help="Threads of the parallel batch (default: 4)")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        def log(scale, mode, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{scale:>6} {mode:<16} {values}")
+
+        with benchmark_database():
+            results = run_suite(
+                options['scale'] or ['small', 'medium'], operations=options['operation'],
+                repeat=options['repeat'], workers=options['workers'], log=log,
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks.celery_suite import SCENARIOS, run_suite
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure quick-task latency on shared versus dedicated queues, and event "
+        "throughput with and without batching, on an in-memory Celery broker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                            help="Scenario to run (repeatable, default: all)")
+        parser.add_argument('--quick', type=int, default=20, help="Quick tasks sent behind the slow one (default: 20)")
+        parser.add_argument('--slow-seconds', type=float, default=1.0, help="Duration of the slow task (default: 1.0)")
+        parser.add_argument('--events', type=int, default=2000, help="Events sent in the batching scenario (default: 2000)")
+        parser.add_argument('--overhead-ms', type=float, default=1.0,
+                            help="Fixed cost of one event handler execution (default: 1.0)")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        def log(scenario, mode, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{scenario:>8} {mode:<16} {values}")
+
+        results = run_suite(
+            options['scenario'], log=log,
+            queues={'quick': options['quick'], 'slow_seconds': options['slow_seconds']},
+            batching={'events': options['events'], 'overhead_ms': options['overhead_ms']},
+        )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks import datasets
+from crm.benchmarks.database import benchmark_database
+from crm.benchmarks.jobs_suite import JOBS, run_suite, scaling_curves
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the CRM cron and Celery jobs against seeded databases of "
+        "increasing size and report how each one scales."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', choices=list(datasets.SCALES),
+                            help="Dataset scale to run (repeatable, default: all)")
+        parser.add_argument('--job', action='append', choices=list(JOBS),
+                            help="Job to run (repeatable, default: all)")
+        parser.add_argument('--profile-dir',
+                            help="Write a cProfile .prof file per job and scale to this directory")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        scales = options['scale'] or list(datasets.SCALES)
+
+        def log(scale, name, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{scale:>6} {name:<26} {values}")
+
+        with benchmark_database() as db_path:
+            results = run_suite(
+                db_path,
+                scales,
+                jobs=options['job'],
+                profile_dir=options['profile_dir'],
+                log=log,
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        self.stdout.write("\nScaling (wall_ms ~ orders ** exponent), most at risk first:")
+        for row in scaling_curves(results):
+            self.stdout.write(
+                f"  {row['job']:<26} exponent={row['exponent']:<5} "
+                f"largest={row['largest']}ms projected_10x={row['projected_10x']}ms"
+            )
@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks import datasets
+from crm.benchmarks.cache_suite import run_suite
+from crm.benchmarks.database import benchmark_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a Zipf-distributed product lookup and order workload with and "
+        "without the product cache and compare database reads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='large', choices=list(datasets.SCALES),
+                            help="Dataset scale to seed (default: large)")
+        parser.add_argument('--operations', type=int, default=5000,
+                            help="Operations to replay per run (default: 5000)")
+        parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent (default: 1.1)")
+        parser.add_argument('--read-ratio', type=float, default=0.8,
+                            help="Share of product(id) queries, the rest are createOrder (default: 0.8)")
+        parser.add_argument('--max-size', type=int, help="Override CRM_PRODUCT_CACHE['max_size']")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        def log(name, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{name:<9} {values}")
+
+        with benchmark_database():
+            results = run_suite(
+                options['scale'],
+                operations=options['operations'],
+                skew=options['skew'],
+                read_ratio=options['read_ratio'],
+                max_size=options['max_size'],
+                log=log,
+            )
+
+        reduction = results['reduction']
+        self.stdout.write(
+            f"Product table reads -{reduction['product_reads']:.1%}, "
+            f"all queries -{reduction['queries']:.1%}, {reduction['speedup']}x throughput"
+        )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks.database import benchmark_database
+from crm.benchmarks.reports_suite import run_suite
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the sharded weekly report from a generated order history with "
+        "1..N worker processes and report the speedup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000,
+                            help="Orders to generate (default: 1000000)")
+        parser.add_argument('--workers', default='1,2,4',
+                            help="Comma-separated worker counts (default: 1,2,4)")
+        parser.add_argument('--shards', type=int, help="Order id ranges (default: CRM_REPORTS['shards'])")
+        parser.add_argument('--repeat', type=int, default=3, help="Timed runs per worker count (default: 3)")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        def log(name, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{name:<12} {values}")
+
+        workers = [int(count) for count in options['workers'].split(',')]
+        with benchmark_database():
+            results = run_suite(
+                options['orders'], workers=workers, shards=options['shards'],
+                repeat=options['repeat'], log=log,
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
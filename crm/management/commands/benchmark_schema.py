@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.benchmarks import datasets, regression
+from crm.benchmarks.database import benchmark_database
+from crm.benchmarks.schema_suite import OPERATIONS, run_suite
+
+SUITE = 'schema'
+
+# The large scale takes several minutes and is only run on request
+DEFAULT_SCALES = ['small', 'medium']
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark crm.schema queries and mutations on seeded datasets and "
+        "fail if a metric regressed beyond tolerance of the stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', action='append', choices=list(datasets.SCALES),
+                            help="Dataset scale to run (repeatable, default: small and medium)")
+        parser.add_argument('--operation', action='append', choices=list(OPERATIONS),
+                            help="Operation to run (repeatable, default: all)")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="Timed runs per operation (default: 5)")
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help="Threads for the concurrent order benchmark, 0 to skip (default: 8)")
+        parser.add_argument('--tolerance', action='append', default=[], metavar='METRIC=FRACTION',
+                            help="Override a regression tolerance, e.g. latency_ms=0.3")
+        parser.add_argument('--update-baseline', action='store_true',
+                            help="Store the results as the new baseline instead of comparing")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        tolerances = {}
+        for item in options['tolerance']:
+            metric, _, value = item.partition('=')
+            try:
+                tolerances[metric] = float(value)
+            except ValueError:
+                raise CommandError(f"Invalid tolerance: {item}")
+
+        scales = options['scale'] or DEFAULT_SCALES
+
+        def log(scale, name, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{scale:>6} {name:<28} {values}")
+
+        with benchmark_database():
+            results = run_suite(
+                scales,
+                operations=options['operation'],
+                repeat=options['repeat'],
+                concurrency=options['concurrency'],
+                log=log,
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if options['update_baseline']:
+            regression.save_baseline(SUITE, results)
+            self.stdout.write(self.style.SUCCESS(
+                f"Baseline written to {regression.baseline_path(SUITE)}"
+            ))
+            return
+
+        baseline = regression.load_baseline(SUITE)
+        if not baseline:
+            self.stdout.write(self.style.WARNING("No baseline stored, run with --update-baseline"))
+            return
+
+        regressions = regression.compare(baseline, results, tolerances)
+        if regressions:
+            for line in regressions:
+                self.stderr.write(line)
+            raise CommandError(f"{len(regressions)} benchmark regression(s)")
+        self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
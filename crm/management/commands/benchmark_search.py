@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks.database import benchmark_database
+from crm.benchmarks.search_suite import run_suite
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the FTS5 search index with icontains scans on generated "
+        "products and customers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000,
+                            help="Products to generate (default: 1000000)")
+        parser.add_argument('--customers', type=int, default=100000,
+                            help="Customers to generate (default: 100000)")
+        parser.add_argument('--first', type=int, default=20, help="Results per search (default: 20)")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per query (default: 5)")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        def log(name, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{name:<15} {values}")
+
+        with benchmark_database():
+            results = run_suite(
+                options['products'],
+                options['customers'],
+                first=options['first'],
+                repeat=options['repeat'],
+                log=log,
+            )
+        self.stdout.write(
+            f"Seeded {options['products']} products and {options['customers']} customers "
+            f"in {results['seed_s']}s, index size: {results['index_kb']} KiB"
+        )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,30 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks.database import benchmark_database
+from crm.benchmarks.serialization_suite import run_suite
+
+
+class Command(BaseCommand):
+    help = (
+        "Time JSON encoding (graphene's json.dumps, stdlib and orjson encoders) and "
+        "gzip compression of an allOrders response, and the /graphql round trip."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=10000, help="Orders in the response (default: 10000)")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per variant (default: 5)")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        def log(scenario, variant, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{scenario:>6} {variant:<14} {values}")
+
+        with benchmark_database():
+            results = run_suite(options['orders'], repeat=options['repeat'], log=log)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
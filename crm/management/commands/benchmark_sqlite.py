@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks import datasets
+from crm.benchmarks.contention_suite import PROFILES, run_suite
+from crm.benchmarks.database import benchmark_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare Django's stock SQLite configuration with the production "
+        "profile under mixed concurrent reads and writes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='medium', choices=list(datasets.SCALES),
+                            help="Dataset scale to seed (default: medium)")
+        parser.add_argument('--profile', action='append', choices=list(PROFILES),
+                            help="Profile to run (repeatable, default: all)")
+        parser.add_argument('--readers', type=int, default=8, help="Reader threads (default: 8)")
+        parser.add_argument('--writers', type=int, default=4, help="Writer threads (default: 4)")
+        parser.add_argument('--duration', type=float, default=5.0,
+                            help="Seconds of load per profile (default: 5)")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        def log(name, metrics):
+            values = ', '.join(f"{key}={value}" for key, value in metrics.items())
+            self.stdout.write(f"{name:<6} {values}")
+
+        with benchmark_database() as db_path:
+            datasets.seed(options['scale'])
+            results = run_suite(
+                db_path,
+                profiles=options['profile'],
+                readers=options['readers'],
+                writers=options['writers'],
+                duration=options['duration'],
+                log=log,
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if 'stock' in results and 'tuned' in results:
+            for key in ('reads_per_s', 'writes_per_s'):
+                if results['stock'][key]:
+                    gain = results['tuned'][key] / results['stock'][key]
+                    self.stdout.write(f"{key}: {gain:.2f}x with the tuned profile")
@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from crm.benchmarks.startup_suite import SCENARIOS, run_suite
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the cold start of cron jobs, Celery workers and schema loading "
+        "in fresh interpreters, with an import-time breakdown by package."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                            help="Startup path to time (repeatable, default: all)")
+        parser.add_argument('--repeat', type=int, default=10, help="Timed starts per scenario (default: 10)")
+        parser.add_argument('--top', type=int, default=8,
+                            help="Slowest packages to list per scenario, 0 to skip profiling (default: 8)")
+        parser.add_argument('--output', help="Also write the results to this JSON file")
+
+    def handle(self, *args, **options):
+        def log(name, metrics):
+            self.stdout.write(
+                f"{name:<22} median_ms={metrics['median_ms']}, cpu_ms={metrics['cpu_ms']}"
+                + (f", import_ms={metrics['import_ms']}" if 'import_ms' in metrics else '')
+            )
+            for package, ms in metrics.get('packages', {}).items():
+                self.stdout.write(f"    {package:<24} {ms} ms")
+
+        results = run_suite(options['scenario'], repeat=options['repeat'], top=options['top'], log=log)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
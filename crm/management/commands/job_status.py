@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from crm import locks
+
+
+class Command(BaseCommand):
+    help = "Show the runs, skips and durations recorded for the periodic jobs (see crm/locks.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('job', nargs='*', help="Job names (default: every task in CELERY_BEAT_SCHEDULE)")
+
+    def handle(self, *args, **options):
+        jobs = options['job'] or [entry['task'].rsplit('.', 1)[-1] for entry in settings.CELERY_BEAT_SCHEDULE.values()]
+        for job in jobs:
+            runs = locks.job_runs(job)
+            if not runs:
+                self.stdout.write(f"{job:<26} no recorded runs")
+                continue
+            self.stdout.write(
+                f"{job:<26} runs={runs.get('runs', 0)} skipped={runs.get('skipped', 0)} "
+                f"last={runs['last_status']} at {runs['last_at']} "
+                f"last_ms={runs.get('last_duration_ms', '-')} max_ms={runs.get('max_duration_ms', '-')}"
+            )
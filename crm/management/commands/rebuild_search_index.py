@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from crm import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search indexes from the product and customer tables."
+
+    def handle(self, *args, **options):
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS("Search indexes rebuilt"))
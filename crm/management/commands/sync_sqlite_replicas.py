@@ -0,0 +1,32 @@
+import sqlite3
+from contextlib import closing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from crm.routers import PRIMARY, get_replicas
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database into the read replica files of "
+        "CRM_READ_REPLICAS (local stand-in for replication)."
+    )
+
+    def handle(self, *args, **options):
+        replicas = get_replicas()
+        if not replicas:
+            raise CommandError("CRM_READ_REPLICAS is empty")
+
+        primary = connections[PRIMARY].settings_dict
+        for alias in [PRIMARY] + replicas:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f"Database '{alias}' is not SQLite")
+
+        with closing(sqlite3.connect(primary['NAME'])) as source:
+            for alias in replicas:
+                name = connections[alias].settings_dict['NAME']
+                with closing(sqlite3.connect(name)) as target:
+                    # Online backup: consistent copy while the primary stays writable
+                    source.backup(target)
+                self.stdout.write(self.style.SUCCESS(f"Copied {primary['NAME']} to '{alias}' ({name})"))
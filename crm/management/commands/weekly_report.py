@@ -0,0 +1,26 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from crm.reports import build_weekly_report, write_report
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the weekly report (products, segments, status funnel, cohort "
+        "retention) with a local process pool and write it as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--week', type=date.fromisoformat,
+                            help="Any date in the week to report (default: last full week)")
+        parser.add_argument('--workers', type=int, default=1, help="Worker processes (default: 1)")
+        parser.add_argument('--shards', type=int, help="Order id ranges (default: CRM_REPORTS['shards'])")
+
+    def handle(self, *args, **options):
+        report = build_weekly_report(options['week'], workers=options['workers'], shards=options['shards'])
+        path = write_report(report)
+        totals = report['totals']
+        self.stdout.write(self.style.SUCCESS(
+            f"Week {report['week']}: {totals['orders']} orders, {totals['revenue']} revenue -> {path}"
+        ))
@@ -0,0 +1,111 @@
+"""
+CRM Middleware
+Django and graphene middleware used by the /graphql endpoint.
+"""
+
+from django.conf import settings
+from graphql import OperationType
+
+from crm import ratelimit, routers
+from crm.loaders import get_loaders
+
+
+class ReplicaPinningMiddleware:
+    """
+    Django middleware resetting the database routing state per request.
+    After a request wrote to the primary, the client gets a short-lived
+    cookie that keeps its reads on the primary until replicas caught up.
+    """
+
+    cookie_name = 'crm_primary_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tokens = routers.start_request(pinned=self.cookie_name in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.end_request(tokens)
+
+        if wrote and routers.get_replicas():
+            response.set_cookie(
+                self.cookie_name, '1',
+                max_age=getattr(settings, 'CRM_REPLICA_PIN_SECONDS', 5),
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class PrimaryForMutationsMiddleware:
+    """
+    Graphene middleware routing mutations, and the fields resolved from
+    their payloads, to the primary. The state is kept until the request
+    ends, since payload fields resolve after the mutation returns.
+    """
+
+    def resolve(self, next, root, info, **args):
+        if root is None and info.operation.operation == OperationType.MUTATION:
+            routers.use_primary()
+        return next(root, info, **args)
+
+
+class LoaderResetMiddleware:
+    """
+    Graphene middleware clearing the request's loaders before each mutation
+    field, so it and later operations of a batch don't see stale objects.
+    """
+
+    def resolve(self, next, root, info, **args):
+        if root is None and info.operation.operation == OperationType.MUTATION:
+            get_loaders(info.context).clear()
+        return next(root, info, **args)
+
+
+class RateLimitMiddleware:
+    """
+    Django middleware admitting /graphql requests (see crm/ratelimit.py):
+    sheds load when too many requests are in flight, caps each client's
+    concurrent requests, and charges the cost of each request to the
+    client's token bucket. Rejected requests get a 429 with Retry-After.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = ratelimit.get_config()
+        if not config['enabled'] or request.path.rstrip('/') not in config['paths']:
+            return self.get_response(request)
+
+        store = ratelimit.get_store()
+        client = ratelimit.client_key(request, config)
+        refused = store.acquire(client, config['concurrency'], config['max_in_flight'])
+        if refused == 'overloaded':
+            return ratelimit.too_many_requests("Server is busy, retry later", refused, 1)
+        if refused:
+            return ratelimit.too_many_requests("Too many concurrent requests from this client", refused, 1)
+
+        try:
+            try:
+                cost = ratelimit.request_cost(request, config)
+            except ratelimit.QueryTooComplex as e:
+                return ratelimit.query_too_complex(str(e))
+            allowed, remaining, retry_after = store.take(client, cost, config['rate'], config['burst'])
+            headers = {
+                'X-RateLimit-Limit': str(config['burst']),
+                'X-RateLimit-Remaining': str(int(remaining)),
+                'X-RateLimit-Cost': str(cost),
+            }
+            if not allowed:
+                message = f"Rate limit exceeded: this request costs {cost}"
+                if cost > config['burst']:
+                    message += f", more than the limit of {config['burst']}; request smaller pages"
+                return ratelimit.too_many_requests(message, 'rate', retry_after, headers)
+            response = self.get_response(request)
+        finally:
+            store.release(client)
+        for name, value in headers.items():
+            response[name] = value
+        return response
@@ -0,0 +1,96 @@
+from django.db import migrations
+
+# FTS5 indexes for crm.search. Products use an external-content table (the
+# text stays in crm_product only), customers a regular one since their name
+# and email live in auth_user. Triggers keep both in sync, including for
+# bulk_create() and queryset updates that don't send signals.
+CUSTOMER_ROW = """
+    SELECT c.id,
+           trim(u.first_name || ' ' || u.last_name || ' ' || u.username),
+           u.email, coalesce(c.phone, ''), coalesce(c.address, '')
+    FROM crm_customer c JOIN auth_user u ON u.id = c.user_id
+"""
+
+FORWARD = [
+    """CREATE VIRTUAL TABLE crm_product_search USING fts5(
+        name, description,
+        content='crm_product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE VIRTUAL TABLE crm_customer_search USING fts5(
+        name, email, phone, address,
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    "INSERT INTO crm_product_search(crm_product_search) VALUES ('rebuild')",
+    "INSERT INTO crm_customer_search(rowid, name, email, phone, address) " + CUSTOMER_ROW,
+
+    """CREATE TRIGGER crm_product_search_insert AFTER INSERT ON crm_product BEGIN
+        INSERT INTO crm_product_search(rowid, name, description)
+        VALUES (new.id, new.name, coalesce(new.description, ''));
+    END""",
+    """CREATE TRIGGER crm_product_search_delete AFTER DELETE ON crm_product BEGIN
+        INSERT INTO crm_product_search(crm_product_search, rowid, name, description)
+        VALUES ('delete', old.id, old.name, coalesce(old.description, ''));
+    END""",
+    # Only text changes touch the index, not stock or price updates
+    """CREATE TRIGGER crm_product_search_update AFTER UPDATE OF name, description ON crm_product BEGIN
+        INSERT INTO crm_product_search(crm_product_search, rowid, name, description)
+        VALUES ('delete', old.id, old.name, coalesce(old.description, ''));
+        INSERT INTO crm_product_search(rowid, name, description)
+        VALUES (new.id, new.name, coalesce(new.description, ''));
+    END""",
+
+    """CREATE TRIGGER crm_customer_search_insert AFTER INSERT ON crm_customer BEGIN
+        INSERT INTO crm_customer_search(rowid, name, email, phone, address)
+        """ + CUSTOMER_ROW + """ WHERE c.id = new.id;
+    END""",
+    """CREATE TRIGGER crm_customer_search_delete AFTER DELETE ON crm_customer BEGIN
+        DELETE FROM crm_customer_search WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER crm_customer_search_update AFTER UPDATE OF user_id, phone, address ON crm_customer BEGIN
+        DELETE FROM crm_customer_search WHERE rowid = old.id;
+        INSERT INTO crm_customer_search(rowid, name, email, phone, address)
+        """ + CUSTOMER_ROW + """ WHERE c.id = new.id;
+    END""",
+    """CREATE TRIGGER crm_customer_search_user_update
+    AFTER UPDATE OF username, first_name, last_name, email ON auth_user BEGIN
+        DELETE FROM crm_customer_search
+        WHERE rowid IN (SELECT id FROM crm_customer WHERE user_id = new.id);
+        INSERT INTO crm_customer_search(rowid, name, email, phone, address)
+        """ + CUSTOMER_ROW + """ WHERE c.user_id = new.id;
+    END""",
+]
+
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS crm_customer_search_user_update",
+    "DROP TRIGGER IF EXISTS crm_customer_search_update",
+    "DROP TRIGGER IF EXISTS crm_customer_search_delete",
+    "DROP TRIGGER IF EXISTS crm_customer_search_insert",
+    "DROP TRIGGER IF EXISTS crm_product_search_update",
+    "DROP TRIGGER IF EXISTS crm_product_search_delete",
+    "DROP TRIGGER IF EXISTS crm_product_search_insert",
+    "DROP TABLE IF EXISTS crm_customer_search",
+    "DROP TABLE IF EXISTS crm_product_search",
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        # Other databases fall back to icontains lookups in crm.search
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('crm', '0003_archived_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(FORWARD), run_sql(BACKWARD)),
+    ]
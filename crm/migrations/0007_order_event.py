@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:13
+
+from django.db import migrations, models
+
+# Order events are append-only: the database refuses to update them. They
+# can still be deleted, e.g. to drop events past a retention period.
+FORWARD = [
+    """CREATE TRIGGER crm_orderevent_append_only BEFORE UPDATE ON crm_orderevent BEGIN
+        SELECT RAISE(ABORT, 'crm_orderevent is append-only');
+    END""",
+]
+
+BACKWARD = [
+    "DROP TRIGGER IF EXISTS crm_orderevent_append_only",
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        # Elsewhere only OrderEvent.save() enforces it
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField(db_index=True)),
+                ('from_status', models.PositiveSmallIntegerField()),
+                ('to_status', models.PositiveSmallIntegerField()),
+                ('actor_id', models.IntegerField(null=True)),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(run_sql(FORWARD), run_sql(BACKWARD)),
+    ]
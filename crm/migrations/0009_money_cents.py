@@ -0,0 +1,96 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:52
+
+import importlib
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import BigIntegerField, ExpressionWrapper, F, Value
+from django.db.models.functions import Cast, Round
+
+import crm.money
+
+# (model, field) pairs moved from DecimalField to integer cents, in a
+# column named <field>_cents
+AMOUNTS = [
+    ('product', 'price'),
+    ('order', 'total_amount'),
+    ('archivedorder', 'total_amount'),
+]
+
+# SQLite rebuilds crm_product to change its columns, dropping the search
+# index triggers of 0004; they are created again on either direction
+PRODUCT_TRIGGERS = [
+    statement for statement in importlib.import_module('crm.migrations.0004_search_index').FORWARD
+    if statement.startswith('CREATE TRIGGER crm_product_search_')
+]
+
+
+def restore_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in PRODUCT_TRIGGERS:
+        name = statement.split()[2]
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        schema_editor.execute(statement)
+
+
+def to_cents(apps, schema_editor):
+    for model_name, name in AMOUNTS:
+        model = apps.get_model('crm', model_name)
+        model.objects.update(**{f'{name}_cents': Cast(Round(F(name) * 100), BigIntegerField())})
+
+
+def from_cents(apps, schema_editor):
+    for model_name, name in AMOUNTS:
+        model = apps.get_model('crm', model_name)
+        model.objects.update(**{name: ExpressionWrapper(
+            F(f'{name}_cents') * Value(Decimal('0.01')),
+            output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_low_stock'),
+    ]
+
+    operations = [
+        # Runs last on rollback
+        migrations.RunPython(migrations.RunPython.noop, restore_triggers),
+        # The decimal columns become nullable so they can be restored by a rollback
+        *[
+            migrations.AlterField(
+                model_name=model_name,
+                name=name,
+                field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+            )
+            for model_name, name in AMOUNTS
+        ],
+        *[
+            migrations.AddField(
+                model_name=model_name,
+                name=f'{name}_cents',
+                field=models.BigIntegerField(default=0),
+            )
+            for model_name, name in AMOUNTS
+        ],
+        migrations.RunPython(to_cents, from_cents),
+        *[
+            migrations.RemoveField(model_name=model_name, name=name)
+            for model_name, name in AMOUNTS
+        ],
+        # The cents column keeps its name; only the field is renamed and typed
+        *[
+            migrations.SeparateDatabaseAndState(state_operations=[
+                migrations.RemoveField(model_name=model_name, name=f'{name}_cents'),
+                migrations.AddField(
+                    model_name=model_name,
+                    name=name,
+                    field=crm.money.MoneyField(db_column=f'{name}_cents'),
+                ),
+            ])
+            for model_name, name in AMOUNTS
+        ],
+        migrations.RunPython(restore_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 10:55
+
+import crm.money
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0009_money_cents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RFMState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('boundaries', models.JSONField(default=dict)),
+                ('boundaries_at', models.DateTimeField(null=True)),
+                ('watermark', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CustomerRFM',
+            fields=[
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rfm', serialize=False, to='crm.customer')),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('revenue', crm.money.MoneyField(db_column='revenue_cents', default=0)),
+                ('last_order_at', models.DateTimeField()),
+                ('recency_score', models.PositiveSmallIntegerField(default=1)),
+                ('frequency_score', models.PositiveSmallIntegerField(default=1)),
+                ('monetary_score', models.PositiveSmallIntegerField(default=1)),
+                ('segment', models.CharField(blank=True, max_length=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['segment', 'customer'], name='crm_customerrfm_segment')],
+            },
+        ),
+    ]
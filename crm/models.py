@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from crm.money import MoneyField
 
 class Customer(models.Model):
     """Customer model for CRM system"""
@@ -19,8 +20,11 @@ class Product(models.Model):
     """Product model for CRM system"""
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True, null=True)
-    price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Integer cents, read as a Decimal (crm/money.py)
+    price = MoneyField(db_column='price_cents')
     stock = models.PositiveIntegerField(default=0)
+    # Stock below this is low (crm/low_stock.py); None uses CRM_LOW_STOCK['threshold']
+    low_stock_threshold = models.PositiveIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -43,7 +47,7 @@ class Order(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='orders')
     quantity = models.PositiveIntegerField(default=1)
-    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    total_amount = MoneyField(db_column='total_amount_cents')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -53,3 +57,120 @@ class Order(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves the status + date range filter of pendingOrderReminders
+            models.Index(fields=['status', 'created_at'], name='crm_order_status_created'),
+            # Incremental refreshes of the analytics snapshot (crm/analytics.py)
+            models.Index(fields=['updated_at'], name='crm_order_updated'),
+        ]
+
+class ArchivedOrder(models.Model):
+    """Order moved out of the hot Order table by crm.archive, keeping its id"""
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='archived_orders')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='archived_orders')
+    quantity = models.PositiveIntegerField(default=1)
+    total_amount = MoneyField(db_column='total_amount_cents')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES, default='pending')
+    created_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    # Columns copied between Order and ArchivedOrder
+    ORDER_FIELDS = [
+        'id', 'customer_id', 'product_id', 'quantity', 'total_amount',
+        'status', 'created_at', 'updated_at',
+    ]
+    
+    def __str__(self):
+        return f"Archived order {self.id} - {self.customer}"
+    
+    def as_order(self):
+        """Unsaved Order instance with the archived values, for GraphQL types"""
+        return Order(**{name: getattr(self, name) for name in self.ORDER_FIELDS})
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['updated_at'], name='crm_archivedorder_updated'),
+        ]
+
+class IdempotencyKey(models.Model):
+    """Stored outcome of a mutation run with a client idempotency key (see crm.idempotency)"""
+    operation = models.CharField(max_length=32)
+    key = models.CharField(max_length=64)
+    # Hash of the mutation arguments, so a key can't be reused for another request
+    fingerprint = models.CharField(max_length=32)
+    response = models.JSONField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"{self.operation} {self.key}"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['operation', 'key'], name='crm_idempotency_operation_key'),
+        ]
+
+class OrderEvent(models.Model):
+    """Append-only audit row of an order status change (see crm.order_status)"""
+    # Compact rows: status codes instead of names, and no foreign keys, so
+    # events outlive archived or deleted orders and cost no joins to write
+    order_id = models.BigIntegerField(db_index=True)
+    from_status = models.PositiveSmallIntegerField()
+    to_status = models.PositiveSmallIntegerField()
+    # User who made the change, if any
+    actor_id = models.IntegerField(null=True)
+    created_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"Order {self.order_id}: {self.from_status} -> {self.to_status}"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Order events are append-only")
+        super().save(*args, **kwargs)
+
+class LowStockProduct(models.Model):
+    """Product whose stock is below its threshold, kept in sync by crm.low_stock"""
+    # The primary key is the index: membership checks and the whole set are cheap
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='low_stock')
+    # When the product was first seen below its threshold
+    since = models.DateTimeField()
+    
+    def __str__(self):
+        return f"Low stock: product {self.product_id}"
+
+class CustomerRFM(models.Model):
+    """Recency, frequency and monetary scores of a customer with orders, kept up to date by crm.rfm"""
+    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True, related_name='rfm')
+    # Lifetime aggregates of the customer's hot and archived orders, cancelled ones excluded
+    orders = models.PositiveIntegerField(default=0)
+    revenue = MoneyField(db_column='revenue_cents', default=0)
+    last_order_at = models.DateTimeField()
+    # Quintile of each aggregate among all customers, 1 (lowest) to 5; recency 5 is the most recent
+    recency_score = models.PositiveSmallIntegerField(default=1)
+    frequency_score = models.PositiveSmallIntegerField(default=1)
+    monetary_score = models.PositiveSmallIntegerField(default=1)
+    segment = models.CharField(max_length=20, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Customer {self.customer_id}: {self.segment} ({self.recency_score}{self.frequency_score}{self.monetary_score})"
+    
+    class Meta:
+        indexes = [
+            # customersBySegment: one segment, paged by customer id
+            models.Index(fields=['segment', 'customer'], name='crm_customerrfm_segment'),
+        ]
+
+class RFMState(models.Model):
+    """The single row of crm.rfm's state: quantile boundaries and order watermark"""
+    # {'recency': [4 ISO timestamps], 'frequency': [4 counts], 'monetary': [4 cents]}, ascending
+    boundaries = models.JSONField(default=dict)
+    boundaries_at = models.DateTimeField(null=True)
+    # Orders updated before this (minus CRM_RFM['overlap']) are reflected in the scores
+    watermark = models.DateTimeField(null=True)
+    
+    def __str__(self):
+        return f"RFM state at {self.watermark}"
@@ -0,0 +1,97 @@
+"""
+CRM Money
+Exact money amounts: integer cents in the database, Decimal in Python.
+
+MoneyField stores an amount as a BIGINT number of cents, so sums and
+arithmetic in the database are integer math and never drift, and
+reading a value builds a Decimal from an int instead of parsing a
+decimal string. Amounts are rounded half up to the cent on the way in;
+floats are converted through their shortest repr (19.99, not
+19.989999...), but callers should pass Decimals, ints or strings.
+Amounts whose cents don't fit in a BIGINT are rejected.
+
+In queries, cents() exposes the raw cents of a MoneyField, for code that
+works on integers (reports, the analytics snapshot). The Money GraphQL
+scalar is in crm/schema.py.
+"""
+
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+from django.db.models import BigIntegerField, ExpressionWrapper, F
+from django.db.models.lookups import GreaterThanOrEqual, LessThan
+
+CENT = Decimal('0.01')
+
+# Largest amount whose cents fit in a signed 64-bit BIGINT
+MAX_AMOUNT = Decimal(2 ** 63 - 1).scaleb(-2)
+
+
+def to_decimal(value):
+    """Amount as a Decimal with two places. Raises ValueError for anything else."""
+    if value is None:
+        return None
+    if isinstance(value, float):
+        value = repr(value)
+    try:
+        amount = value if isinstance(value, Decimal) else Decimal(value.strip() if isinstance(value, str) else value)
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"Invalid amount: {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount: {value!r}")
+    try:
+        # Raises for amounts with more digits than the context's precision
+        amount = amount.quantize(CENT, rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f"Amount out of range: {value!r}")
+    if abs(amount) > MAX_AMOUNT:
+        raise ValueError(f"Amount out of range: {value!r}")
+    return amount
+
+
+def to_cents(value):
+    """Amount as an int number of cents."""
+    return None if value is None else int(to_decimal(value).scaleb(2))
+
+
+def from_cents(cents):
+    """Decimal amount of an int number of cents, e.g. 1999 -> Decimal('19.99')."""
+    return None if cents is None else Decimal(cents).scaleb(-2)
+
+
+def cents(name):
+    """Raw cents of the MoneyField `name`, as an integer query expression."""
+    return ExpressionWrapper(F(name), output_field=BigIntegerField())
+
+
+class MoneyField(models.BigIntegerField):
+    """Amount stored as integer cents and read as a Decimal with two places."""
+
+    description = "Money amount (stored as integer cents)"
+
+    def from_db_value(self, value, expression, connection):
+        return from_cents(value)
+
+    def to_python(self, value):
+        try:
+            return to_decimal(value)
+        except ValueError:
+            raise exceptions.ValidationError(
+                self.error_messages['invalid'], code='invalid', params={'value': value},
+            )
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return to_cents(value)
+
+    def formfield(self, **kwargs):
+        return super().formfield(**{'form_class': forms.DecimalField, 'decimal_places': 2, **kwargs})
+
+
+# IntegerField rounds float bounds of gte/lt to whole numbers before they
+# are converted to cents; the plain lookups leave that to get_prep_value
+MoneyField.register_lookup(GreaterThanOrEqual)
+MoneyField.register_lookup(LessThan)
@@ -0,0 +1,167 @@
+"""
+CRM Order Status
+Validated order status transitions, applied to many orders at once.
+
+Orders are selected by id or by a filter and moved in chunks of
+CRM_ORDER_STATUS['chunk_size']: each chunk is read, updated with one
+UPDATE per chunk and logged with one INSERT of OrderEvent rows, in one
+transaction. Orders whose status can't move to the target are skipped.
+Cancelling gives the ordered quantities back to stock with one
+`stock = stock + n` UPDATE per product and chunk.
+
+Only hot orders change status; archived orders are left alone.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from crm import low_stock
+from crm.models import Order, OrderEvent, Product
+
+DEFAULTS = {
+    # Orders read, updated and logged per transaction
+    'chunk_size': 500,
+}
+
+# Statuses each status may move to
+TRANSITIONS = {
+    'pending': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+
+# Codes stored in OrderEvent; new statuses must be appended to STATUS_CHOICES
+STATUS_CODES = {status: code for code, (status, _) in enumerate(Order.STATUS_CHOICES)}
+STATUS_NAMES = {code: status for status, code in STATUS_CODES.items()}
+
+# Filters accepted by transition_orders(), as Order lookups
+FILTERS = {
+    'status': 'status',
+    'customer_id': 'customer_id',
+    'product_id': 'product_id',
+    'created_after': 'created_at__gte',
+    'created_before': 'created_at__lt',
+}
+
+
+class TransitionError(Exception):
+    """Unknown status, or no orders selected."""
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_ORDER_STATUS', {})}
+
+
+def can_transition(current, to):
+    return to in TRANSITIONS.get(current, ())
+
+
+def sources(to):
+    """Statuses orders may move to `to` from."""
+    return [status for status, targets in TRANSITIONS.items() if to in targets]
+
+
+def chunks(ids, filters, chunk_size):
+    """
+    Yield functions reading one chunk of (id, status, product_id, quantity)
+    rows. They are called inside the chunk's transaction, so the rows can't
+    change between the read and the update.
+    """
+    columns = ('id', 'status', 'product_id', 'quantity')
+    if ids is not None:
+        ids = sorted(ids)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            yield lambda chunk=chunk: list(
+                Order.objects.select_for_update().filter(pk__in=chunk).values_list(*columns)
+            )
+        return
+
+    # Keyset paging on id: moved orders may stop matching the filter
+    orders = Order.objects.filter(**{FILTERS[name]: value for name, value in filters.items()})
+    position = {'last': 0, 'done': False}
+
+    def read():
+        rows = list(
+            orders.select_for_update().filter(pk__gt=position['last']).order_by('pk')
+            .values_list(*columns)[:chunk_size]
+        )
+        if rows:
+            position['last'] = rows[-1][0]
+        position['done'] = len(rows) < chunk_size
+        return rows
+
+    while not position['done']:
+        yield read
+
+
+def transition_orders(to, ids=None, filters=None, actor_id=None, chunk_size=None):
+    """
+    Move the selected orders to status `to`.
+
+    Select orders with `ids` or with `filters` (keys of FILTERS). Returns
+    counts: updated, skipped (status can't move to `to`, including orders
+    already there), missing (ids not found) and restored_units (stock given
+    back by cancellations). Raises TransitionError for an unknown status or
+    an empty selection.
+    """
+    if to not in TRANSITIONS:
+        raise TransitionError(f"Unknown status {to!r}; expected one of {', '.join(TRANSITIONS)}")
+    filters = {name: value for name, value in (filters or {}).items() if value is not None}
+    unknown = set(filters) - set(FILTERS)
+    if unknown:
+        raise TransitionError(f"Unknown order filters: {', '.join(sorted(unknown))}")
+    if ids is None and not filters:
+        raise TransitionError("Select orders by ids or by at least one filter")
+    if ids is not None:
+        try:
+            ids = {int(pk) for pk in ids}
+        except (TypeError, ValueError):
+            raise TransitionError("Order ids must be integers")
+
+    allowed = sources(to)
+    chunk_size = chunk_size or get_config()['chunk_size']
+    result = {'updated': 0, 'skipped': 0, 'missing': 0, 'restored_units': 0}
+    for read in chunks(ids, filters, chunk_size):
+        with transaction.atomic():
+            rows = read()
+            moved = [row for row in rows if row[1] in allowed]
+            result['skipped'] += len(rows) - len(moved)
+            if not moved:
+                continue
+
+            now = timezone.now()
+            # updated_at is set explicitly: update() skips auto_now, and the
+            # analytics snapshot refreshes from it
+            Order.objects.filter(pk__in=[row[0] for row in moved], status__in=allowed).update(
+                status=to, updated_at=now,
+            )
+            if to == 'cancelled':
+                result['restored_units'] += restore_stock(moved, now)
+            OrderEvent.objects.bulk_create([
+                OrderEvent(
+                    order_id=order_id, from_status=STATUS_CODES[status], to_status=STATUS_CODES[to],
+                    actor_id=actor_id, created_at=now,
+                )
+                for order_id, status, _, _ in moved
+            ])
+            result['updated'] += len(moved)
+    if ids is not None:
+        result['missing'] = len(ids) - result['updated'] - result['skipped']
+    return result
+
+
+def restore_stock(rows, now):
+    """Give the quantities of cancelled (id, status, product_id, quantity) rows back to stock."""
+    quantities = {}
+    for _, _, product_id, quantity in rows:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    # In id order, so concurrent cancellations lock products in the same order
+    for product_id in sorted(quantities):
+        Product.objects.filter(pk=product_id).update(stock=F('stock') + quantities[product_id], updated_at=now)
+    low_stock.stock_changed(quantities)
+    return sum(quantities.values())
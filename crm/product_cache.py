@@ -0,0 +1,154 @@
+"""
+CRM Product Cache
+Per-process LRU cache of product snapshots for the hot lookups in
+crm.schema (product(id) and createOrder).
+
+Snapshots hold every Product column except stock, which is always read
+from the database. Entries expire after CRM_PRODUCT_CACHE['ttl'] seconds
+and are dropped early when the product's version key in Django's cache
+changes. Saving a product bumps that key, so with a shared cache backend
+(e.g. Redis) every process drops its copy on the next lookup. While that
+cache is unreachable, lookups read the database as misses, and saves
+reach other processes only through the ttl.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from crm.models import Product
+
+DEFAULTS = {
+    'enabled': True,
+    # Products kept per process
+    'max_size': 1024,
+    # Seconds a snapshot is used without another version bump (bounds
+    # staleness for updates that bypass save(), e.g. queryset.update())
+    'ttl': 30.0,
+}
+
+# Product columns in model order (as Model.from_db() expects them) and
+# the snapshot columns, which leave stock out on purpose
+COLUMNS = [field.attname for field in Product._meta.concrete_fields]
+FIELDS = [name for name in COLUMNS if name != 'stock']
+STOCK = COLUMNS.index('stock')
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_PRODUCT_CACHE', {})}
+
+
+def version_key(pk):
+    return f'crm:product:{pk}:version'
+
+
+def current_version(pk):
+    """The product's version in Django's cache, or None if the cache is unreachable."""
+    try:
+        return cache.get(version_key(pk), 0)
+    except Exception:
+        return None
+
+
+class ProductCache:
+    """Thread-safe LRU of {pk: (values, version, expires_at)} with hit/miss counters."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'invalidated': 0, 'evictions': 0}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def discard(self, pk):
+        with self._lock:
+            self._entries.pop(int(pk), None)
+
+    def get(self, pk):
+        """
+        Return a Product for pk. On a cache hit stock is deferred, so reading
+        it queries the database. Raises Product.DoesNotExist.
+        """
+        config = get_config()
+        pk = int(pk)
+        if not config['enabled']:
+            return Product.objects.get(pk=pk)
+
+        version = current_version(pk)
+        with self._lock:
+            entry = self._entries.get(pk)
+            if entry is not None and version is not None:
+                values, entry_version, expires_at = entry
+                if entry_version != version:
+                    self.stats['invalidated'] += 1
+                elif expires_at < time.monotonic():
+                    self.stats['expired'] += 1
+                else:
+                    self._entries.move_to_end(pk)
+                    self.stats['hits'] += 1
+                    return Product.from_db(DEFAULT_DB_ALIAS, FIELDS, values)
+            self.stats['misses'] += 1
+
+        # A miss costs the same single query as an uncached lookup, and
+        # the instance returned for it has the current stock loaded
+        row = Product.objects.filter(pk=pk).values_list(*COLUMNS).first()
+        if row is None:
+            raise Product.DoesNotExist(f"Product {pk} does not exist")
+
+        if version is not None:
+            with self._lock:
+                self._entries[pk] = (row[:STOCK] + row[STOCK + 1:], version, time.monotonic() + config['ttl'])
+                self._entries.move_to_end(pk)
+                while len(self._entries) > config['max_size']:
+                    self._entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+        return Product.from_db(DEFAULT_DB_ALIAS, COLUMNS, row)
+
+    def info(self):
+        """Counters plus size and hit rate, e.g. for logs and benchmarks."""
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'size': len(self._entries),
+            'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else None,
+        }
+
+
+products = ProductCache()
+
+
+def get_product(pk):
+    return products.get(pk)
+
+
+def invalidate(pk):
+    """Drop pk here and, through its version key, in every other process."""
+    products.discard(pk)
+    try:
+        try:
+            cache.incr(version_key(pk))
+        except ValueError:
+            # No version yet: any value other than the default 0 invalidates
+            cache.set(version_key(pk), 1, None)
+    except Exception:
+        # Cache unreachable: other processes drop their copy after the ttl
+        pass
+
+
+@receiver(post_save, sender=Product)
+def invalidate_saved_product(sender, instance, update_fields=None, **kwargs):
+    # Stock-only saves don't change what the snapshots hold
+    if update_fields is not None and set(update_fields) <= {'stock', 'updated_at'}:
+        return
+    invalidate(instance.pk)
@@ -0,0 +1,422 @@
+"""
+CRM Rate Limiting
+Admission control for the /graphql endpoint (see RateLimitMiddleware).
+
+Every client (authenticated user, API key or IP address) has a token
+bucket refilled at CRM_RATE_LIMIT['rate'] cost units per second, up to
+'burst'. A request takes as many tokens as its operations cost, estimated
+statically from the query: each field costs 1 (or its 'field_costs' entry)
+and the fields below a list are multiplied by the list's size argument
+(first/top/limit), clamped to the resolver's maximum ('max_sizes'). Lists
+without one count as 'list_sizes' entries (the unbounded allOrders,
+allCustomers and allProducts) or 'list_size' items. An allOrders with
+nested fields therefore costs far more than product(id). Each fragment's
+cost is computed once per nesting level, and queries nested deeper than
+'max_depth' or selecting more than 'max_nodes' fields are refused with a
+400 before any further work.
+
+On top of that each client may have 'concurrency' requests in flight, and
+when 'max_in_flight' requests are in flight overall the endpoint sheds new
+ones. Rejected requests get a 429 with a Retry-After header.
+
+The 'locmem' backend keeps state per process (tests, single node); the
+'redis' backend shares it between every node through Redis.
+"""
+
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.http import JsonResponse
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, InlineFragmentNode,
+    IntValueNode, OperationType, VariableNode, get_named_type, get_nullable_type, is_list_type, parse,
+)
+from graphql.utilities import get_operation_ast
+
+DEFAULTS = {
+    'enabled': True,
+    # 'locmem' (per process) or 'redis' (shared between nodes)
+    'backend': 'locmem',
+    'redis_url': 'redis://localhost:6379/1',
+    # Paths the middleware applies to
+    'paths': ['/graphql'],
+    # Cost units refilled per second and bucket size, per client
+    'rate': 100.0,
+    'burst': 2000,
+    # Requests in flight per client, and overall before shedding
+    'concurrency': 4,
+    'max_in_flight': 64,
+    # Assumed size of a list without a first/top/limit argument, and of
+    # the root lists that return a whole table
+    'list_size': 20,
+    'list_sizes': {
+        'Query.allOrders': 250,
+        'Query.allCustomers': 250,
+        'Query.allProducts': 250,
+    },
+    'size_arguments': ['first', 'top', 'limit'],
+    # Largest size the resolvers return, whatever the argument asks for
+    'max_sizes': {
+        'Query.pendingOrderReminders': 1000,
+        'Query.customersBySegment': 1000,
+        'Query.search': 100,
+    },
+    # Limits of the cost walk itself: deeper or larger queries are refused
+    'max_depth': 20,
+    'max_nodes': 5000,
+    # Extra cost of running a mutation, and per-field cost overrides
+    'mutation_cost': 10,
+    'field_costs': {
+        'Query.search': 10,
+        'Query.revenueBreakdown': 20,
+    },
+    # Request header carrying an API key (hashed before use)
+    'api_key_header': 'X-Api-Key',
+    # Use the first X-Forwarded-For address (only behind a trusted proxy)
+    'trust_forwarded_for': False,
+    # Seconds after which a crashed worker's in-flight slots are forgotten (redis)
+    'in_flight_ttl': 60,
+}
+
+# Parsed documents by query text
+_documents = OrderedDict()
+DOCUMENT_CACHE_SIZE = 256
+
+
+class QueryTooComplex(Exception):
+    """The query is nested too deep or selects too many fields to be costed."""
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'CRM_RATE_LIMIT', {})}
+    for name in ('field_costs', 'list_sizes', 'max_sizes'):
+        config[name] = {**DEFAULTS[name], **config[name]}
+    return config
+
+
+def parse_cached(query):
+    document = _documents.get(query)
+    if document is None:
+        document = parse(query)
+        _documents[query] = document
+        if len(_documents) > DOCUMENT_CACHE_SIZE:
+            _documents.popitem(last=False)
+    return document
+
+
+def list_size(node, field, key, variables, config):
+    """
+    Size of the list field `key` (Type.field): its size argument from the
+    query, its variables or its default, at most the resolver's maximum.
+    """
+    size = None
+    arguments = {argument.name.value: argument.value for argument in node.arguments}
+    for name in config['size_arguments']:
+        value = arguments.get(name)
+        if isinstance(value, IntValueNode):
+            size = max(0, int(value.value))
+        elif isinstance(value, VariableNode) and isinstance(variables.get(value.name.value), int):
+            size = max(0, variables[value.name.value])
+        elif name in field.args and isinstance(field.args[name].default_value, int):
+            size = field.args[name].default_value
+        if size is not None:
+            return min(size, config['max_sizes'].get(key, size))
+    return config['list_sizes'].get(key, config['list_size'])
+
+
+def selection_cost(selection_set, parent_type, context, seen=(), depth=0):
+    schema, fragments, variables, config, walk = context
+    if depth > config['max_depth']:
+        raise QueryTooComplex(f"Query is nested more than {config['max_depth']} levels deep")
+    total = 0
+    for node in selection_set.selections:
+        walk['nodes'] += 1
+        if walk['nodes'] > config['max_nodes']:
+            raise QueryTooComplex(f"Query selects more than {config['max_nodes']} fields")
+        if isinstance(node, FieldNode):
+            name = node.name.value
+            field = getattr(parent_type, 'fields', {}).get(name)
+            if name.startswith('__') or field is None:
+                # Introspection, or a field validation will reject anyway
+                total += 1
+                continue
+            key = f'{parent_type.name}.{name}'
+            children = 0
+            if node.selection_set:
+                children = selection_cost(node.selection_set, get_named_type(field.type), context, seen, depth + 1)
+            if is_list_type(get_nullable_type(field.type)):
+                children *= list_size(node, field, key, variables, config)
+            total += config['field_costs'].get(key, 1) + children
+        elif isinstance(node, InlineFragmentNode):
+            type_ = schema.get_type(node.type_condition.name.value) if node.type_condition else parent_type
+            total += selection_cost(node.selection_set, type_, context, seen, depth)
+        elif isinstance(node, FragmentSpreadNode):
+            name = node.name.value
+            fragment = fragments.get(name)
+            if fragment is not None and name not in seen:
+                # Spreading a fragment twice must not walk it twice: nested
+                # fragments would take exponential time
+                key = (name, depth)
+                if key not in walk['fragments']:
+                    type_ = schema.get_type(fragment.type_condition.name.value)
+                    walk['fragments'][key] = selection_cost(fragment.selection_set, type_, context, seen + (name,), depth)
+                total += walk['fragments'][key]
+    return total
+
+
+def query_cost(query, variables=None, operation_name=None, config=None):
+    """
+    Static cost estimate of one GraphQL operation. Invalid queries cost 1.
+    Raises QueryTooComplex past max_depth or max_nodes.
+    """
+    from graphene_django.settings import graphene_settings
+
+    config = config or get_config()
+    schema = graphene_settings.SCHEMA.graphql_schema
+    try:
+        document = parse_cached(query)
+    except GraphQLError:
+        return 1
+    operation = get_operation_ast(document, operation_name)
+    root = operation and schema.get_root_type(operation.operation)
+    if root is None:
+        return 1
+    fragments = {
+        node.name.value: node for node in document.definitions if isinstance(node, FragmentDefinitionNode)
+    }
+    walk = {'nodes': 0, 'fragments': {}}
+    context = (schema, fragments, variables if isinstance(variables, dict) else {}, config, walk)
+    cost = selection_cost(operation.selection_set, root, context)
+    if operation.operation == OperationType.MUTATION:
+        cost += config['mutation_cost']
+    return max(1, cost)
+
+
+class LocMemStore:
+    """Buckets and in-flight counters of this process."""
+
+    # Buckets kept; the least recently used (long refilled) ones are dropped
+    max_clients = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._in_flight = {}
+        self._total = 0
+
+    def take(self, client, cost, rate, burst):
+        """Take cost tokens. Returns (allowed, tokens left, seconds until cost is available)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return allowed, tokens, 0.0 if allowed else (cost - tokens) / rate
+
+    def acquire(self, client, concurrency, max_in_flight):
+        """Count a request in flight. Returns None, or why it was refused."""
+        with self._lock:
+            if self._total >= max_in_flight:
+                return 'overloaded'
+            if self._in_flight.get(client, 0) >= concurrency:
+                return 'concurrency'
+            self._in_flight[client] = self._in_flight.get(client, 0) + 1
+            self._total += 1
+        return None
+
+    def release(self, client):
+        with self._lock:
+            count = self._in_flight.get(client, 0) - 1
+            if count > 0:
+                self._in_flight[client] = count
+            else:
+                self._in_flight.pop(client, None)
+            self._total = max(0, self._total - 1)
+
+
+# KEYS[1] bucket; ARGV cost, rate, burst. Returns {allowed, tokens*1000}.
+TAKE_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local cost, rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, math.floor(tokens * 1000)}
+"""
+
+# KEYS[1] client counter, KEYS[2] global counter; ARGV concurrency, max_in_flight, ttl
+ACQUIRE_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') >= tonumber(ARGV[2]) then
+    return 'overloaded'
+end
+if tonumber(redis.call('GET', KEYS[1]) or '0') >= tonumber(ARGV[1]) then
+    return 'concurrency'
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return false
+"""
+
+RELEASE_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if tonumber(redis.call('DECR', key)) <= 0 then
+        redis.call('DEL', key)
+    end
+end
+"""
+
+
+class RedisStore:
+    """
+    Buckets and in-flight counters shared through Redis, updated by Lua
+    scripts. Fails open: while Redis is unreachable every request is admitted.
+    """
+
+    prefix = 'crm:ratelimit:'
+
+    def __init__(self, url, in_flight_ttl):
+        import redis
+
+        self.errors = redis.RedisError
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.in_flight_ttl = in_flight_ttl
+        self._take = self.client.register_script(TAKE_SCRIPT)
+        self._acquire = self.client.register_script(ACQUIRE_SCRIPT)
+        self._release = self.client.register_script(RELEASE_SCRIPT)
+
+    def take(self, client, cost, rate, burst):
+        try:
+            allowed, tokens = self._take(keys=[f'{self.prefix}bucket:{client}'], args=[cost, rate, burst])
+        except self.errors:
+            return True, burst, 0.0
+        tokens = tokens / 1000
+        return bool(allowed), tokens, 0.0 if allowed else (cost - tokens) / rate
+
+    def acquire(self, client, concurrency, max_in_flight):
+        try:
+            reason = self._acquire(
+                keys=[f'{self.prefix}in_flight:{client}', f'{self.prefix}in_flight'],
+                args=[concurrency, max_in_flight, self.in_flight_ttl],
+            )
+        except self.errors:
+            return None
+        return reason.decode() if reason else None
+
+    def release(self, client):
+        try:
+            self._release(keys=[f'{self.prefix}in_flight:{client}', f'{self.prefix}in_flight'])
+        except self.errors:
+            pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                config = get_config()
+                if config['backend'] == 'redis':
+                    _store = RedisStore(config['redis_url'], config['in_flight_ttl'])
+                else:
+                    _store = LocMemStore()
+    return _store
+
+
+def reset():
+    """Forget every bucket and counter of the locmem backend, e.g. between tests."""
+    global _store
+    _store = None
+
+
+def client_key(request, config):
+    """Rate limit key of the request: its user, else its API key, else its IP address."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    api_key = request.headers.get(config['api_key_header'])
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:24]
+    address = request.META.get('REMOTE_ADDR', '')
+    if config['trust_forwarded_for'] and request.headers.get('X-Forwarded-For'):
+        address = request.headers['X-Forwarded-For'].split(',')[0].strip()
+    return f'ip:{address}'
+
+
+def request_operations(request):
+    """(query, variables, operation name) of every operation in a GraphQL request."""
+    if request.method == 'GET':
+        payloads = [request.GET.dict()]
+    elif request.content_type == 'application/graphql':
+        payloads = [{'query': request.body.decode()}]
+    elif request.content_type == 'application/json':
+        try:
+            payloads = json.loads(request.body or b'{}')
+        except ValueError:
+            return []
+        if not isinstance(payloads, list):
+            payloads = [payloads]
+    else:
+        payloads = [request.POST.dict()]
+
+    operations = []
+    for payload in payloads:
+        if not isinstance(payload, dict) or not isinstance(payload.get('query'), str):
+            continue
+        variables = payload.get('variables')
+        if isinstance(variables, str):
+            try:
+                variables = json.loads(variables)
+            except ValueError:
+                variables = None
+        operations.append((payload['query'], variables, payload.get('operationName')))
+    return operations
+
+
+def request_cost(request, config):
+    """Summed cost of the operations of a request (batches hold several); at least 1."""
+    return max(1, sum(
+        query_cost(query, variables, operation_name, config)
+        for query, variables, operation_name in request_operations(request)
+    ))
+
+
+def query_too_complex(message):
+    return JsonResponse({'errors': [{'message': message, 'extensions': {'code': 'QUERY_TOO_COMPLEX'}}]}, status=400)
+
+
+def too_many_requests(message, reason, retry_after, headers=None):
+    retry_after = max(1, math.ceil(retry_after))
+    response = JsonResponse(
+        {'errors': [{'message': message, 'extensions': {'code': 'RATE_LIMITED', 'reason': reason,
+                                                        'retryAfter': retry_after}}]},
+        status=429,
+    )
+    response['Retry-After'] = str(retry_after)
+    for name, value in (headers or {}).items():
+        response[name] = value
+    return response
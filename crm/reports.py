@@ -0,0 +1,259 @@
+"""
+CRM Weekly Report
+Per-product sales, customer segments, status funnel and cohort retention
+for one week, over hot and archived orders.
+
+Orders are split into id-range shards. Each shard is aggregated on its
+own (in a process pool, a Celery chord or inline) into a JSON-friendly
+partial, and the partials are merged, so the work spreads across cores.
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from multiprocessing import get_all_start_methods, get_context
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from crm.models import ArchivedOrder, Order, Product
+from crm.money import cents as cents_of, from_cents
+
+DEFAULTS = {
+    # Shards per report; more shards than workers keeps every worker busy
+    'shards': 16,
+    # Products listed in the report, by revenue
+    'top_products': 20,
+    # Weekly cohorts followed in the retention table
+    'cohort_weeks': 8,
+    # Lifetime order counts at which customers become 'repeat' and 'loyal'
+    'segments': {'repeat': 2, 'loyal': 5},
+    # Directory the JSON reports are written to
+    'output_dir': '/tmp',
+}
+
+# Status funnel stages in order; cancelled orders are reported beside it
+FUNNEL = ['pending', 'processing', 'shipped', 'delivered']
+
+WEEK = timedelta(days=7)
+
+
+def get_config():
+    config = {**DEFAULTS, **getattr(settings, 'CRM_REPORTS', {})}
+    config['segments'] = {**DEFAULTS['segments'], **config['segments']}
+    return config
+
+
+def week_bounds(day=None):
+    """Monday 00:00 UTC of the week containing `day` (default: last full week) and a week later."""
+    if day is None:
+        day = timezone.now().date() - WEEK
+    start = datetime.combine(day - timedelta(days=day.weekday()), dt_time.min, tzinfo=dt_timezone.utc)
+    return start, start + WEEK
+
+
+def shard_ranges(shards):
+    """Split the order ids of both tables into at most `shards` [low, high) ranges."""
+    low, high = None, None
+    for model in (Order, ArchivedOrder):
+        bounds = model.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is not None:
+            low = bounds['low'] if low is None else min(low, bounds['low'])
+            high = bounds['high'] if high is None else max(high, bounds['high'])
+    if low is None:
+        return []
+    step = max(1, -(-(high - low + 1) // shards))
+    return [[start, min(start + step, high + 1)] for start in range(low, high + 1, step)]
+
+
+def aggregate_shard(low, high, start, end):
+    """
+    Partial aggregates of the orders with low <= id < high, for the week
+    [start, end) (ISO strings or datetimes). Everything is keyed by str
+    and holds ints so partials survive Celery's JSON serializer.
+    """
+    if isinstance(start, str):
+        start, end = datetime.fromisoformat(start), datetime.fromisoformat(end)
+    cohort_start = start - WEEK * (get_config()['cohort_weeks'] - 1)
+    start_ts, cohort_ts = start.timestamp(), cohort_start.timestamp()
+    week_seconds = WEEK.total_seconds()
+
+    products = {}
+    statuses = {}
+    # customer -> [lifetime orders, first order ts, week orders, week cents, active week bitmask]
+    customers = {}
+    for model in (Order, ArchivedOrder):
+        rows = model.objects.filter(id__gte=low, id__lt=high, created_at__lt=end).order_by().annotate(
+            cents=cents_of('total_amount'),
+        ).values_list('customer_id', 'product_id', 'quantity', 'cents', 'status', 'created_at')
+        for customer_id, product_id, quantity, cents, status, created_at in rows.iterator(chunk_size=10000):
+            ts = created_at.timestamp()
+            key = str(customer_id)
+            customer = customers.get(key)
+            if customer is None:
+                customer = customers[key] = [0, ts, 0, 0, 0]
+            customer[0] += 1
+            if ts < customer[1]:
+                customer[1] = ts
+            if ts >= cohort_ts:
+                # Bit n: ordered in the n-th week of the cohort window
+                customer[4] |= 1 << int((ts - cohort_ts) // week_seconds)
+            if ts < start_ts:
+                continue
+
+            customer[2] += 1
+            customer[3] += cents
+            product = products.get(str(product_id))
+            if product is None:
+                product = products[str(product_id)] = [0, 0, 0]
+            product[0] += 1
+            product[1] += quantity
+            product[2] += cents
+            statuses[status] = statuses.get(status, 0) + 1
+    return {'products': products, 'statuses': statuses, 'customers': customers}
+
+
+def merge(partials):
+    """Combine shard partials into one."""
+    merged = {'products': {}, 'statuses': {}, 'customers': {}}
+    for partial in partials:
+        for key, (orders, units, cents) in partial['products'].items():
+            total = merged['products'].setdefault(key, [0, 0, 0])
+            total[0] += orders
+            total[1] += units
+            total[2] += cents
+        for status, count in partial['statuses'].items():
+            merged['statuses'][status] = merged['statuses'].get(status, 0) + count
+        for key, (orders, first, week_orders, week_cents, active) in partial['customers'].items():
+            total = merged['customers'].get(key)
+            if total is None:
+                merged['customers'][key] = [orders, first, week_orders, week_cents, active]
+                continue
+            total[0] += orders
+            total[1] = min(total[1], first)
+            total[2] += week_orders
+            total[3] += week_cents
+            total[4] |= active
+    return merged
+
+
+def money(cents):
+    return str(from_cents(cents))
+
+
+def finalize(merged, start, end):
+    """Turn merged partials into the report dict."""
+    config = get_config()
+    products = sorted(merged['products'].items(), key=lambda item: (-item[1][2], int(item[0])))
+    top = products[:config['top_products']]
+    names = Product.objects.in_bulk([int(key) for key, _ in top])
+
+    # Segments by lifetime orders up to the end of the week
+    thresholds = config['segments']
+    segments = {name: {'customers': 0, 'orders': 0, 'revenue_cents': 0} for name in ('new', 'repeat', 'loyal')}
+    for orders, _, customer_orders, customer_cents, _ in merged['customers'].values():
+        if not customer_orders:
+            continue
+        name = 'loyal' if orders >= thresholds['loyal'] else 'repeat' if orders >= thresholds['repeat'] else 'new'
+        segments[name]['customers'] += 1
+        segments[name]['orders'] += customer_orders
+        segments[name]['revenue_cents'] += customer_cents
+
+    # Funnel: orders that reached each stage (or a later one)
+    statuses = merged['statuses']
+    week_orders = sum(statuses.values())
+    funnel = []
+    for index, status in enumerate(FUNNEL):
+        reached = sum(statuses.get(later, 0) for later in FUNNEL[index:])
+        funnel.append({
+            'stage': status,
+            'orders': reached,
+            'share': round(reached / week_orders, 4) if week_orders else 0.0,
+        })
+
+    # Cohorts: customers by week of first order, share ordering again in later weeks
+    weeks = config['cohort_weeks']
+    cohort_start = start - WEEK * (weeks - 1)
+    cohorts = [{'customers': 0, 'active': [0] * (weeks - n)} for n in range(weeks)]
+    for _, first, _, _, active in merged['customers'].values():
+        cohort = int((first - cohort_start.timestamp()) // WEEK.total_seconds())
+        if not 0 <= cohort < weeks:
+            continue
+        cohorts[cohort]['customers'] += 1
+        for offset in range(weeks - cohort):
+            if active >> (cohort + offset) & 1:
+                cohorts[cohort]['active'][offset] += 1
+
+    year, week, _ = start.isocalendar()
+    return {
+        'week': f'{year}-W{week:02d}',
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'totals': {
+            'orders': week_orders,
+            'units': sum(units for _, units, _ in merged['products'].values()),
+            'revenue': money(sum(cents for _, _, cents in merged['products'].values())),
+            'customers': sum(1 for customer in merged['customers'].values() if customer[2]),
+        },
+        'products': [
+            {
+                'product_id': int(key),
+                'name': names[int(key)].name if int(key) in names else None,
+                'orders': orders,
+                'units': units,
+                'revenue': money(cents),
+            }
+            for key, (orders, units, cents) in top
+        ],
+        'segments': {
+            name: {'customers': values['customers'], 'orders': values['orders'], 'revenue': money(values['revenue_cents'])}
+            for name, values in segments.items()
+        },
+        'funnel': funnel,
+        'cancelled': statuses.get('cancelled', 0),
+        'cohorts': [
+            {
+                'cohort': '{}-W{:02d}'.format(*(cohort_start + WEEK * n).isocalendar()[:2]),
+                'customers': cohort['customers'],
+                'retention': [
+                    round(active / cohort['customers'], 4) if cohort['customers'] else 0.0
+                    for active in cohort['active']
+                ],
+            }
+            for n, cohort in enumerate(cohorts)
+        ],
+    }
+
+
+def _aggregate(args):
+    return aggregate_shard(*args)
+
+
+def build_weekly_report(day=None, workers=1, shards=None):
+    """
+    Build the report for the week containing `day` (default: last full week).
+    With workers > 1 the shards are aggregated by a pool of forked processes.
+    """
+    start, end = week_bounds(day)
+    ranges = shard_ranges(shards or get_config()['shards'])
+    jobs = [(low, high, start, end) for low, high in ranges]
+
+    if workers > 1 and len(jobs) > 1 and 'fork' in get_all_start_methods():
+        # Children must open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('fork')) as pool:
+            partials = list(pool.map(_aggregate, jobs))
+    else:
+        partials = [aggregate_shard(*job) for job in jobs]
+    return finalize(merge(partials), start, end)
+
+
+def write_report(report):
+    """Write the report as JSON to CRM_REPORTS['output_dir']. Returns the path."""
+    path = os.path.join(get_config()['output_dir'], f"crm_weekly_report_{report['week']}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return path
@@ -0,0 +1,230 @@
+"""
+CRM RFM Scoring
+Recency, frequency and monetary scores and segments of customers, kept
+up to date incrementally instead of scanning every order on demand.
+
+Each customer with orders has a CustomerRFM row holding the aggregates of
+their hot and archived orders (cancelled ones excluded): last order date,
+order count and revenue. Each aggregate is scored 1 to 5 by the quintile
+it falls in among all customers, and the scores name the customer's
+segment (SEGMENTS), an indexed column customersBySegment pages through.
+
+- refresh() (refresh_rfm_scores, every few minutes) reads only the
+  orders updated since the watermark in RFMState, re-aggregates their
+  customers and scores them with the stored quintile boundaries.
+- rescore() (rescore_rfm, nightly) recomputes the boundaries from every
+  customer's aggregates and rescores everyone. Recency scores drift as
+  time passes without orders; this is where they catch up.
+
+Deleted orders are not seen by refresh(); deleting a customer deletes
+their row. Configure through the CRM_RFM setting.
+"""
+
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, Max, Q, Sum, Value, When
+from django.utils import timezone
+
+from crm import money
+from crm.joblog import job_run
+from crm.low_stock import chunked
+from crm.models import ArchivedOrder, CustomerRFM, Order, RFMState
+
+DEFAULTS = {
+    # Seconds of updated_at re-read on each refresh, for transactions
+    # that committed after a later updated_at was already seen
+    'overlap': 60.0,
+    # Customers aggregated and scored per query
+    'chunk_size': 500,
+}
+
+# Scores run from 1 to QUANTILES
+QUANTILES = 5
+
+# Aggregate each score is computed from
+METRICS = {'recency': 'last_order_at', 'frequency': 'orders', 'monetary': 'revenue'}
+
+# The first segment whose score ranges all match wins; unlisted scores match any value
+SEGMENTS = [
+    ('champions', {'recency': (4, 5), 'frequency': (4, 5), 'monetary': (4, 5)}),
+    ('loyal', {'recency': (3, 5), 'frequency': (3, 5)}),
+    ('new', {'recency': (4, 5), 'frequency': (1, 1)}),
+    ('promising', {'recency': (3, 5), 'frequency': (1, 2)}),
+    ('at_risk', {'recency': (1, 2), 'frequency': (3, 5)}),
+    ('hibernating', {'recency': (1, 2), 'frequency': (1, 2)}),
+]
+DEFAULT_SEGMENT = 'others'
+SEGMENT_NAMES = [name for name, _ in SEGMENTS] + [DEFAULT_SEGMENT]
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_RFM', {})}
+
+
+def get_state():
+    state, _ = RFMState.objects.get_or_create(pk=1)
+    return state
+
+
+def boundary_values(metric, boundaries):
+    """The stored boundaries of `metric` as values of its field."""
+    values = boundaries.get(metric) or []
+    if metric == 'recency':
+        return [datetime.fromisoformat(value) for value in values]
+    if metric == 'monetary':
+        return [money.from_cents(value) for value in values]
+    return values
+
+
+def score_expression(metric, boundaries):
+    """
+    Score of `metric` as a query expression: 1 + the number of boundaries
+    below the value, so customers tied on a boundary share the lower score.
+    """
+    field = METRICS[metric]
+    values = boundary_values(metric, boundaries)
+    whens = [
+        When(**{f'{field}__gt': value}, then=Value(len(values) + 1 - index))
+        for index, value in enumerate(reversed(values))
+    ]
+    return Case(*whens, default=Value(1)) if whens else Value(1)
+
+
+def segment_expression():
+    whens = [
+        When(Q(**{f'{metric}_score__range': scores for metric, scores in ranges.items()}), then=Value(name))
+        for name, ranges in SEGMENTS
+    ]
+    return Case(*whens, default=Value(DEFAULT_SEGMENT))
+
+
+def score(queryset, boundaries):
+    """Score the customers of `queryset` with `boundaries`, then name their segments."""
+    if not boundaries:
+        return
+    queryset.update(**{f'{metric}_score': score_expression(metric, boundaries) for metric in METRICS})
+    # Separate UPDATE: the segment is computed from the new scores
+    queryset.update(segment=segment_expression())
+
+
+def aggregate(customer_ids):
+    """{customer id: (orders, revenue cents, last order)} over hot and archived orders."""
+    totals = {}
+    for model in (Order, ArchivedOrder):
+        # The customer_id index keeps this proportional to the customers' orders
+        rows = (
+            model.objects.filter(customer_id__in=customer_ids).exclude(status='cancelled').order_by()
+            .values('customer_id')
+            .annotate(orders=Count('id'), cents=Sum(money.cents('total_amount')), last=Max('created_at'))
+            .values_list('customer_id', 'orders', 'cents', 'last')
+        )
+        for pk, orders, cents, last in rows:
+            if pk in totals:
+                previous = totals[pk]
+                orders, cents, last = orders + previous[0], cents + previous[1], max(last, previous[2])
+            totals[pk] = (orders, cents, last)
+    return totals
+
+
+def update_customers(customer_ids, boundaries):
+    """Re-aggregate and score the customers `customer_ids` (one chunk). Returns how many have orders."""
+    totals = aggregate(customer_ids)
+    # Upsert: one statement for new and existing rows
+    CustomerRFM.objects.bulk_create(
+        [
+            CustomerRFM(customer_id=pk, orders=orders, revenue=money.from_cents(cents), last_order_at=last)
+            for pk, (orders, cents, last) in totals.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['customer'],
+        update_fields=['orders', 'revenue', 'last_order_at', 'updated_at'],
+    )
+    # Customers left with cancelled orders only
+    CustomerRFM.objects.filter(customer_id__in=set(customer_ids) - set(totals)).delete()
+    score(CustomerRFM.objects.filter(customer_id__in=list(totals)), boundaries)
+    return len(totals)
+
+
+def compute_boundaries():
+    """
+    QUANTILES - 1 ascending cut points of each aggregate over all customers,
+    read in sorted order from the database without holding every value.
+    """
+    count = CustomerRFM.objects.count()
+    # Last value of each quantile but the top one
+    positions = [max(0, count * step // QUANTILES - 1) for step in range(1, QUANTILES)]
+    boundaries = {}
+    for metric, field in METRICS.items():
+        column = money.cents(field) if metric == 'monetary' else field
+        values = CustomerRFM.objects.order_by(field).values_list(column, flat=True)
+        cuts = []
+        for index, value in enumerate(values.iterator(chunk_size=10000)):
+            # Positions repeat when there are fewer customers than quantiles
+            while len(cuts) < len(positions) and positions[len(cuts)] == index:
+                cuts.append(value.isoformat() if metric == 'recency' else value)
+            if len(cuts) == len(positions):
+                break
+        boundaries[metric] = cuts
+    return boundaries
+
+
+def refresh():
+    """
+    Aggregate and score the customers whose orders changed since the
+    watermark. The first run covers every customer and computes the
+    boundaries. Returns the number of customers updated.
+    """
+    config = get_config()
+    with job_run('refresh_rfm_scores') as run:
+        state = get_state()
+        started = timezone.now()
+        orders = Order.objects.order_by()
+        if state.watermark is not None:
+            orders = orders.filter(updated_at__gte=state.watermark - timedelta(seconds=config['overlap']))
+        # Read before the rows: anything updated meanwhile is read next time
+        newest = orders.aggregate(latest=Max('updated_at'))['latest']
+
+        customer_ids = set(orders.values_list('customer_id', flat=True).distinct())
+        if state.watermark is None:
+            customer_ids |= set(ArchivedOrder.objects.values_list('customer_id', flat=True).distinct())
+        updated = 0
+        for chunk in chunked(customer_ids, config['chunk_size']):
+            # A failed run keeps the watermark, and the next one redoes its chunks
+            with transaction.atomic():
+                updated += update_customers(chunk, state.boundaries)
+        run.count('customers', updated)
+
+        fields = ['watermark']
+        if not state.boundaries and updated:
+            rescore_all(state, run)
+            fields += ['boundaries', 'boundaries_at']
+        state.watermark = newest or state.watermark or started
+        # Only our fields: rescore() may have saved new boundaries meanwhile
+        state.save(update_fields=fields)
+        run.info(f"Refreshed RFM scores of {len(customer_ids)} customers", watermark=state.watermark)
+        return updated
+
+
+def rescore_all(state, run):
+    with transaction.atomic():
+        state.boundaries = compute_boundaries()
+        state.boundaries_at = timezone.now()
+        score(CustomerRFM.objects.all(), state.boundaries)
+    run.info("Recomputed RFM boundaries", boundaries=state.boundaries)
+
+
+def rescore():
+    """
+    Recompute the quintile boundaries from every customer's aggregates and
+    rescore all customers. Returns the number of customers per segment.
+    """
+    with job_run('rescore_rfm') as run:
+        state = get_state()
+        rescore_all(state, run)
+        state.save(update_fields=['boundaries', 'boundaries_at'])
+        segments = dict(CustomerRFM.objects.order_by().values_list('segment').annotate(customers=Count('pk')))
+        for name, customers in segments.items():
+            run.count(name, customers)
+        return segments
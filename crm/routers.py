@@ -0,0 +1,90 @@
+"""
+CRM Database Routing
+Sends reads to the read replicas listed in CRM_READ_REPLICAS (round-robin)
+and every write to the primary ('default').
+
+Reads go to the primary instead when:
+- the current GraphQL operation is a mutation (see crm.middleware),
+- the current request or task already wrote, or
+- the client wrote within the last CRM_REPLICA_PIN_SECONDS, so it reads
+  its own writes even if the replicas lag behind.
+"""
+
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+PRIMARY = 'default'
+
+# True while reads must go to the primary
+_use_primary = ContextVar('crm_use_primary', default=False)
+# True once the current request or task wrote to the primary
+_wrote = ContextVar('crm_wrote', default=False)
+
+_round_robin = itertools.count()
+
+
+def get_replicas():
+    return list(getattr(settings, 'CRM_READ_REPLICAS', []))
+
+
+def use_primary(value=True):
+    """Force reads onto the primary for the current context. Returns a reset token."""
+    return _use_primary.set(value)
+
+
+def reset_primary(token):
+    _use_primary.reset(token)
+
+
+@contextmanager
+def primary():
+    """Read from the primary inside the block, e.g. for read-your-writes."""
+    token = use_primary()
+    try:
+        yield
+    finally:
+        reset_primary(token)
+
+
+def start_request(pinned=False):
+    """Reset the routing state at the start of a request. Returns reset tokens."""
+    return _use_primary.set(pinned), _wrote.set(False)
+
+
+def reset_state():
+    """Forget the routing state, e.g. between Celery tasks run by one worker."""
+    _use_primary.set(False)
+    _wrote.set(False)
+
+
+def end_request(tokens):
+    """Restore the routing state and report whether the request wrote."""
+    wrote = _wrote.get()
+    _use_primary.reset(tokens[0])
+    _wrote.reset(tokens[1])
+    return wrote
+
+
+class ReplicaRouter:
+    """Database router for the primary/replica setup described above."""
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        if not replicas or _use_primary.get() or _wrote.get():
+            return PRIMARY
+        return replicas[next(_round_robin) % len(replicas)]
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and are never migrated directly
+        return db not in get_replicas()
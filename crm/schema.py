@@ -1,8 +1,46 @@
 import graphene
+from datetime import timedelta
+from graphene_django.converter import convert_django_field, get_django_field_description
 from graphene_django.types import DjangoObjectType
 from django.contrib.auth.models import User
-from crm.models import Customer, Product, Order
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from crm.models import Customer, CustomerRFM, Product, Order, ArchivedOrder, OrderEvent
 from crm.models import Product
+from crm import analytics, archive, idempotency, low_stock, money, order_status, rfm
+from crm.loaders import get_loaders
+from crm.ratelimit import parse_cached
+from crm import search as crm_search
+from crm.product_cache import get_product
+from graphql import FieldNode, FragmentDefinitionNode, GraphQLError, OperationDefinitionNode, OperationType, Undefined
+from graphql.language.ast import FloatValueNode, IntValueNode, StringValueNode
+
+# Scalars
+class Money(graphene.Scalar):
+    """Money amount with two decimal places, as a string (\"19.99\") to keep it exact"""
+    
+    @staticmethod
+    def serialize(value):
+        return str(money.to_decimal(value))
+    
+    @classmethod
+    def parse_literal(cls, node, _variables=None):
+        # The literal's text, so 19.99 never goes through a float
+        if isinstance(node, (StringValueNode, IntValueNode, FloatValueNode)):
+            return cls.parse_value(node.value)
+        return Undefined
+    
+    @staticmethod
+    def parse_value(value):
+        try:
+            return money.to_decimal(value)
+        except ValueError:
+            return Undefined
+
+@convert_django_field.register(money.MoneyField)
+def convert_money_field(field, registry=None):
+    return Money(description=get_django_field_description(field), required=not field.null)
 
 # GraphQL Types
 class UserType(DjangoObjectType):
@@ -10,29 +48,131 @@ class UserType(DjangoObjectType):
         model = User
         fields = ('id', 'username', 'email', 'first_name', 'last_name')
 
+# Related objects are read through the request's loaders (crm/loaders.py)
 class CustomerType(DjangoObjectType):
     class Meta:
         model = Customer
         fields = '__all__'
+    
+    def resolve_user(self, info):
+        return get_loaders(info.context).user.load(self.user_id)
+    
+    def resolve_orders(self, info):
+        return get_loaders(info.context).customer_orders.load(self.pk)
 
 class ProductType(DjangoObjectType):
     class Meta:
         model = Product
         fields = '__all__'
+    
+    def resolve_orders(self, info):
+        return get_loaders(info.context).product_orders.load(self.pk)
 
 class OrderType(DjangoObjectType):
     class Meta:
         model = Order
         fields = '__all__'
+    
+    def resolve_customer(self, info):
+        return get_loaders(info.context).customer.load(self.customer_id)
+    
+    def resolve_product(self, info):
+        return get_loaders(info.context).product.load(self.product_id)
+
+class CustomerSegmentType(DjangoObjectType):
+    """A customer's RFM scores and segment (crm/rfm.py)"""
+    class Meta:
+        model = CustomerRFM
+        fields = (
+            'customer', 'segment', 'recency_score', 'frequency_score', 'monetary_score',
+            'orders', 'revenue', 'last_order_at', 'updated_at',
+        )
+    
+    def resolve_customer(self, info):
+        return get_loaders(info.context).customer.load(self.customer_id)
+
+class OrderReminderType(graphene.ObjectType):
+    """Flat order row with the customer's email, used for reminders"""
+    id = graphene.ID()
+    customer_email = graphene.String()
+    created_at = graphene.DateTime()
+    status = graphene.String()
+    total_amount = Money()
+
+class SearchResultType(graphene.ObjectType):
+    """Full-text search hit, best match first"""
+    type = graphene.String()
+    id = graphene.ID()
+    score = graphene.Float()
+    highlight = graphene.String(description="Name with <mark>ed matches, HTML-escaped")
+    snippet = graphene.String(description="Best matching excerpt with <mark>ed matches, HTML-escaped")
+    product = graphene.Field(ProductType)
+    customer = graphene.Field(CustomerType)
+    
+    def resolve_product(self, info):
+        return self['object'] if self['type'] == 'product' else None
+    
+    def resolve_customer(self, info):
+        return self['object'] if self['type'] == 'customer' else None
+
+class OrderEventType(graphene.ObjectType):
+    """Status change of an order, from the append-only event log"""
+    order_id = graphene.ID()
+    from_status = graphene.String()
+    to_status = graphene.String()
+    actor_id = graphene.ID()
+    created_at = graphene.DateTime()
+    
+    def resolve_from_status(self, info):
+        return order_status.STATUS_NAMES[self.from_status]
+    
+    def resolve_to_status(self, info):
+        return order_status.STATUS_NAMES[self.to_status]
+
+class RevenueGroupType(graphene.ObjectType):
+    """Orders, units and revenue of one group in revenueBreakdown"""
+    key = graphene.String(description="Product/customer id, status, or period (2026-10-19, 2026-W42, 2026-10)")
+    orders = graphene.Int()
+    quantity = graphene.Int()
+    revenue = Money()
+
+class OrderTotalsType(graphene.ObjectType):
+    """Number of orders and their revenue, summed by the database"""
+    orders = graphene.Int()
+    revenue = Money()
 
 # Queries
 class Query(graphene.ObjectType):
     # Hello query for testing
     name = graphene.String(default_value="Hello, GraphQL!")
     
+    # Full-text search over products and customers
+    search = graphene.List(
+        SearchResultType,
+        query=graphene.String(required=True),
+        types=graphene.List(graphene.String, description="product and/or customer (default: both)"),
+        first=graphene.Int(default_value=20),
+    )
+    
+    # Revenue analytics over hot and archived orders
+    revenue_breakdown = graphene.List(
+        RevenueGroupType,
+        group_by=graphene.String(required=True, description=', '.join(analytics.GROUP_BY)),
+        since=graphene.DateTime(),
+        until=graphene.DateTime(),
+        statuses=graphene.List(graphene.String),
+        top=graphene.Int(),
+    )
+    
     # Customer queries
     all_customers = graphene.List(CustomerType)
     customer = graphene.Field(CustomerType, id=graphene.ID(required=True))
+    customers_by_segment = graphene.List(
+        CustomerSegmentType,
+        segment=graphene.String(required=True, description=', '.join(rfm.SEGMENT_NAMES)),
+        after_id=graphene.ID(description="Customer id of the previous page's last entry"),
+        first=graphene.Int(default_value=50),
+    )
     
     # Product queries
     all_products = graphene.List(ProductType)
@@ -40,29 +180,111 @@ class Query(graphene.ObjectType):
     low_stock_products = graphene.List(ProductType, threshold=graphene.Int(default_value=10))
     
     # Order queries
-    all_orders = graphene.List(OrderType)
+    all_orders = graphene.List(
+        OrderType,
+        created_after=graphene.DateTime(),
+        created_before=graphene.DateTime(),
+    )
     order = graphene.Field(OrderType, id=graphene.ID(required=True))
+    # Count and revenue of hot and archived orders, without listing them
+    order_totals = graphene.Field(OrderTotalsType)
+    order_events = graphene.List(OrderEventType, order_id=graphene.ID(required=True))
+    pending_order_reminders = graphene.List(
+        OrderReminderType,
+        since_days=graphene.Int(default_value=7),
+        status=graphene.String(default_value='pending'),
+        after_id=graphene.ID(),
+        first=graphene.Int(default_value=100),
+    )
+    
+    def resolve_search(self, info, query, types=None, first=20):
+        unknown = set(types or []) - set(crm_search.TYPES)
+        if unknown:
+            raise GraphQLError(f"Unknown search types: {', '.join(sorted(unknown))}")
+        return crm_search.search(query, types=types, first=first)
+    
+    def resolve_revenue_breakdown(self, info, group_by, since=None, until=None, statuses=None, top=None):
+        if group_by not in analytics.GROUP_BY:
+            raise GraphQLError(f"groupBy must be one of {', '.join(analytics.GROUP_BY)}")
+        rows = analytics.revenue(group_by, since, until, statuses, max(1, top) if top is not None else None)
+        return [
+            RevenueGroupType(key=key, orders=orders, quantity=quantity, revenue=money.from_cents(cents))
+            for key, orders, quantity, cents in rows
+        ]
     
     def resolve_all_customers(self, info):
-        return Customer.objects.all()
+        customers = list(Customer.objects.all())
+        get_loaders(info.context).want_for_customers(customers)
+        return customers
     
     def resolve_customer(self, info, id):
         return Customer.objects.get(pk=id)
     
+    def resolve_customers_by_segment(self, info, segment, after_id=None, first=50):
+        if segment not in rfm.SEGMENT_NAMES:
+            raise GraphQLError(f"segment must be one of {', '.join(rfm.SEGMENT_NAMES)}")
+        # Keyset paging on the (segment, customer) index
+        rows = CustomerRFM.objects.filter(segment=segment).order_by('customer_id')
+        if after_id is not None:
+            rows = rows.filter(customer_id__gt=after_id)
+        rows = list(rows[:max(1, min(first, 1000))])
+        get_loaders(info.context).customer.want(row.customer_id for row in rows)
+        return rows
+    
     def resolve_all_products(self, info):
-        return Product.objects.all()
+        products = list(Product.objects.all())
+        get_loaders(info.context).want_for_products(products)
+        return products
     
     def resolve_product(self, info, id):
-        return Product.objects.get(pk=id)
+        # Cached snapshot; stock is only read from the database if requested
+        return get_product(id)
     
     def resolve_low_stock_products(self, info, threshold=10):
-        return Product.objects.filter(stock__lt=threshold)
+        products = list(Product.objects.filter(stock__lt=threshold))
+        get_loaders(info.context).want_for_products(products)
+        return products
     
-    def resolve_all_orders(self, info):
-        return Order.objects.all()
+    def resolve_all_orders(self, info, created_after=None, created_before=None):
+        # Archived orders are only read when the range reaches past the archive boundary
+        orders = list(archive.orders_in_range(created_after, created_before))
+        get_loaders(info.context).want_for_orders(orders)
+        return orders
     
     def resolve_order(self, info, id):
-        return Order.objects.get(pk=id)
+        return archive.get_order(id)
+    
+    def resolve_order_totals(self, info):
+        orders, cents = 0, 0
+        for model in (Order, ArchivedOrder):
+            totals = model.objects.order_by().aggregate(orders=Count('id'), cents=Sum(money.cents('total_amount')))
+            orders += totals['orders']
+            cents += totals['cents'] or 0
+        return OrderTotalsType(orders=orders, revenue=money.from_cents(cents))
+    
+    def resolve_order_events(self, info, order_id):
+        return OrderEvent.objects.filter(order_id=order_id).order_by('pk')
+    
+    def resolve_pending_order_reminders(self, info, since_days=7, status='pending', after_id=None, first=100):
+        # Date range on the (status, created_at) index, keyset paging on id
+        since = timezone.now() - timedelta(days=since_days)
+        first = max(1, min(first, 1000))
+        models = [Order, ArchivedOrder] if archive.needs_archive(since) else [Order]
+        
+        rows = []
+        for model in models:
+            orders = model.objects.filter(status=status, created_at__gte=since)
+            if after_id is not None:
+                orders = orders.filter(pk__gt=after_id)
+            # values() joins the customer's email without building model instances
+            rows += orders.order_by('pk').values(
+                'id', 'created_at', 'status', 'total_amount',
+                customer_email=F('customer__user__email'),
+            )[:first]
+        if len(models) == 1:
+            return rows
+        # Drop orders archived between the two queries, then merge by id
+        return sorted({row['id']: row for row in rows}.values(), key=lambda row: row['id'])[:first]
 
 # Mutations
 class CreateCustomer(graphene.Mutation):
@@ -102,20 +324,24 @@ class CreateProduct(graphene.Mutation):
     class Arguments:
         name = graphene.String(required=True)
         description = graphene.String()
-        price = graphene.Float(required=True)
+        price = Money(required=True)
         stock = graphene.Int(default_value=0)
+        # Stock below this is low; defaults to CRM_LOW_STOCK['threshold']
+        low_stock_threshold = graphene.Int()
 
     success = graphene.Boolean()
     product = graphene.Field(ProductType)
 
-    def mutate(self, info, name, description=None, price=0.0, stock=0):
+    def mutate(self, info, name, price, description=None, stock=0, low_stock_threshold=None):
         try:
             product = Product.objects.create(
                 name=name,
                 description=description,
                 price=price,
-                stock=stock
+                stock=stock,
+                low_stock_threshold=low_stock_threshold,
             )
+            low_stock.stock_changed({product.pk: None})
             return CreateProduct(success=True, product=product)
         except Exception as e:
             return CreateProduct(success=False, product=None)
@@ -131,15 +357,12 @@ class UpdateLowStockProducts(graphene.Mutation):
 
     def mutate(self, info, threshold=10, increment=10):
         try:
-            # Find products with stock below threshold
-            low_stock_products = Product.objects.filter(stock__lt=threshold)
-            
-            updated_products = []
-            for product in low_stock_products:
-                # Increment stock
-                product.stock += increment
-                product.save()
-                updated_products.append(product)
+            # Find products with stock below threshold and restock them with
+            # one UPDATE instead of a save() per product
+            ids = list(Product.objects.filter(stock__lt=threshold).values_list('pk', flat=True))
+            Product.objects.filter(pk__in=ids).update(stock=F('stock') + increment, updated_at=timezone.now())
+            low_stock.stock_changed(dict.fromkeys(ids, increment))
+            updated_products = list(Product.objects.filter(pk__in=ids))
             
             if updated_products:
                 message = f"Successfully updated {len(updated_products)} products with low stock"
@@ -163,21 +386,53 @@ class CreateOrder(graphene.Mutation):
         customer_id = graphene.ID(required=True)
         product_id = graphene.ID(required=True)
         quantity = graphene.Int(required=True)
+        # Retries with the same key return the first result instead of ordering again
+        idempotency_key = graphene.String()
 
     success = graphene.Boolean()
     order = graphene.Field(OrderType)
+    replayed = graphene.Boolean()
 
-    def mutate(self, info, customer_id, product_id, quantity):
+    def mutate(self, info, customer_id, product_id, quantity, idempotency_key=None):
         try:
-            customer = Customer.objects.get(pk=customer_id)
-            product = Product.objects.get(pk=product_id)
-            
-            # Calculate total amount
-            total_amount = product.price * quantity
-            
-            # Check if enough stock is available
-            if product.stock < quantity:
-                return CreateOrder(success=False, order=None)
+            return idempotency.run(
+                'createOrder',
+                idempotency_key,
+                {'customer_id': customer_id, 'product_id': product_id, 'quantity': quantity},
+                lambda: CreateOrder.place_order(customer_id, product_id, quantity),
+                dump=lambda result: {'success': result.success, 'order_id': result.order and result.order.pk},
+                load=lambda data: CreateOrder(
+                    success=data['success'],
+                    order=archive.get_order(data['order_id']) if data['order_id'] else None,
+                    replayed=True,
+                ),
+            )
+        except idempotency.IdempotencyError as e:
+            raise GraphQLError(str(e))
+        except Exception as e:
+            return CreateOrder(success=False, order=None)
+
+    @staticmethod
+    def place_order(customer_id, product_id, quantity):
+        customer = Customer.objects.get(pk=customer_id)
+        # Price and name come from the product cache, stock never does
+        product = get_product(product_id)
+        
+        # Calculate total amount
+        total_amount = product.price * quantity
+        
+        # No savepoint: a failure rolls back the enclosing mutation
+        # transaction, so stock is never taken without an order
+        with transaction.atomic(savepoint=False):
+            # Take the stock in one conditional UPDATE, so concurrent orders
+            # can neither oversell nor overwrite each other's decrement
+            reserved = Product.objects.filter(pk=product.pk, stock__gte=quantity).update(
+                stock=F('stock') - quantity,
+                updated_at=timezone.now(),
+            )
+            if not reserved:
+                return CreateOrder(success=False, order=None, replayed=False)
+            low_stock.stock_changed({product.pk: -quantity})
             
             # Create order
             order = Order.objects.create(
@@ -186,20 +441,102 @@ class CreateOrder(graphene.Mutation):
                 quantity=quantity,
                 total_amount=total_amount
             )
-            
-            # Update product stock
-            product.stock -= quantity
-            product.save()
-            
-            return CreateOrder(success=True, order=order)
-        except Exception as e:
-            return CreateOrder(success=False, order=None)
+        
+        return CreateOrder(success=True, order=order, replayed=False)
+
+class OrderFilterInput(graphene.InputObjectType):
+    """Orders to select in bulkUpdateOrderStatus; every given field must match"""
+    status = graphene.String()
+    customer_id = graphene.ID()
+    product_id = graphene.ID()
+    created_after = graphene.DateTime()
+    created_before = graphene.DateTime()
+
+class BulkUpdateOrderStatus(graphene.Mutation):
+    """Move the orders selected by ids or filter to another status (see crm/order_status.py)"""
+    class Arguments:
+        to = graphene.String(required=True)
+        ids = graphene.List(graphene.NonNull(graphene.ID))
+        filter = OrderFilterInput()
+
+    success = graphene.Boolean()
+    message = graphene.String()
+    updated = graphene.Int()
+    skipped = graphene.Int(description="Orders whose status can't move to the target")
+    missing = graphene.Int(description="Ids matching no order")
+    restored_units = graphene.Int(description="Units given back to stock by cancellations")
+
+    def mutate(self, info, to, ids=None, filter=None):
+        user = getattr(info.context, 'user', None)
+        try:
+            result = order_status.transition_orders(
+                to, ids=ids, filters=dict(filter) if filter else None,
+                actor_id=user.pk if user is not None and user.is_authenticated else None,
+            )
+        except order_status.TransitionError as e:
+            raise GraphQLError(str(e))
+        message = f"Moved {result['updated']} orders to {to}"
+        if result['skipped']:
+            message += f", skipped {result['skipped']} that can't move to {to}"
+        return BulkUpdateOrderStatus(success=True, message=message, **result)
 
 class Mutation(graphene.ObjectType):
     create_customer = CreateCustomer.Field()
     create_product = CreateProduct.Field()
     update_low_stock_products = UpdateLowStockProducts.Field()
     create_order = CreateOrder.Field()
+    bulk_update_order_status = BulkUpdateOrderStatus.Field()
 
 # Create the schema
 schema = graphene.Schema(query=Query, mutation=Mutation)
+
+# Introspection results by query text. The schema is fixed once built, so
+# every result stays valid for the life of the process.
+_introspection = {}
+
+# Distinct introspection queries cached per process
+INTROSPECTION_CACHE_SIZE = 16
+
+
+def is_introspection_query(query):
+    """
+    True when query is a single query operation selecting nothing but
+    introspection fields (__schema, __type, __typename) at the top level.
+    """
+    if query in _introspection:
+        return True
+    if '__schema' not in query and '__type' not in query:
+        # Regular queries skip the parse (__type also matches __typename)
+        return False
+    try:
+        # Shares the rate limiter's cache of parsed documents
+        document = parse_cached(query)
+    except GraphQLError:
+        return False
+    operations = [node for node in document.definitions if not isinstance(node, FragmentDefinitionNode)]
+    if len(operations) != 1 or not isinstance(operations[0], OperationDefinitionNode):
+        return False
+    operation = operations[0]
+    return operation.operation == OperationType.QUERY and not operation.variable_definitions and all(
+        isinstance(node, FieldNode) and node.name.value in ('__schema', '__type', '__typename')
+        for node in operation.selection_set.selections
+    )
+
+
+def get_introspection(query=None):
+    """
+    Result of an introspection query (default: graphql-core's standard
+    query, as used by schema.introspect()), computed once per process.
+    """
+    if query not in _introspection:
+        if query is None:
+            data = schema.introspect()
+        else:
+            result = schema.execute(query)
+            if result.errors:
+                raise result.errors[0]
+            data = result.data
+        if len(_introspection) >= INTROSPECTION_CACHE_SIZE:
+            _introspection.pop(next(iter(_introspection)))
+        _introspection[query] = data
+    return _introspection[query]
@@ -0,0 +1,139 @@
+"""
+CRM Search
+Ranked full-text search over products and customers, backed by the SQLite
+FTS5 tables created in migration 0004 (kept in sync by triggers).
+Other databases fall back to unranked icontains lookups.
+"""
+
+import html
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from crm.models import Customer, Product
+
+TYPES = ('product', 'customer')
+
+# Relative BM25 weight of each indexed column, in table column order
+WEIGHTS = {
+    'product': (10.0, 1.0),                # name, description
+    'customer': (10.0, 5.0, 2.0, 1.0),     # name, email, phone, address
+}
+
+# Markers FTS5 puts around matches; swapped for <mark> after HTML escaping
+_OPEN, _CLOSE = '\ue000', '\ue001'
+
+_WORD = re.compile(r'\w+')
+
+
+def to_match_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match, the last one
+    as a prefix so results show up while typing. FTS5 syntax in the input
+    is treated as plain text.
+    """
+    words = _WORD.findall(text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def mark(text):
+    """HTML-escape an FTS5 highlight and wrap matches in <mark>."""
+    return html.escape(text or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def fts_search(kind, match, first):
+    """Return [(id, score, highlight, snippet)] from one FTS5 table, best first."""
+    table = f'crm_{kind}_search'
+    weights = ', '.join(str(weight) for weight in WEIGHTS[kind])
+    sql = (
+        f"SELECT rowid, -bm25({table}, {weights}) AS score, "
+        f"highlight({table}, 0, %s, %s), "
+        f"snippet({table}, -1, %s, %s, '…', 12) "
+        f"FROM {table} WHERE {table} MATCH %s "
+        f"ORDER BY bm25({table}, {weights}) LIMIT %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [_OPEN, _CLOSE, _OPEN, _CLOSE, match, first])
+        return cursor.fetchall()
+
+
+def fallback_search(kind, text, first):
+    """Unranked icontains lookup with the same result shape as fts_search()."""
+    if kind == 'product':
+        fields = ['name', 'description']
+        queryset = Product.objects.all()
+    else:
+        fields = ['user__first_name', 'user__last_name', 'user__username', 'user__email', 'phone', 'address']
+        queryset = Customer.objects.all()
+
+    for word in _WORD.findall(text):
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f'{field}__icontains': word})
+        queryset = queryset.filter(condition)
+    return [(pk, 0.0, None, None) for pk in queryset.order_by('pk').values_list('pk', flat=True)[:first]]
+
+
+def search(text, types=None, first=20):
+    """
+    Search products and/or customers for `text`. Returns up to `first`
+    dicts {'type', 'id', 'score', 'highlight', 'snippet', 'object'},
+    best match first. highlight is the marked-up name, snippet the best
+    matching excerpt of any column, both HTML-escaped.
+    """
+    types = [kind for kind in TYPES if kind in (types or TYPES)]
+    first = max(1, min(first, 100))
+    use_fts = connection.vendor == 'sqlite'
+    match = to_match_query(text)
+    if match is None:
+        return []
+
+    rows = []
+    for kind in types:
+        hits = fts_search(kind, match, first) if use_fts else fallback_search(kind, text, first)
+        rows += [(kind, pk, score, highlight, snippet) for pk, score, highlight, snippet in hits]
+    # Scores of both tables are BM25 values on the same query, close enough to merge
+    rows.sort(key=lambda row: row[2], reverse=True)
+    rows = rows[:first]
+
+    # One query per type for the matched objects
+    models = {'product': Product.objects, 'customer': Customer.objects.select_related('user')}
+    objects = {
+        kind: models[kind].in_bulk([row[1] for row in rows if row[0] == kind])
+        for kind in types
+    }
+    return [
+        {
+            'type': kind,
+            'id': pk,
+            'score': round(score, 4),
+            'highlight': mark(highlight) if highlight is not None else None,
+            'snippet': mark(snippet) if snippet is not None else None,
+            'object': objects[kind].get(pk),
+        }
+        for kind, pk, score, highlight, snippet in rows
+        # Skip rows whose object was deleted since the index was read
+        if pk in objects[kind]
+    ]
+
+
+def rebuild():
+    """Rebuild both FTS5 indexes from the CRM tables."""
+    if connection.vendor != 'sqlite':
+        return
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("INSERT INTO crm_product_search(crm_product_search) VALUES ('rebuild')")
+        cursor.execute("DELETE FROM crm_customer_search")
+        cursor.execute(
+            "INSERT INTO crm_customer_search(rowid, name, email, phone, address) "
+            "SELECT c.id, trim(u.first_name || ' ' || u.last_name || ' ' || u.username), "
+            "u.email, coalesce(c.phone, ''), coalesce(c.address, '') "
+            "FROM crm_customer c JOIN auth_user u ON u.id = c.user_id"
+        )
+        cursor.execute("INSERT INTO crm_product_search(crm_product_search) VALUES ('optimize')")
+        cursor.execute("INSERT INTO crm_customer_search(crm_customer_search) VALUES ('optimize')")
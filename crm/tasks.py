@@ -1,12 +1,67 @@
+import functools
 import os
-import sys
+import runpy
 from datetime import datetime
-from celery import shared_task
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
-import requests
+from decimal import Decimal
+from celery import chord, shared_task
+from crm import batching, cron, graphql_client, idempotency, locks, low_stock, reports, rfm
+from crm.archive import archive_orders
+from crm.joblog import job_run
+
+REMINDERS_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cron_jobs', 'send_order_reminders.py')
+
+def exclusive(func):
+    """
+    Skip a periodic task while a previous run still holds the job's lock,
+    returning 'skipped' (see crm/locks.py). Runs are recorded per job.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        status, result = locks.run_exclusive(func.__name__, func, *args, **kwargs)
+        return status if status == 'skipped' else result
+    return wrapper
+
+@shared_task
+@exclusive
+def log_crm_heartbeat():
+    """Celery beat entry of crm.cron.log_crm_heartbeat."""
+    cron.log_crm_heartbeat()
+
+@shared_task
+@exclusive
+def update_low_stock():
+    """
+    Reconciliation pass of the low-stock set (crm/low_stock.py). Products
+    are handled as their stock crosses the threshold; this catches the rest.
+    """
+    return low_stock.reconcile()
+
+@shared_task
+@exclusive
+def refresh_rfm_scores():
+    """Score the customers whose orders changed since the last run (crm/rfm.py)."""
+    return rfm.refresh()
+
+@shared_task
+@exclusive
+def rescore_rfm():
+    """Recompute the RFM quintile boundaries and rescore every customer."""
+    return rfm.rescore()
 
 @shared_task
+@exclusive
+def send_order_reminders():
+    """Celery beat entry of crm/cron_jobs/send_order_reminders.py."""
+    runpy.run_path(REMINDERS_SCRIPT, run_name='crm_order_reminders')['main']()
+
+@shared_task
+@exclusive
+def clean_inactive_customers():
+    """Celery beat entry of crm.cron.clean_inactive_customers."""
+    cron.clean_inactive_customers()
+
+@shared_task
+@exclusive
 def generate_crm_report():
     """
     Generate CRM report with total customers, orders, and revenue.
@@ -16,85 +71,124 @@ def generate_crm_report():
     # Get current timestamp
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
-    # Log file path
-    log_file = '/tmp/crm_report_log.txt'
-    
-    try:
-        # GraphQL endpoint
-        graphql_endpoint = "http://localhost:8000/graphql"
-        
-        # Create GraphQL client
-        transport = RequestsHTTPTransport(url=graphql_endpoint)
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-        
+    with job_run('generate_crm_report') as run:
         # Query 1: Get total number of customers
-        customers_query = gql("""
+        customers_query = """
             query {
                 allCustomers {
                     id
                 }
             }
-        """)
+        """
         
-        # Query 2: Get total number of orders and revenue
-        orders_query = gql("""
+        # Query 2: Get total number of orders and revenue, summed by the database
+        orders_query = """
             query {
-                allOrders {
-                    id
-                    totalAmount
+                orderTotals {
+                    orders
+                    revenue
                 }
             }
-        """)
+        """
         
-        # Execute queries
-        customers_result = client.execute(customers_query)
-        orders_result = client.execute(orders_query)
+        # Execute both queries in one batched request (gql is imported on first use, see crm/graphql_client.py)
+        customers_result, orders_result = graphql_client.execute_batch([customers_query, orders_query])
         
         # Extract data
         total_customers = len(customers_result.get('allCustomers', []))
-        orders = orders_result.get('allOrders', [])
-        total_orders = len(orders)
+        totals = orders_result.get('orderTotals') or {}
+        total_orders = totals.get('orders') or 0
         
-        # Calculate total revenue
-        total_revenue = sum(
-            float(order.get('totalAmount', 0)) 
-            for order in orders 
-            if order.get('totalAmount') is not None
-        )
+        # Revenue is an exact Money string ("1234.50"), kept as a Decimal
+        total_revenue = Decimal(totals.get('revenue') or '0.00')
         
         # Format revenue to 2 decimal places
         formatted_revenue = f"${total_revenue:.2f}"
         
-        # Create report message
-        report_message = f"{timestamp} - Report: {total_customers} customers, {total_orders} orders, {formatted_revenue} revenue"
-        
-        # Log the report
-        try:
-            with open(log_file, 'a') as f:
-                f.write(report_message + '\n')
-        except Exception as log_error:
-            print(f"Error writing to log file: {log_error}", file=sys.stderr)
+        # Log the report (errors are logged by job_run and re-raised so Celery knows the task failed)
+        run.count('customers', total_customers)
+        run.count('orders', total_orders)
+        run.info(
+            f"Report: {total_customers} customers, {total_orders} orders, {formatted_revenue} revenue",
+            revenue=str(total_revenue),
+        )
         
         # Return the report data for potential use
         return {
             'timestamp': timestamp,
             'total_customers': total_customers,
             'total_orders': total_orders,
-            'total_revenue': total_revenue,
+            'total_revenue': str(total_revenue),
             'formatted_revenue': formatted_revenue
         }
+
+@shared_task
+@exclusive
+def archive_old_orders():
+    """
+    Move orders older than CRM_ORDER_ARCHIVE['age_days'] into the archive
+    table in batches, keeping the hot Order table small.
+    """
+    with job_run('archive_old_orders') as run:
+        def log(batch, moved):
+            run.count('orders', moved)
+            run.info(f"Archived batch {batch}: {moved} orders", batch=batch, moved=moved)
         
-    except Exception as e:
-        error_message = f"{timestamp} - Error generating CRM report: {str(e)}"
-        
-        # Log error
-        try:
-            with open(log_file, 'a') as f:
-                f.write(error_message + '\n')
-        except:
-            print(f"Error writing to log file: {e}", file=sys.stderr)
-        
-        print(f"Error generating CRM report: {str(e)}", file=sys.stderr)
+        total = archive_orders(log=log)
+        return {'archived': total}
+
+@shared_task
+@exclusive
+def prune_idempotency_keys():
+    """Delete idempotency keys older than CRM_IDEMPOTENCY['ttl'] in batches."""
+    with job_run('prune_idempotency_keys') as run:
+        def log(deleted):
+            run.count('keys', deleted)
         
-        # Re-raise the exception so Celery knows the task failed
-        raise
+        return {'deleted': idempotency.prune_expired(log=log)}
+
+@shared_task
+def aggregate_report_shard(low, high, start, end):
+    """Partial weekly report aggregates of one order id range."""
+    return reports.aggregate_shard(low, high, start, end)
+
+@shared_task
+def merge_weekly_report(partials, start, end):
+    """
+    Chord callback of generate_weekly_report: merge the shard partials and
+    write the report file.
+    """
+    with job_run('generate_weekly_report') as run:
+        start, end = datetime.fromisoformat(start), datetime.fromisoformat(end)
+        report = reports.finalize(reports.merge(partials), start, end)
+        path = reports.write_report(report)
+        run.count('orders', report['totals']['orders'])
+        run.info(f"Weekly report {report['week']} written to {path}", shards=len(partials))
+        return path
+
+@shared_task
+@exclusive
+def generate_weekly_report(day=None):
+    """
+    Build the weekly report for the week containing `day` (ISO date, default:
+    last full week) as a chord: one aggregate_report_shard task per order id
+    range, merged by merge_weekly_report. Shards run on whichever workers are free.
+    """
+    with job_run('generate_weekly_report') as run:
+        start, end = reports.week_bounds(datetime.fromisoformat(day).date() if day else None)
+        ranges = reports.shard_ranges(reports.get_config()['shards'])
+        run.count('shards', len(ranges))
+        header = [
+            aggregate_report_shard.s(low, high, start.isoformat(), end.isoformat())
+            for low, high in ranges
+        ]
+        if not header:
+            # A chord needs at least one task; report on an empty table directly
+            return merge_weekly_report([], start.isoformat(), end.isoformat())
+        result = chord(header)(merge_weekly_report.s(start.isoformat(), end.isoformat()))
+        return result.id
+
+@shared_task(ignore_result=True, autoretry_for=(Exception,), retry_backoff=True, max_retries=5)
+def flush_batch(name):
+    """Hand the events buffered by a crm.batching.Batch to its handler in one execution."""
+    return batching.get_batch(name).flush()
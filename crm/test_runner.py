@@ -0,0 +1,22 @@
+"""
+CRM Test Runner
+Django's test runner with a process-local cache, the way Django itself
+swaps in the locmem email backend: the suite needs no Redis and leaves no
+keys in the configured cache.
+"""
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._caches = override_settings(CACHES=LOCMEM_CACHES)
+        self._caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._caches.disable()
+        super().teardown_test_environment(**kwargs)
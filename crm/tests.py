@@ -1,3 +1,1381 @@
-from django.test import TestCase
+import gzip
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql import get_introspection_query, print_ast
+
+from crm import analytics, archive, batching, cron, encoders, graphql_client, health, idempotency, joblog, locks, low_stock, money, order_status, product_cache, ratelimit, reports, rfm, routers, tasks, views
+from crm.benchmarks import datasets
+from crm.benchmarks import regression, startup_suite
+from crm.benchmarks.schema_suite import run_suite
+from crm.db.backends.sqlite3.base import DatabaseWrapper
+from crm.models import ArchivedOrder, Customer, CustomerRFM, IdempotencyKey, LowStockProduct, Order, OrderEvent, Product
+from crm.schema import schema
+
+
+class SchemaBenchmarkRegressionTest(TransactionTestCase):
+    """
+    Runs the crm.schema benchmark suite at the smallest scale.
+    Only query counts are compared here since they are deterministic;
+    `manage.py benchmark_schema` also checks latency and memory. Not in a
+    TestCase transaction, so mutations pay for their own BEGIN as they do
+    in the command.
+    """
+
+    def test_query_counts_do_not_regress(self):
+        baseline = regression.load_baseline('schema')
+        self.assertTrue(baseline, "No schema benchmark baseline stored")
+
+        results = run_suite(['small'], repeat=1)
+
+        regressions = regression.compare(baseline, results, metrics=['queries'])
+        self.assertEqual(regressions, [], '\n'.join(regressions))
+
+
+@override_settings(CRM_READ_REPLICAS=['replica_a', 'replica_b'])
+class ReplicaRouterTest(SimpleTestCase):
+    """Routing decisions of crm.routers.ReplicaRouter, without real replicas."""
+
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.tokens = routers.start_request()
+
+    def tearDown(self):
+        routers.end_request(self.tokens)
+
+    def test_reads_rotate_over_replicas(self):
+        reads = {self.router.db_for_read(None) for _ in range(4)}
+        self.assertEqual(reads, {'replica_a', 'replica_b'})
+
+    def test_reads_follow_writes_to_primary(self):
+        self.assertEqual(self.router.db_for_write(None), routers.PRIMARY)
+        self.assertEqual(self.router.db_for_read(None), routers.PRIMARY)
+        self.assertFalse(routers.end_request(routers.start_request()))
+
+    def test_pinned_and_primary_block_read_primary(self):
+        with routers.primary():
+            self.assertEqual(self.router.db_for_read(None), routers.PRIMARY)
+        self.assertIn(self.router.db_for_read(None), routers.get_replicas())
+
+        routers.end_request(self.tokens)
+        self.tokens = routers.start_request(pinned=True)
+        self.assertEqual(self.router.db_for_read(None), routers.PRIMARY)
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica_a', 'crm'))
+        self.assertTrue(self.router.allow_migrate(routers.PRIMARY, 'crm'))
+
+
+class SQLiteBackendTest(SimpleTestCase):
+    """The SQLite backend applies its pragmas to new connections and begins atomic blocks IMMEDIATE."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='crm_sqlite_test_')
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = f'{directory}/tuned.sqlite3'
+        # A file database: in-memory test databases can't use WAL
+        self.wrapper = DatabaseWrapper({**connection.settings_dict, 'NAME': self.path}, alias='sqlite_test')
+        self.addCleanup(self.wrapper.close)
+
+    def pragma(self, name):
+        with self.wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('cache_size'), -65536)
+
+    def test_atomic_blocks_begin_immediate(self):
+        self.wrapper.ensure_connection()
+        with CaptureQueriesContext(self.wrapper) as queries:
+            # What atomic() does on entering the outermost block
+            self.wrapper.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        self.assertEqual([query['sql'] for query in queries], ['BEGIN IMMEDIATE'])
+
+        # The write lock is held before anything is written
+        other = sqlite3.connect(self.path, timeout=0)
+        self.addCleanup(other.close)
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            other.execute('BEGIN IMMEDIATE')
+        self.wrapper.rollback()
+        self.wrapper.set_autocommit(True)
+
+    def test_invalid_options_are_rejected(self):
+        for options in ({'transaction_mode': 'LAZY'}, {'pragmas': {'journal_mode': 'wal; DROP TABLE crm_order'}}):
+            with self.assertRaises(ImproperlyConfigured):
+                DatabaseWrapper({**connection.settings_dict, 'OPTIONS': options}, alias='sqlite_test')
+
+
+class OrderArchiveTest(TestCase):
+    """crm.archive moves old orders out of Order and the resolvers still find them."""
+
+    def setUp(self):
+        user = User.objects.create_user('archive_test', 'archive@example.com')
+        customer = Customer.objects.create(user=user)
+        product = Product.objects.create(name='Widget', price=Decimal('5.00'), stock=10)
+        self.old, self.new = [
+            Order.objects.create(customer=customer, product=product, total_amount=Decimal('5.00'))
+            for _ in range(2)
+        ]
+        Order.objects.filter(pk=self.old.pk).update(created_at=timezone.now() - timedelta(days=400))
+
+    def execute(self, query, **variables):
+        result = schema.execute(query, variable_values=variables)
+        self.assertIsNone(result.errors)
+        return result.data
+
+    def test_old_orders_are_moved_in_batches(self):
+        self.assertEqual(archive.archive_orders(batch_size=1), 1)
+        self.assertEqual(list(Order.objects.values_list('pk', flat=True)), [self.new.pk])
+        self.assertEqual(list(ArchivedOrder.objects.values_list('pk', flat=True)), [self.old.pk])
+
+    def test_resolvers_read_archive_only_when_needed(self):
+        archive.archive_orders()
+        query = 'query($after: DateTime) { allOrders(createdAfter: $after) { id } }'
+
+        with self.assertNumQueries(2):
+            data = self.execute(query)
+        self.assertEqual([o['id'] for o in data['allOrders']], [str(self.new.pk), str(self.old.pk)])
+
+        recent = (timezone.now() - timedelta(days=30)).isoformat()
+        with self.assertNumQueries(1):
+            data = self.execute(query, after=recent)
+        self.assertEqual([o['id'] for o in data['allOrders']], [str(self.new.pk)])
+
+        data = self.execute('query($id: ID!) { order(id: $id) { id status } }', id=self.old.pk)
+        self.assertEqual(data['order'], {'id': str(self.old.pk), 'status': 'PENDING'})
+
+    def test_naive_created_after(self):
+        archive.archive_orders()
+        data = self.execute('{ allOrders(createdAfter: "2020-01-01T00:00:00") { id } }')
+        self.assertEqual([o['id'] for o in data['allOrders']], [str(self.new.pk), str(self.old.pk)])
+
+    def test_nested_orders_include_the_archive(self):
+        archive.archive_orders()
+        expected = [{'orders': [{'id': str(self.new.pk)}, {'id': str(self.old.pk)}]}]
+
+        # Customers, then their hot and archived orders
+        with self.assertNumQueries(3):
+            data = self.execute('{ allCustomers { orders { id } } }')
+        self.assertEqual(data['allCustomers'], expected)
+        self.assertEqual(self.execute('{ allProducts { orders { id } } }')['allProducts'], expected)
+
+
+def load_reminders_script():
+    """crm/cron_jobs/send_order_reminders.py as a module, so its settings can be patched."""
+    spec = importlib.util.spec_from_file_location('crm_order_reminders', tasks.REMINDERS_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class OrderRemindersTest(TestCase):
+    """pendingOrderReminders pages by id, and the script dispatches every page and advances its watermark."""
+
+    query = """query($first: Int, $after: ID, $status: String) {
+        pendingOrderReminders(first: $first, afterId: $after, status: $status) { id customerEmail status totalAmount }
+    }"""
+
+    def setUp(self):
+        user = User.objects.create_user(username='reminders_test', email='remind@example.com')
+        self.customer = Customer.objects.create(user=user)
+        self.product = Product.objects.create(name='Cup', price=Decimal('3.00'), stock=100)
+        self.pending = [self.order() for _ in range(3)]
+        self.shipped = self.order(status='shipped')
+        old = self.order()
+        Order.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=10))
+        # Five days old: archived with a 3-day archive age, still within the 7 days
+        self.archived = self.order()
+        Order.objects.filter(pk=self.archived.pk).update(created_at=timezone.now() - timedelta(days=5))
+        with override_settings(CRM_ORDER_ARCHIVE={'age_days': 3}):
+            archive.archive_orders()
+
+        directory = tempfile.mkdtemp(prefix='crm_reminders_test_')
+        self.addCleanup(shutil.rmtree, directory)
+        self.script = load_reminders_script()
+        self.script.WATERMARK_FILE = f'{directory}/watermark.txt'
+
+    def order(self, status='pending'):
+        return Order.objects.create(
+            customer=self.customer, product=self.product, total_amount=Decimal('3.00'), status=status,
+        )
+
+    def reminders(self, **variables):
+        result = schema.execute(self.query, variable_values=variables)
+        self.assertIsNone(result.errors)
+        return [row['id'] for row in result.data['pendingOrderReminders']]
+
+    def test_pages_by_id_with_the_archive(self):
+        expected = sorted(order.pk for order in self.pending + [self.archived])
+        with override_settings(CRM_ORDER_ARCHIVE={'age_days': 3}):
+            first = self.reminders(first=2)
+            rest = self.reminders(first=2, after=first[-1])
+            shipped = self.reminders(status='shipped')
+            self.assertEqual(len(self.reminders(first=0)), 1)
+        self.assertEqual([int(pk) for pk in first + rest], expected)
+        self.assertEqual(shipped, [str(self.shipped.pk)])
+
+    def test_first_is_clamped(self):
+        Order.objects.bulk_create([
+            Order(customer=self.customer, product=self.product, total_amount=Decimal('1.00')) for _ in range(1000)
+        ])
+        self.assertEqual(len(self.reminders(first=5000)), 1000)
+
+    def test_script_dispatches_pages_and_advances_the_watermark(self):
+        # gql() returns a GraphQLRequest since gql 4, a DocumentNode before
+        query = print_ast(getattr(self.script.REMINDERS_QUERY, 'document', self.script.REMINDERS_QUERY))
+
+        class Client:
+            def execute(client, document, variable_values):
+                return schema.execute(query, variable_values=variable_values).data
+
+        run = mock.Mock()
+        self.script.PAGE_SIZE = 2
+        with override_settings(CRM_ORDER_ARCHIVE={'age_days': 3}), ThreadPoolExecutor(2) as executor:
+            pages = self.script.fetch_pages(Client(), None)
+            self.script.dispatch(run, self.script.FileSender(run), pages, executor, threading.BoundedSemaphore(2))
+
+        sent = [call.kwargs['order_id'] for call in run.info.call_args_list]
+        self.assertEqual(sorted(int(pk) for pk in sent), sorted(order.pk for order in self.pending + [self.archived]))
+        self.assertEqual(self.script.read_watermark(), str(max(order.pk for order in self.pending + [self.archived])))
+
+        # Nothing newer than the watermark: nothing to send
+        run.reset_mock()
+        with override_settings(CRM_ORDER_ARCHIVE={'age_days': 3}), ThreadPoolExecutor(2) as executor:
+            pages = self.script.fetch_pages(Client(), self.script.read_watermark())
+            self.script.dispatch(run, self.script.FileSender(run), pages, executor, threading.BoundedSemaphore(2))
+        run.info.assert_not_called()
+
+    def test_dispatch_bounds_concurrency_and_keeps_the_watermark_on_failure(self):
+        self.script.BATCH_SIZE = 2
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        class Sender:
+            def send_batch(sender, orders):
+                with lock:
+                    in_flight.append(1)
+                    peak.append(len(in_flight))
+                time.sleep(0.01)
+                with lock:
+                    in_flight.pop()
+                if orders[0]['id'] == '11':
+                    raise ConnectionError("SMTP server went away")
+
+        pages = [[{'id': str(n)} for n in range(1, 11)], [{'id': str(n)} for n in range(11, 13)]]
+        with ThreadPoolExecutor(8) as executor, self.assertRaises(ConnectionError):
+            self.script.dispatch(mock.Mock(), Sender(), iter(pages), executor, threading.BoundedSemaphore(2))
+        self.assertLessEqual(max(peak), 2)
+        self.assertEqual(self.script.read_watermark(), '10')
+
+    def test_job_runs_through_the_rate_limited_endpoint(self):
+        from gql.transport.requests import RequestsHTTPTransport
+        from graphql import ExecutionResult
+
+        def post(transport, request, variable_values=None, *args, **kwargs):
+            # The HTTP round trip, through the test client and its middleware
+            if hasattr(request, 'payload'):
+                payload = request.payload
+            else:
+                payload = {'query': print_ast(request), 'variables': variable_values}
+            body = self.client.post('/graphql', payload, content_type='application/json').json()
+            return ExecutionResult(data=body.get('data'), errors=body.get('errors'))
+
+        ratelimit.reset()
+        self.addCleanup(ratelimit.reset)
+        with mock.patch.object(RequestsHTTPTransport, 'execute', autospec=True, side_effect=post):
+            # Exits with 1 when a page is refused
+            self.script.main()
+        self.assertEqual(self.script.read_watermark(), str(max(order.pk for order in self.pending)))
+
+    def test_rate_limited_pages_are_retried(self):
+        from gql.transport.exceptions import TransportQueryError
+
+        refused = TransportQueryError("Rate limit exceeded", errors=[
+            {'message': "Rate limit exceeded", 'extensions': {'code': 'RATE_LIMITED', 'retryAfter': 3}},
+        ])
+        client = mock.Mock()
+        client.execute.side_effect = [refused, {'pendingOrderReminders': [{'id': '1'}]}]
+        with mock.patch.object(self.script.time, 'sleep') as sleep:
+            self.assertEqual(list(self.script.fetch_pages(client, None)), [[{'id': '1'}]])
+        sleep.assert_called_once_with(3)
+
+        client.execute.side_effect = TransportQueryError("Unknown field", errors=[{'message': "Unknown field"}])
+        with self.assertRaises(TransportQueryError):
+            list(self.script.fetch_pages(client, None))
+
+    def test_smtp_sender_skips_orders_without_email(self):
+        orders = [{'id': '1', 'customerEmail': 'a@example.com'}, {'id': '2', 'customerEmail': None}]
+        with mock.patch('smtplib.SMTP') as smtp:
+            self.script.SMTPSender(mock.Mock(), host='mail', port=25).send_batch(orders)
+        smtp.assert_called_once_with('mail', 25, timeout=30)
+        message = smtp.return_value.__enter__.return_value.send_message.call_args.args[0]
+        self.assertEqual(message['To'], 'a@example.com')
+        self.assertEqual(smtp.return_value.__enter__.return_value.send_message.call_count, 1)
+
+
+class SearchTest(TestCase):
+    """The search query ranks FTS5 matches and follows edits through the triggers."""
+
+    query = '''
+        query($q: String!, $types: [String]) {
+            search(query: $q, types: $types) { type id highlight snippet product { name } customer { id } }
+        }
+    '''
+
+    def setUp(self):
+        self.lamp = Product.objects.create(name='Desk Lamp', description='A bright lamp', price=Decimal('20.00'))
+        self.cable = Product.objects.create(name='Cable', description='Fits any <desk> lamp', price=Decimal('2.00'))
+        user = User.objects.create_user('jlamp', 'jane@lamp.example', first_name='Jane', last_name='Lamp')
+        self.customer = Customer.objects.create(user=user, address='1 Main Street')
+
+    def search(self, q, types=None):
+        result = schema.execute(self.query, variable_values={'q': q, 'types': types})
+        self.assertIsNone(result.errors)
+        return result.data['search']
+
+    def test_ranked_results_with_highlights(self):
+        hits = self.search('lam', types=['product'])
+        self.assertEqual([hit['id'] for hit in hits], [str(self.lamp.pk), str(self.cable.pk)])
+        self.assertEqual(hits[0]['highlight'], 'Desk <mark>Lamp</mark>')
+        self.assertEqual(hits[1]['snippet'], 'Fits any &lt;desk&gt; <mark>lamp</mark>')
+        self.assertEqual(hits[0]['product'], {'name': 'Desk Lamp'})
+
+        hits = self.search('jane lamp')
+        self.assertEqual([(hit['type'], hit['id']) for hit in hits], [('customer', str(self.customer.pk))])
+
+    def test_index_follows_updates_and_deletes(self):
+        Product.objects.filter(pk=self.lamp.pk).update(name='Floor Light')
+        self.customer.user.email = 'jane@light.example'
+        self.customer.user.save()
+        self.cable.delete()
+
+        self.assertEqual(self.search('desk', types=['product']), [])
+        hits = self.search('light')
+        self.assertEqual({(hit['type'], hit['id']) for hit in hits},
+                         {('product', str(self.lamp.pk)), ('customer', str(self.customer.pk))})
+
+
+class ProductCacheTest(TestCase):
+    """crm.product_cache serves snapshots, never caches stock and drops saved products."""
+
+    def setUp(self):
+        product_cache.products.clear()
+        self.product = Product.objects.create(name='Kettle', price=Decimal('30.00'), stock=5)
+
+    def test_hits_skip_the_database_except_for_stock(self):
+        product_cache.get_product(self.product.pk)
+        Product.objects.filter(pk=self.product.pk).update(stock=2)
+
+        with self.assertNumQueries(0):
+            cached = product_cache.get_product(self.product.pk)
+            self.assertEqual(cached.name, 'Kettle')
+        with self.assertNumQueries(1):
+            self.assertEqual(cached.stock, 2)
+
+    def test_save_invalidates_snapshot(self):
+        product_cache.get_product(self.product.pk)
+        self.product.price = Decimal('35.00')
+        self.product.save()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(product_cache.get_product(self.product.pk).price, Decimal('35.00'))
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:1/0',
+    }})
+    def test_unreachable_cache_falls_back_to_the_database(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(product_cache.get_product(self.product.pk).name, 'Kettle')
+        self.product.price = Decimal('35.00')
+        self.product.save()
+
+        result = schema.execute(f'{{ product(id: {self.product.pk}) {{ price }} }}')
+        self.assertIsNone(result.errors)
+        self.assertEqual(Decimal(result.data['product']['price']), Decimal('35.00'))
+
+        customer = Customer.objects.create(user=User.objects.create_user(username='cacheless', email='c@example.com'))
+        result = schema.execute(
+            'mutation($c: ID!, $p: ID!) { createOrder(customerId: $c, productId: $p, quantity: 1) { success } }',
+            variable_values={'c': customer.pk, 'p': self.product.pk},
+        )
+        self.assertTrue(result.data['createOrder']['success'])
+
+
+class IdempotencyKeyTest(TestCase):
+    """createOrder with an idempotency key places one order however often it is retried."""
+
+    MUTATION = """
+        mutation CreateOrder($customerId: ID!, $productId: ID!, $quantity: Int!, $key: String) {
+            createOrder(customerId: $customerId, productId: $productId, quantity: $quantity, idempotencyKey: $key) {
+                success
+                replayed
+                order { id }
+            }
+        }
+    """
+
+    def setUp(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.customer = Customer.objects.create(user=user)
+        self.product = Product.objects.create(name='Kettle', price=Decimal('30.00'), stock=5)
+
+    def create_order(self, key, quantity=2):
+        variables = {'customerId': self.customer.pk, 'productId': self.product.pk, 'quantity': quantity, 'key': key}
+        return schema.execute(self.MUTATION, variable_values=variables)
+
+    def test_retry_replays_first_result(self):
+        first = self.create_order('retry-1').data['createOrder']
+        retry = self.create_order('retry-1').data['createOrder']
+
+        self.assertEqual((first['success'], first['replayed']), (True, False))
+        self.assertEqual((retry['success'], retry['replayed']), (True, True))
+        self.assertEqual(retry['order']['id'], first['order']['id'])
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+
+    def test_key_reused_with_other_arguments(self):
+        self.create_order('retry-2')
+        result = self.create_order('retry-2', quantity=1)
+
+        self.assertIn('different arguments', result.errors[0].message)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_expired_keys_execute_again_and_are_pruned(self):
+        self.create_order('retry-3')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertFalse(self.create_order('retry-3').data['createOrder']['replayed'])
+        self.assertEqual(Order.objects.count(), 2)
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(idempotency.prune_expired(), 1)
+
+
+class StartupTest(TestCase):
+    """Short-lived processes don't import what they don't use; introspection is cached."""
+
+    def test_job_modules_defer_heavy_imports(self):
+        # Fails with the offending modules in the RuntimeError
+        startup_suite.run_python(startup_suite.SETUP + (
+            "import sys, crm.cron, crm.tasks, crm.schema; "
+            "loaded = [name for name in ('gql', 'requests', 'numpy') if name in sys.modules]; "
+            "assert not loaded, loaded"
+        ))
+
+    def test_introspection_served_from_cache(self):
+        query = get_introspection_query()
+        expected = schema.introspect()
+        first = self.client.post('/graphql', {'query': query}, content_type='application/json')
+        with mock.patch.object(schema, 'execute', side_effect=AssertionError("schema executed")):
+            second = self.client.post('/graphql', {'query': query}, content_type='application/json')
+
+        self.assertEqual(first.json()['data'], expected)
+        self.assertEqual(second.json()['data'], expected)
+
+    def test_regular_queries_are_not_parsed_for_introspection(self):
+        from crm import schema as crm_schema
+
+        with mock.patch.object(crm_schema, 'parse_cached', wraps=crm_schema.parse_cached) as parse_cached:
+            self.assertFalse(crm_schema.is_introspection_query('{ allProducts { name } }'))
+            parse_cached.assert_not_called()
+            self.assertTrue(crm_schema.is_introspection_query('{ __type(name: "Query") { name } }'))
+            self.assertFalse(crm_schema.is_introspection_query('{ __typename allProducts { name } }'))
+
+
+@skipUnless(analytics.HAS_NUMPY, "NumPy is not installed")
+class AnalyticsSnapshotTest(TestCase):
+    """The NumPy snapshot answers like the database and follows changes incrementally."""
+
+    def setUp(self):
+        datasets.seed('small')
+        # Half of the seeded history is older than the archive age
+        archive.archive_orders()
+        self.snapshot = analytics.OrderSnapshot()
+        self.snapshot.refresh()
+
+    def test_matches_database_aggregation(self):
+        for group_by in analytics.GROUP_BY:
+            self.assertEqual(
+                sorted(self.snapshot.revenue(group_by)),
+                sorted(analytics.database_revenue(group_by)),
+                group_by,
+            )
+        since = timezone.now() - timedelta(days=90)
+        self.assertEqual(
+            self.snapshot.revenue('product', since=since, statuses=['pending', 'shipped'], top=3),
+            analytics.database_revenue('product', since=since, statuses=['pending', 'shipped'], top=3),
+        )
+
+    def test_incremental_refresh(self):
+        order = Order.objects.order_by('-pk').first()
+        order.status = 'cancelled'
+        order.save()
+        Order.objects.create(
+            customer=order.customer, product=order.product, quantity=3, total_amount=Decimal('7.50'),
+        )
+
+        with self.assertNumQueries(4):
+            self.snapshot.refresh(force=True)
+        self.assertEqual(
+            sorted(self.snapshot.revenue('status')),
+            sorted(analytics.database_revenue('status')),
+        )
+
+
+class WeeklyReportTest(TestCase):
+    """Merged shard partials give the same report as a single pass."""
+
+    def setUp(self):
+        datasets.seed('small')
+        archive.archive_orders()
+        # A few orders inside last week, on top of the seeded history
+        self.start, self.end = reports.week_bounds()
+        order = Order.objects.order_by('pk').first()
+        for days in (0, 2, 5):
+            created = Order.objects.create(
+                customer=order.customer, product=order.product, quantity=2, total_amount=Decimal('19.99'),
+            )
+            Order.objects.filter(pk=created.pk).update(created_at=self.start + timedelta(days=days))
+
+    def test_shards_match_single_pass(self):
+        single = reports.build_weekly_report(shards=1)
+        self.assertEqual(reports.build_weekly_report(shards=7), single)
+
+        week = Order.objects.filter(created_at__gte=self.start, created_at__lt=self.end)
+        self.assertEqual(single['totals']['orders'], week.count())
+        self.assertEqual(
+            Decimal(single['totals']['revenue']),
+            sum((order.total_amount for order in week), Decimal('0')),
+        )
+        self.assertEqual(single['funnel'][0]['orders'], single['totals']['orders'] - single['cancelled'])
+
+
+class RateLimitTest(TestCase):
+    """Requests are charged by query cost and refused with a 429 past the limits."""
+
+    def setUp(self):
+        ratelimit.reset()
+        self.addCleanup(ratelimit.reset)
+
+    def post(self, query, **headers):
+        return self.client.post('/graphql', {'query': query}, content_type='application/json', **headers)
+
+    def test_cost_grows_with_list_sizes(self):
+        single = ratelimit.query_cost('{ product(id: 1) { name price } }')
+        page = ratelimit.query_cost('{ search(query: "a", first: 5) { __typename } }')
+        nested = ratelimit.query_cost('{ allCustomers { name orders { id product { name } } } }')
+
+        self.assertEqual(single, 3)
+        self.assertGreater(nested, 20 * 20)
+        self.assertLess(page, nested)
+
+    def test_unbounded_lists_and_clamped_sizes(self):
+        # allOrders returns the whole table: priced as 250 rows, not list_size
+        everything = ratelimit.query_cost('{ allOrders { id totalAmount customer { id } product { id name } } }')
+        self.assertEqual(everything, 1 + 250 * 7)
+
+        # The resolver returns at most 1000 reminders, whatever first asks for
+        reminders = '{ pendingOrderReminders(first: 5000) { id } }'
+        self.assertEqual(ratelimit.query_cost(reminders), 1001)
+        self.assertEqual(
+            ratelimit.query_cost('query($n: Int) { search(query: "a", first: $n) { __typename } }', {'n': 500}),
+            10 + 100,
+        )
+        self.assertEqual(self.post(reminders).status_code, 200)
+
+    def test_nested_fragments_are_costed_once(self):
+        # Each fragment spreads the next one twice: 2**30 fields if walked naively
+        fragments = ''.join(
+            f'fragment F{i} on Query {{ __typename ...F{i + 1} ...F{i + 1} }} ' for i in range(30)
+        )
+        query = '{ ...F0 } ' + fragments + 'fragment F30 on Query { __typename }'
+
+        started = time.perf_counter()
+        self.assertEqual(ratelimit.query_cost(query), 2 ** 31 - 1)
+        self.assertLess(time.perf_counter() - started, 1)
+        self.assertEqual(self.post(query).status_code, 429)
+
+    def test_too_deep_or_too_large_queries_are_refused(self):
+        deep = '{ allCustomers { ' + 'orders { customer { ' * 10 + 'id' + ' } }' * 10 + ' } }'
+        with self.assertRaises(ratelimit.QueryTooComplex):
+            ratelimit.query_cost(deep)
+        response = self.post(deep)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['extensions']['code'], 'QUERY_TOO_COMPLEX')
+
+        wide = '{ ' + ' '.join(f'p{i}: product(id: 1) {{ name }}' for i in range(3000)) + ' }'
+        with self.assertRaises(ratelimit.QueryTooComplex):
+            ratelimit.query_cost(wide)
+
+    @override_settings(CRM_RATE_LIMIT={'rate': 1.0, 'burst': 10})
+    def test_bucket_exhaustion_returns_429(self):
+        query = '{ product(id: 1) { name price } }'
+        responses = [self.post(query) for _ in range(4)]
+
+        self.assertEqual([response.status_code for response in responses], [200, 200, 200, 429])
+        self.assertEqual(responses[0]['X-RateLimit-Cost'], '3')
+        self.assertEqual(responses[3]['Retry-After'], '2')
+        self.assertEqual(responses[3].json()['errors'][0]['extensions']['reason'], 'rate')
+        # Other clients have their own bucket
+        self.assertEqual(self.post(query, HTTP_X_API_KEY='other').status_code, 200)
+
+    @override_settings(CRM_RATE_LIMIT={'concurrency': 1, 'max_in_flight': 2})
+    def test_concurrency_and_shedding(self):
+        store = ratelimit.get_store()
+        self.assertIsNone(store.acquire('ip:127.0.0.1', 1, 2))
+
+        response = self.post('{ __typename }')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()['errors'][0]['extensions']['reason'], 'concurrency')
+
+        self.assertIsNone(store.acquire('key:other', 1, 2))
+        response = self.post('{ __typename }', HTTP_X_API_KEY='third')
+        self.assertEqual(response.json()['errors'][0]['extensions']['reason'], 'overloaded')
+
+        store.release('ip:127.0.0.1')
+        store.release('key:other')
+        self.assertEqual(self.post('{ __typename }').status_code, 200)
+
+
+# Two whole allOrders tables cost more than one client's burst
+@override_settings(CRM_RATE_LIMIT={'enabled': False})
+class BatchedRequestTest(TestCase):
+    """A JSON array of operations runs in one request, sharing the request's loaders."""
+
+    orders_query = '{ allOrders { id customer { id user { email } } product { name stock } } }'
+
+    def setUp(self):
+        ratelimit.reset()
+        datasets.seed('small')
+
+    def post(self, operations):
+        return self.client.post('/graphql', operations, content_type='application/json')
+
+    def test_results_in_order_with_shared_loaders(self):
+        single = self.post({'query': self.orders_query}).json()
+
+        # Hot and archived orders, then one query each for the nested
+        # customers, users and products; the third operation only reads the
+        # orders again and finds everything else in the request's loaders
+        with self.assertNumQueries(5 + 1 + 2):
+            response = self.post([
+                {'query': self.orders_query},
+                {'query': '{ allCustomers { id } }'},
+                {'query': self.orders_query},
+            ])
+        results = response.json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['data'] for result in results[::2]], [single['data']] * 2)
+        self.assertEqual(len(results[1]['data']['allCustomers']), Customer.objects.count())
+
+    def test_mutation_clears_loaders(self):
+        order = Order.objects.order_by('pk').first()
+        query = f'{{ order(id: {order.pk}) {{ product {{ stock }} }} }}'
+        mutation = (
+            f'mutation {{ createOrder(customerId: {order.customer_id}, productId: {order.product_id}, '
+            'quantity: 1) { success } }'
+        )
+        Product.objects.filter(pk=order.product_id).update(stock=10)
+
+        results = self.post([{'query': query}, {'query': mutation}, {'query': query}]).json()
+
+        self.assertTrue(results[1]['data']['createOrder']['success'])
+        self.assertEqual(
+            [results[0]['data']['order']['product']['stock'], results[2]['data']['order']['product']['stock']],
+            [10, 9],
+        )
+
+    def test_batch_size_limit(self):
+        with override_settings(CRM_GRAPHQL_BATCH={'max_operations': 2}):
+            response = self.post([{'query': '{ name }'}] * 3)
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CRM_RATE_LIMIT={'enabled': False})
+class ParallelBatchTest(TransactionTestCase):
+    """Queries-only batches give the same results on the thread pool (which needs committed data)."""
+
+    def test_parallel_reads_match_sequential(self):
+        datasets.seed('small')
+        operations = [
+            {'query': '{ allOrders { id customer { user { email } } product { name } } }'},
+            {'query': '{ allProducts { name orders { id } } }'},
+        ] * 2
+
+        sequential = self.client.post('/graphql', operations, content_type='application/json').json()
+        with override_settings(CRM_GRAPHQL_BATCH={'parallel_reads': True}):
+            parallel = self.client.post('/graphql', operations, content_type='application/json').json()
+
+        self.assertNotIn('errors', parallel[0])
+        self.assertEqual(parallel, sequential)
+
+
+@override_settings(CRM_RATE_LIMIT={'enabled': False})
+class GraphQLClientTest(TestCase):
+    """graphql_client.execute_batch sends gql's batched requests and returns their data in order."""
+
+    url = 'http://testserver/graphql'
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='crm_gql_test_')
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(CRM_GRAPHQL_CLIENT={'schema_cache': f'{directory}/schema.json'})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # Queries are validated against the cached schema, without an introspection request
+        graphql_client.save_introspection(self.url, schema.introspect())
+        self.product = Product.objects.create(name='Stapler', price=Decimal('12.00'), stock=3)
+
+    def test_execute_batch_sends_one_request(self):
+        from gql.transport.requests import RequestsHTTPTransport
+        from graphql import ExecutionResult
+
+        payloads = []
+
+        def post(transport, requests, **kwargs):
+            # The HTTP round trip, through the test client
+            payloads.append([request.payload for request in requests])
+            response = self.client.post('/graphql', payloads[-1], content_type='application/json')
+            return [ExecutionResult(data=result['data']) for result in response.json()]
+
+        with mock.patch.object(RequestsHTTPTransport, 'execute_batch', autospec=True, side_effect=post):
+            results = graphql_client.execute_batch([
+                '{ name }',
+                ('query($id: ID!) { product(id: $id) { name stock } }', {'id': self.product.pk}),
+            ], url=self.url)
+
+        self.assertEqual(results, [{'name': 'Hello, GraphQL!'}, {'product': {'name': 'Stapler', 'stock': 3}}])
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual(payloads[0][1]['variables'], {'id': self.product.pk})
+
+
+class OrderStatusTest(TestCase):
+    """Status changes follow the state machine, restore stock on cancellation and are logged."""
+
+    def setUp(self):
+        ratelimit.reset()
+        user = User.objects.create_user(username='status_test', email='status@example.com')
+        customer = Customer.objects.create(user=user)
+        self.product = Product.objects.create(name='Lamp', price=Decimal('20.00'), stock=0)
+        self.orders = [
+            Order.objects.create(customer=customer, product=self.product, quantity=quantity,
+                                 total_amount=Decimal('20.00') * quantity, status=status)
+            for quantity, status in [(2, 'pending'), (3, 'processing'), (1, 'shipped'), (4, 'pending')]
+        ]
+
+    def test_transitions_in_chunks(self):
+        ids = [order.pk for order in self.orders] + [999999]
+        before = Order.objects.get(pk=self.orders[0].pk).updated_at
+
+        result = order_status.transition_orders('cancelled', ids=ids, chunk_size=2)
+
+        self.assertEqual(result, {'updated': 3, 'skipped': 1, 'missing': 1, 'restored_units': 9})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 9)
+        self.assertEqual(Order.objects.filter(status='cancelled').count(), 3)
+        self.assertGreater(Order.objects.get(pk=self.orders[0].pk).updated_at, before)
+        self.assertEqual(
+            sorted(OrderEvent.objects.values_list('order_id', 'from_status', 'to_status')),
+            sorted((order.pk, order_status.STATUS_CODES[order.status], order_status.STATUS_CODES['cancelled'])
+                   for order in self.orders if order.status != 'shipped'),
+        )
+        # Cancelled orders can't move again, so their stock is never restored twice
+        self.assertEqual(order_status.transition_orders('cancelled', ids=ids)['updated'], 0)
+
+    def test_events_are_append_only(self):
+        order_status.transition_orders('processing', ids=[self.orders[0].pk])
+        event = OrderEvent.objects.get()
+        with self.assertRaises(ValueError):
+            event.save()
+        # The SQLite trigger also refuses queryset updates
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderEvent.objects.update(to_status=0)
+
+    def test_bulk_mutation_with_filter(self):
+        response = self.client.post('/graphql', {'query': """
+            mutation {
+                bulkUpdateOrderStatus(to: "processing", filter: {status: "pending"}) {
+                    success updated skipped restoredUnits
+                }
+            }
+        """}, content_type='application/json').json()
+        self.assertEqual(
+            response['data']['bulkUpdateOrderStatus'],
+            {'success': True, 'updated': 2, 'skipped': 0, 'restoredUnits': 0},
+        )
+
+        events = schema.execute(f'{{ orderEvents(orderId: {self.orders[3].pk}) {{ fromStatus toStatus }} }}')
+        self.assertEqual(events.data['orderEvents'], [{'fromStatus': 'pending', 'toStatus': 'processing'}])
+
+        invalid = schema.execute('mutation { bulkUpdateOrderStatus(to: "lost", ids: [1]) { success } }')
+        self.assertIn("Unknown status", invalid.errors[0].message)
+
+
+@override_settings(CRM_ORDER_STATUS={'chunk_size': 2})
+class OrderStatusTransactionTest(TransactionTestCase):
+    """bulkUpdateOrderStatus commits each chunk, other mutations run in one transaction."""
+
+    def test_chunks_commit_between_reads(self):
+        ratelimit.reset()
+        customer = Customer.objects.create(user=User.objects.create_user(username='chunks', email='chunks@example.com'))
+        product = Product.objects.create(name='Bulb', price=Decimal('2.00'), stock=0)
+        Order.objects.bulk_create([
+            Order(customer=customer, product=product, total_amount=Decimal('2.00')) for _ in range(5)
+        ])
+        chunks = order_status.chunks
+        between = []
+
+        def recording_chunks(*args):
+            for read in chunks(*args):
+                # Runs after the previous chunk's block exited
+                between.append(connection.in_atomic_block)
+                yield read
+
+        with mock.patch.object(order_status, 'chunks', recording_chunks):
+            response = self.client.post('/graphql', {
+                'query': 'mutation { bulkUpdateOrderStatus(to: "processing", filter: {status: "pending"}) { updated } }',
+            }, content_type='application/json').json()
+
+        self.assertEqual(response['data']['bulkUpdateOrderStatus']['updated'], 5)
+        self.assertEqual(between, [False, False, False])
+
+    def test_atomic_mutations(self):
+        self.assertTrue(views.is_atomic_mutation('mutation { createOrder(customerId: 1, productId: 1) { success } }'))
+        self.assertFalse(views.is_atomic_mutation('mutation { bulkUpdateOrderStatus(to: "shipped", ids: [1]) { success } }'))
+        self.assertTrue(views.is_atomic_mutation(
+            'mutation { a: bulkUpdateOrderStatus(to: "shipped", ids: [1]) { success } b: createOrder(customerId: 1, productId: 1) { success } }'
+        ))
+        self.assertFalse(views.is_atomic_mutation('{ allProducts { id } }'))
+
+
+class BatchingTest(SimpleTestCase):
+    """Many events schedule one flush, which hands them to the handler in order."""
+
+    def setUp(self):
+        self.handler = mock.Mock()
+        self.batch = batching.Batch('batching_test', self.handler)
+        cache.delete_many([self.batch.key(suffix) for suffix in ('seq', 'done', 'scheduled', 'lock')])
+
+    @override_settings(CRM_BATCHES={'batching_test': {'max_size': 3}})
+    def test_events_are_coalesced(self):
+        with mock.patch.object(batching.Batch, 'schedule') as schedule:
+            for n in range(5):
+                self.batch.add({'product_id': n})
+            schedule.assert_called_once_with(1.0)
+
+            self.assertEqual(self.batch.flush(), 3)
+            self.handler.assert_called_once_with([{'product_id': n} for n in range(3)])
+            # The batch was full, so the rest is flushed right away
+            schedule.assert_called_with(0)
+
+            self.assertEqual(self.batch.flush(), 2)
+            self.assertEqual(self.handler.call_args[0][0], [{'product_id': 3}, {'product_id': 4}])
+            self.assertEqual(self.batch.flush(), 0)
+            self.assertEqual(schedule.call_count, 2)
+
+    def test_flush_waits_for_events_still_being_written(self):
+        with mock.patch.object(batching.Batch, 'schedule'):
+            self.batch.add({'product_id': 0})
+            # A producer has taken the next number but not written its event
+            slow = cache.incr(self.batch.key('seq'))
+            self.batch.add({'product_id': 2})
+
+            self.assertEqual(self.batch.flush(), 1)
+            cache.set(self.batch.key(slow), {'product_id': 1})
+            self.assertEqual(self.batch.flush(), 2)
+            self.assertEqual(self.handler.call_args[0][0], [{'product_id': 1}, {'product_id': 2}])
+
+            # A number still missing after the ttl is skipped as expired
+            cache.incr(self.batch.key('seq'))
+            self.batch.add({'product_id': 4})
+            self.assertEqual(self.batch.flush(), 0)
+            with mock.patch('crm.batching.time') as clock:
+                clock.time.return_value = time.time() + 25 * 3600
+                self.assertEqual(self.batch.flush(), 1)
+            self.assertEqual(self.handler.call_args[0][0], [{'product_id': 4}])
+
+
+class HealthTest(SimpleTestCase):
+    """/readyz reports probe results, cached for a ttl, and the heartbeat alerts on slow readiness."""
+
+    def setUp(self):
+        self.probes = {name: mock.Mock(name=name) for name in health.PROBES}
+        patcher = mock.patch.dict(health.PROBES, self.probes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        health._results.clear()
+        self.addCleanup(health._results.clear)
+
+    def test_probe_results_are_cached(self):
+        health.readiness()
+        health.readiness()
+        self.assertEqual(self.probes['database'].call_count, 1)
+
+        health.readiness(fresh=True)
+        self.assertEqual(self.probes['database'].call_count, 2)
+        with override_settings(CRM_HEALTH={'ttl': 0}):
+            health.readiness()
+        self.assertEqual(self.probes['database'].call_count, 3)
+
+    def test_status_codes(self):
+        self.assertEqual(self.client.get('/healthz').json(), {'status': 'ok'})
+        response = self.client.get('/readyz')
+        self.assertEqual((response.status_code, response.json()['status']), (200, 'ok'))
+
+        # The broker is optional: its failure degrades the service
+        self.probes['broker'].side_effect = ConnectionError("broker down")
+        response = self.client.get('/readyz?fresh=1')
+        self.assertEqual((response.status_code, response.json()['status']), (200, 'degraded'))
+        self.assertEqual(response.json()['checks']['broker']['error'], "ConnectionError: broker down")
+
+        self.probes['database'].side_effect = RuntimeError("database locked")
+        response = self.client.get('/readyz?fresh=1')
+        self.assertEqual((response.status_code, response.json()['status']), (503, 'unavailable'))
+        self.assertEqual(self.probes['database'].call_count, 3)
+
+    def test_heartbeat_alerts_on_latency_above_trend(self):
+        directory = tempfile.mkdtemp(prefix='crm_heartbeat_test_')
+        self.addCleanup(shutil.rmtree, directory)
+        history_file = f'{directory}/history.json'
+        with open(history_file, 'w') as f:
+            json.dump([1.0] * 12, f)
+
+        def slow_readyz(url, timeout):
+            time.sleep(0.02)
+            return mock.Mock(status_code=200, json=mock.Mock(return_value={'status': 'ok', 'checks': {}}))
+
+        run = mock.Mock()
+        config = {
+            'url': 'http://crm/readyz', 'timeout': 1.0,
+            'history_file': history_file, 'history_size': 288, 'alert_factor': 3.0,
+        }
+        with override_settings(CRM_HEARTBEAT=config), mock.patch('requests.get', side_effect=slow_readyz), \
+                mock.patch('crm.cron.job_run') as job_run:
+            job_run.return_value.__enter__.return_value = run
+            cron.log_crm_heartbeat()
+
+        run.warning.assert_called_once()
+        message, alert = run.warning.call_args.args[0], run.warning.call_args.kwargs
+        self.assertEqual(message, "Readiness latency above trend")
+        self.assertEqual((alert['median_ms'], alert['samples']), (1.0, 12))
+        with open(history_file) as f:
+            self.assertEqual(len(json.load(f)), 13)
+        # Too little history: no alert
+        self.assertIsNone(cron.heartbeat_latency_alert([1.0, 50.0], 3.0))
+
+
+class JobLogTest(SimpleTestCase):
+    """crm.joblog writes buffered JSON lines and a summary record per run, and follows rotation."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='crm_joblog_test_')
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def job(self, **config):
+        """A job of its own, logging to the test directory with `config`."""
+        job = f'joblog_test_{uuid.uuid4().hex[:8]}'
+        with override_settings(CRM_JOB_LOG={'directory': self.directory, **config}):
+            handler = joblog.get_handler(job)
+        self.addCleanup(joblog._handlers.pop, job)
+        self.addCleanup(handler.close)
+        if job in joblog._listeners:
+            self.addCleanup(lambda: joblog._listeners.pop(job).stop())
+        return job
+
+    def records(self, job, suffix=''):
+        with open(f'{self.directory}/{job}_log.txt{suffix}') as f:
+            return [json.loads(line) for line in f]
+
+    def test_records_and_summary(self):
+        job = self.job()
+        with joblog.job_run(job) as run:
+            run.info("Processed", product_id=7)
+            run.count('products', 2)
+
+        processed, summary = self.records(job)
+        self.assertEqual(
+            {key: processed[key] for key in ('level', 'job', 'run_id', 'message', 'product_id')},
+            {'level': 'INFO', 'job': job, 'run_id': run.run_id, 'message': "Processed", 'product_id': 7},
+        )
+        self.assertEqual((summary['message'], summary['status'], summary['counts']), ("Run finished", 'ok', {'products': 2}))
+        self.assertIn('duration_ms', summary)
+
+    def test_failures_and_exits(self):
+        job = self.job()
+        with self.assertRaises(ValueError), joblog.job_run(job):
+            raise ValueError("bad row")
+        for code in (0, 2):
+            with self.assertRaises(SystemExit), joblog.job_run(job):
+                sys.exit(code)
+
+        failed, clean_exit, error_exit = self.records(job)
+        self.assertEqual((failed['level'], failed['message'], failed['status']), ('ERROR', "Run failed", 'error'))
+        self.assertIn("ValueError: bad row", failed['error'])
+        self.assertEqual((clean_exit['level'], clean_exit['status'], clean_exit['exit_code']), ('INFO', 'ok', 0))
+        self.assertEqual((error_exit['level'], error_exit['status'], error_exit['exit_code']), ('ERROR', 'error', 2))
+
+    def test_buffering_and_rotation(self):
+        job = self.job(flush_interval=60)
+        path = f'{self.directory}/{job}_log.txt'
+        run = joblog.job_run(job)
+        run.info("Buffered")
+        self.assertFalse(os.path.exists(path))
+        # Errors are written right away
+        run.error("Failed")
+        self.assertEqual([record['message'] for record in self.records(job)], ["Buffered", "Failed"])
+
+        # logrotate moves the file away: the next flush starts a new one
+        os.rename(path, f'{path}.1')
+        run.info("After rotation")
+        joblog.flush(job)
+        self.assertEqual([record['message'] for record in self.records(job)], ["After rotation"])
+        self.assertEqual(len(self.records(job, '.1')), 2)
+
+    def test_processes_sharing_a_file(self):
+        path = f'{self.directory}/shared_log.txt'
+        # A handler of its own for each prefork worker
+        handlers = [
+            joblog.BufferedWatchedFileHandler(path, buffer_size=64 * 1024, flush_interval=60) for _ in range(4)
+        ]
+
+        def write(handler, message, count):
+            handler.setFormatter(joblog.JsonLinesFormatter())
+            for i in range(count):
+                handler.handle(logging.makeLogRecord({
+                    'msg': message, 'levelno': logging.INFO, 'levelname': 'INFO', 'data': {'i': i},
+                }))
+            handler.flush()
+
+        def read(path):
+            with open(path) as f:
+                return [json.loads(line) for line in f]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(write, handlers, ['x' * 5000] * 4, [200] * 4))
+        self.assertEqual(len(read(path)), 800)
+
+        # After logrotate moved the file, every worker writes to the new one
+        os.rename(path, f'{path}.1')
+        for handler in handlers:
+            write(handler, "After rotation", 1)
+            handler.close()
+        self.assertEqual([record['message'] for record in read(path)], ["After rotation"] * 4)
+        self.assertEqual(len(read(f'{path}.1')), 800)
+
+    def test_queue_mode_writes_everything_by_the_end_of_the_run(self):
+        job = self.job(queue=True, flush_interval=60)
+        with joblog.job_run(job) as run:
+            for n in range(200):
+                run.info("Queued", n=n)
+            try:
+                raise KeyError('sku')
+            except KeyError:
+                run.log(logging.WARNING, "Skipped", exc_info=True)
+
+        records = self.records(job)
+        self.assertEqual(len(records), 202)
+        self.assertIn("KeyError: 'sku'", records[200]['error'])
+        self.assertEqual(records[-1]['status'], 'ok')
+
+
+class JobLockTest(SimpleTestCase):
+    """Periodic jobs skip while a previous run holds their lock, and runs are recorded."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix='crm_locks_test_')
+        self.addCleanup(shutil.rmtree, directory)
+        # Nothing listens on port 1, so Redis locks fall back to lock files
+        settings = override_settings(CRM_JOB_LOCKS={'redis_url': 'redis://localhost:1/0', 'directory': directory})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_overlapping_runs_are_skipped(self):
+        from crm.tasks import update_low_stock
+
+        lock = locks.acquire('update_low_stock')
+        self.assertIsNone(locks.acquire('update_low_stock'))
+        with mock.patch('crm.low_stock.reconcile') as job:
+            self.assertEqual(update_low_stock(), 'skipped')
+            job.assert_not_called()
+            lock.release()
+            update_low_stock()
+            job.assert_called_once_with()
+
+        runs = locks.job_runs('update_low_stock')
+        self.assertEqual((runs['runs'], runs['skipped'], runs['last_status']), (1, 1, 'ok'))
+        self.assertIn('last_duration_ms', runs)
+
+    def test_beat_tasks_are_exclusive(self):
+        for name in ('archive_old_orders', 'prune_idempotency_keys', 'generate_weekly_report'):
+            lock = locks.acquire(name)
+            self.assertEqual(getattr(tasks, name)(), 'skipped')
+            lock.release()
+
+    def test_failed_runs_release_the_lock(self):
+        with self.assertRaises(RuntimeError):
+            locks.run_exclusive('failing_job', sys.exit, 1)
+        self.assertEqual(locks.job_runs('failing_job')['last_status'], 'failed')
+        self.assertEqual(locks.run_exclusive('failing_job', lambda: 42), ('ok', 42))
+
+
+class CustomerCleanupTest(TestCase):
+    """clean_inactive_customers keeps customers whose recent orders were archived."""
+
+    def setUp(self):
+        product = Product.objects.create(name='Lamp', price=Decimal('15.00'), stock=10)
+        self.customers = {}
+        for name, days in (('active', 10), ('archived', 100), ('inactive', 500)):
+            user = User.objects.create_user(username=f'cleanup_{name}', email=f'{name}@cleanup.example')
+            customer = self.customers[name] = Customer.objects.create(user=user)
+            order = Order.objects.create(customer=customer, product=product, total_amount=Decimal('15.00'))
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days))
+
+    @override_settings(CRM_ORDER_ARCHIVE={'age_days': 30})
+    def test_archived_orders_count_as_activity(self):
+        archive.archive_orders()
+        self.assertEqual(ArchivedOrder.objects.count(), 2)
+
+        cron.clean_inactive_customers(days=365)
+
+        self.assertEqual(
+            set(Customer.objects.values_list('user__username', flat=True)),
+            {'cleanup_active', 'cleanup_archived'},
+        )
+        self.assertEqual(ArchivedOrder.objects.get().customer, self.customers['archived'])
+
+
+@override_settings(CRM_LOW_STOCK={'restock_increment': None})
+class LowStockTest(TestCase):
+    """Products enter and leave the low-stock set as their stock crosses the threshold."""
+
+    def setUp(self):
+        batch = low_stock.stock_changes
+        cache.delete_many([batch.key(suffix) for suffix in ('seq', 'done', 'scheduled', 'lock')])
+        schedule = mock.patch.object(batching.Batch, 'schedule')
+        self.schedule = schedule.start()
+        self.addCleanup(schedule.stop)
+        user = User.objects.create_user(username='low_stock_test', email='low@example.com')
+        self.customer = Customer.objects.create(user=user)
+        self.product = Product.objects.create(name='Mug', price=Decimal('8.00'), stock=6, low_stock_threshold=5)
+        self.other = Product.objects.create(name='Plate', price=Decimal('9.00'), stock=50)
+
+    def order(self, product, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            result = schema.execute(
+                'mutation($c: ID!, $p: ID!, $q: Int!) { createOrder(customerId: $c, productId: $p, quantity: $q) { success } }',
+                variable_values={'c': self.customer.pk, 'p': product.pk, 'q': quantity},
+            )
+        self.assertTrue(result.data['createOrder']['success'])
+
+    def test_crossing_the_threshold(self):
+        self.order(self.product, 1)
+        self.order(self.other, 1)
+        # Neither crossed its threshold: no event
+        self.schedule.assert_not_called()
+
+        self.order(self.product, 2)
+        self.schedule.assert_called_once()
+        self.assertEqual(low_stock.stock_changes.flush(), 1)
+        self.assertEqual(list(LowStockProduct.objects.values_list('product_id', flat=True)), [self.product.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            schema.execute('mutation { updateLowStockProducts(threshold: 5, increment: 10) { success } }')
+        self.assertEqual(low_stock.stock_changes.flush(), 1)
+        self.assertFalse(LowStockProduct.objects.exists())
+
+    def test_reconcile_catches_missed_changes(self):
+        # A queryset update emits no event
+        Product.objects.filter(pk=self.other.pk).update(stock=0)
+        self.assertEqual(low_stock.reconcile(), 1)
+        self.assertEqual(list(LowStockProduct.objects.values_list('product_id', flat=True)), [self.other.pk])
+        self.assertEqual(low_stock.reconcile(), 0)
+
+
+
+class MoneyTest(TestCase):
+    """Amounts are stored as cents, summed by the database and never pass through a float."""
+
+    def setUp(self):
+        user = User.objects.create_user(username='money_test', email='money@example.com')
+        self.customer = Customer.objects.create(user=user)
+
+    def test_prices_and_totals_are_exact(self):
+        created = schema.execute(
+            'mutation($price: Money!) { a: createProduct(name: "Pen", price: 0.10, stock: 100) { product { id price } } '
+            'b: createProduct(name: "Ink", price: $price, stock: 100) { product { id price } } }',
+            variable_values={'price': 0.2},
+        )
+        self.assertIsNone(created.errors)
+        self.assertEqual(created.data['a']['product']['price'], '0.10')
+        self.assertEqual(created.data['b']['product']['price'], '0.20')
+        self.assertEqual(list(Product.objects.order_by('pk').values_list(money.cents('price'), flat=True)), [10, 20])
+
+        for product in ('a', 'b'):
+            for _ in range(5):
+                schema.execute(
+                    'mutation($c: ID!, $p: ID!) { createOrder(customerId: $c, productId: $p, quantity: 3) { success } }',
+                    variable_values={'c': self.customer.pk, 'p': created.data[product]['product']['id']},
+                )
+        # 0.1 + 0.2 summed as floats would be 0.30000000000000004
+        totals = schema.execute('{ orderTotals { orders revenue } }').data['orderTotals']
+        self.assertEqual(totals, {'orders': 10, 'revenue': '4.50'})
+        self.assertEqual(Order.objects.aggregate(total=Sum('total_amount'))['total'], Decimal('4.50'))
+
+        with mock.patch('crm.graphql_client.execute_batch', side_effect=lambda queries: [
+            schema.execute(query).data for query in queries
+        ]):
+            report = tasks.generate_crm_report.run.__wrapped__()
+        self.assertEqual(report['formatted_revenue'], '$4.50')
+
+    def test_amounts_are_rounded_to_cents(self):
+        self.assertEqual(money.to_cents('19.995'), 2000)
+        self.assertEqual(money.to_cents(19.99), 1999)
+        self.assertEqual(str(money.from_cents(5)), '0.05')
+        with self.assertRaises(ValueError):
+            money.to_cents('NaN')
+
+    def test_out_of_range_amounts_are_rejected(self):
+        self.assertEqual(money.to_cents('92233720368547758.07'), 2 ** 63 - 1)
+        for amount in ('1e30', '92233720368547758.08', '-92233720368547758.09'):
+            with self.assertRaisesMessage(ValueError, "Amount out of range"):
+                money.to_cents(amount)
+
+        result = schema.execute('mutation { createProduct(name: "Yacht", price: "1e30", stock: 1) { success } }')
+        self.assertEqual(len(result.errors), 1)
+        self.assertNotIn('InvalidOperation', result.errors[0].message)
+        self.assertFalse(Product.objects.filter(name='Yacht').exists())
+        invalid = schema.execute('mutation { createProduct(name: "Bad", price: "ten") { success } }')
+        self.assertTrue(invalid.errors)
+
+
+@override_settings(CRM_RATE_LIMIT={'enabled': False}, CRM_GRAPHQL_RESPONSES={'min_size': 100})
+class ResponseEncodingTest(TestCase):
+    """/graphql responses are encoded by crm.encoders and gzipped when large and accepted."""
+
+    def setUp(self):
+        product = Product.objects.create(name='Lamp', price=Decimal('20.00'), stock=100)
+        for n in range(20):
+            Product.objects.create(name=f'Bulb {n}', price=Decimal('1.50'), stock=n)
+        self.query = {'query': '{ allProducts { id name price stock } }'}
+        self.product = product
+
+    def test_encoders_agree(self):
+        data = {'price': Decimal('19.99'), 'at': timezone.now(), 'name': 'Lámpara', 'items': [1, 2.5, None, True]}
+        stdlib = encoders.get_encoder('stdlib').encode(data)
+        self.assertEqual(json.loads(stdlib)['price'], '19.99')
+        if encoders.HAS_ORJSON:
+            self.assertEqual(encoders.get_encoder('orjson').encode(data), stdlib)
+
+    def test_large_responses_are_gzipped(self):
+        plain = self.client.post('/graphql', self.query, content_type='application/json')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        compressed = self.client.post('/graphql', self.query, content_type='application/json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertTrue(compressed.streaming)
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(compressed.streaming_content)), plain.content)
+
+        small = self.client.post(
+            '/graphql', {'query': f'{{ product(id: {self.product.pk}) {{ name }} }}'},
+            content_type='application/json', HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+
+@override_settings(CRM_RFM={'overlap': 0})
+class RFMTest(TestCase):
+    """RFM scores are kept up to date from changed orders and paged by segment."""
+
+    def setUp(self):
+        self.product = Product.objects.create(name='Tea', price=Decimal('10.00'), stock=1000)
+        now = timezone.now()
+        self.customers = []
+        # Customer i: 5 - i orders of $10 * (5 - i), last one i + 1 days ago
+        for i in range(5):
+            user = User.objects.create_user(username=f'rfm_{i}', email=f'rfm_{i}@example.com')
+            customer = Customer.objects.create(user=user)
+            self.customers.append(customer)
+            for _ in range(5 - i):
+                self.order(customer, Decimal('10.00') * (5 - i))
+            at = now - timedelta(days=i + 1)
+            Order.objects.filter(customer=customer).update(created_at=at, updated_at=at)
+        user = User.objects.create_user(username='rfm_cancelled', email='rfm_cancelled@example.com')
+        self.cancelled = Customer.objects.create(user=user)
+        self.order(self.cancelled, Decimal('99.00'), status='cancelled')
+
+    def order(self, customer, amount, status='pending'):
+        return Order.objects.create(customer=customer, product=self.product, total_amount=amount, status=status)
+
+    def segment(self, customer):
+        return CustomerRFM.objects.get(customer=customer).segment
+
+    def test_incremental_refresh_and_rescore(self):
+        self.assertEqual(rfm.refresh(), 5)
+        self.assertFalse(CustomerRFM.objects.filter(customer=self.cancelled).exists())
+        best = CustomerRFM.objects.get(customer=self.customers[0])
+        self.assertEqual((best.recency_score, best.frequency_score, best.monetary_score), (5, 5, 5))
+        self.assertEqual((best.orders, best.revenue), (5, Decimal('250.00')))
+        self.assertEqual(self.segment(self.customers[4]), 'hibernating')
+
+        # Only orders changed since the watermark are read: the new ones
+        for _ in range(10):
+            self.order(self.customers[4], Decimal('10.00'))
+        self.assertEqual(rfm.refresh(), 1)
+        self.assertEqual(CustomerRFM.objects.get(customer=self.customers[4]).orders, 11)
+        self.assertEqual(self.segment(self.customers[4]), 'champions')
+
+        # New boundaries: $110 is now the middle revenue
+        segments = rfm.rescore()
+        self.assertEqual(sum(segments.values()), 5)
+        self.assertEqual(self.segment(self.customers[4]), 'loyal')
+
+    def test_customers_by_segment_pages(self):
+        rfm.refresh()
+        query = '''query($after: ID) {
+            customersBySegment(segment: "champions", first: 1, afterId: $after) {
+                segment recencyScore revenue customer { id user { username } }
+            }
+        }'''
+        pages = []
+        after = None
+        while True:
+            rows = schema.execute(query, variable_values={'after': after}).data['customersBySegment']
+            if not rows:
+                break
+            pages.append(rows)
+            after = rows[-1]['customer']['id']
+        self.assertEqual([page[0]['customer']['user']['username'] for page in pages], ['rfm_0', 'rfm_1'])
+        self.assertEqual(pages[0][0]['revenue'], '250.00')
+
+        invalid = schema.execute('{ customersBySegment(segment: "whales") { segment } }')
+        self.assertIn('segment must be one of', invalid.errors[0].message)
@@ -1,3 +1,179 @@
-from django.shortcuts import render
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 
-# Create your views here.
+from django.conf import settings
+from django.db import connections, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.views import GraphQLView as BaseGraphQLView, HttpError
+from graphql import ExecutionResult, FieldNode, OperationType, parse
+from graphql.utilities import get_operation_ast
+
+from crm import encoders, health
+from crm.loaders import get_loaders
+from crm.ratelimit import parse_cached
+
+DEFAULTS = {
+    # Operations accepted in one batched request
+    'max_operations': 20,
+    # Run batches made only of queries on a thread pool of `workers`
+    'parallel_reads': False,
+    'workers': 4,
+}
+
+# Mutations left out of the per-mutation transaction (CRM_ATOMIC_MUTATIONS)
+# because they commit in chunks themselves, releasing the write lock
+# between chunks (crm/order_status.py)
+NON_ATOMIC_MUTATIONS = {'bulkUpdateOrderStatus'}
+
+# Liveness answer, built once so the fast path does no work per request
+HEALTHZ_BODY = b'{"status": "ok"}'
+
+
+@never_cache
+@require_GET
+def healthz(request):
+    """Liveness: the process is up and serving requests. Touches no dependency."""
+    return HttpResponse(HEALTHZ_BODY, content_type='application/json')
+
+
+@never_cache
+@require_GET
+def readyz(request):
+    """
+    Readiness: database, cache, broker and GraphQL schema probes.
+    Probe results are cached briefly; pass ?fresh=1 to re-run them.
+    Responds 503 when a required dependency is down.
+    """
+    status, checks = health.readiness(fresh=request.GET.get('fresh') == '1')
+    return JsonResponse(
+        {'status': status, 'checks': checks},
+        status=503 if status == 'unavailable' else 200,
+    )
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_GRAPHQL_BATCH', {})}
+
+
+def is_query(entry):
+    """Whether a batch entry is a query (not a mutation, nor unparsable)."""
+    try:
+        operation = get_operation_ast(parse(entry.get('query') or ''), entry.get('operationName'))
+    except Exception:
+        return False
+    return operation is not None and operation.operation == OperationType.QUERY
+
+
+def is_atomic_mutation(query, operation_name=None):
+    """Whether the operation is a mutation to run in one transaction."""
+    if not getattr(settings, 'CRM_ATOMIC_MUTATIONS', True):
+        return False
+    try:
+        operation = get_operation_ast(parse_cached(query), operation_name)
+    except Exception:
+        return False
+    if operation is None or operation.operation != OperationType.MUTATION:
+        return False
+    fields = {node.name.value for node in operation.selection_set.selections if isinstance(node, FieldNode)}
+    # Fields of other mutations in the same operation keep the transaction
+    return not fields or not fields <= NON_ATOMIC_MUTATIONS
+
+
+class GraphQLView(BaseGraphQLView):
+    """
+    graphene-django's view, answering introspection-only queries (GraphiQL,
+    gql clients fetching the schema) from crm.schema's per-process cache
+    instead of walking the schema on every request.
+
+    A JSON array of operations is executed as a batch and answered with an
+    array of results, in order. The operations share the request, and with
+    it the request's loaders (crm/loaders.py) and database connection.
+
+    Responses are encoded and compressed by crm/encoders.py.
+
+    Each mutation runs in a transaction, as graphene-django's
+    ATOMIC_MUTATIONS would, except those in NON_ATOMIC_MUTATIONS.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        return encoders.compress(request, self.get_http_response(request, *args, **kwargs))
+
+    def get_http_response(self, request, *args, **kwargs):
+        self.batch = (
+            request.method == 'POST'
+            and self.get_content_type(request) == 'application/json'
+            and request.body.lstrip()[:1] == b'['
+        )
+        if not self.batch:
+            return super().dispatch(request, *args, **kwargs)
+
+        try:
+            responses = self.get_batch_responses(request, self.parse_body(request))
+        except HttpError as e:
+            response = e.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(request, {'errors': [self.format_error(e)]})
+            return response
+        return HttpResponse(
+            status=max(status for _, status in responses),
+            content=b'[' + b','.join(result for result, _ in responses) + b']',
+            content_type='application/json',
+        )
+
+    def get_batch_responses(self, request, data):
+        """(JSON, status) of each operation. Queries-only batches may run in parallel."""
+        config = get_config()
+        if len(data) > config['max_operations']:
+            raise HttpError(HttpResponseBadRequest(
+                f"Batches are limited to {config['max_operations']} operations."
+            ))
+        if not all(isinstance(entry, dict) for entry in data):
+            raise HttpError(HttpResponseBadRequest("Every operation of a batch must be a JSON object."))
+
+        # Created up front so that worker threads share them
+        get_loaders(request)
+        workers = min(config['workers'], len(data))
+        if not config['parallel_reads'] or workers < 2 or not all(is_query(entry) for entry in data):
+            # Mutations run in order, each in its own transaction
+            return [self.get_response(request, entry) for entry in data]
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Each operation keeps the request's routing state (crm.routers)
+            futures = [pool.submit(copy_context().run, self.get_read_response, request, entry) for entry in data]
+            return [future.result() for future in futures]
+
+    def get_read_response(self, request, entry):
+        try:
+            return self.get_response(request, entry)
+        finally:
+            # Worker threads open their own database connections
+            connections.close_all()
+
+    def json_encode(self, request, d, pretty=False):
+        pretty = self.pretty or pretty or bool(request.GET.get('pretty'))
+        return encoders.get_encoder().encode(d, pretty=pretty)
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        # Imported here so loading the URLconf doesn't build the schema
+        from crm.schema import get_introspection, is_introspection_query
+
+        if query and not variables and is_introspection_query(query):
+            try:
+                return ExecutionResult(data=get_introspection(query))
+            except Exception:
+                # Let the regular path report the errors
+                pass
+        if not query or not is_atomic_mutation(query, operation_name):
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql,
+            )
+        with transaction.atomic():
+            result = super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql,
+            )
+            if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                transaction.set_rollback(True)
+        return result